@@ -0,0 +1,36 @@
+'''
+The outline + quiz contract shared by the video and transcript analyzers. Kept free of the
+analyzers' cloud and database dependencies so either can be imported (and tested) on its own.
+'''
+import json
+import re
+
+from pydantic import BaseModel, ValidationError
+
+
+class QnA(BaseModel):
+  question: str
+  answer: str
+
+class ResponseStruct(BaseModel):
+  outline: str
+  quiz: list[QnA]
+
+
+def parse_response(llm_res: str):
+  ptrn = re.compile(r"```json(.*?)```", re.DOTALL)
+  match = re.search(ptrn, llm_res)
+  if match:
+    try:
+      res_dict = json.loads(match.group(1))
+      if isinstance(res_dict, dict): ret = ResponseStruct.model_validate(res_dict)
+      elif isinstance(res_dict, list): ret = [ResponseStruct.model_validate(x) for x in res_dict]
+      else: raise Exception(f"Shouldn't have reached here. Expected type of dict or list, but got {type(res_dict)}")
+      return ret.outline, ret.quiz
+
+    except ValidationError as e:
+      print("Pydantic Validation Error:", e)
+      print(llm_res)
+    except Exception as e:
+      print("Error:", e)
+      print(llm_res)
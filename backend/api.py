@@ -1,22 +1,32 @@
 import os
+import asyncio
+import base64
 import copy
+import json
+import traceback
+import uuid
 import requests
 import jwt
 import yaml
-import google.generativeai as genai
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.requests import Request
-from starlette.responses import RedirectResponse, JSONResponse
+from starlette.responses import RedirectResponse, JSONResponse, StreamingResponse, Response
+from datetime import datetime
 from typing import Dict, Optional, List
 from urllib.parse import urlencode
 from pydantic import BaseModel, Field
 
 import db
+import migrations
+import async_db as adb
 import utils
 import structured_llm_output as llm
 import yt_video_recommender
+import embeddings
+from semantic_cache import SemanticCache
+from prompt_registry import registry as prompts
 
 app = FastAPI(root_path='/api/v1')
 
@@ -27,7 +37,36 @@ app.add_middleware(
   allow_methods=["GET", "POST", "OPTIONS"],
   allow_headers=["Content-Type", "Authorization"],
 )
-db.check_and_create_tables()
+migrations.migrate()
+
+# finished analyses never change until a re-analysis lands, which evicts them via LISTEN/NOTIFY
+watch_cache = utils.TTLCache(
+  max_size=int(os.environ.get("WATCH_CACHE_SIZE", 4096)),
+  ttl=float(os.environ.get("WATCH_CACHE_TTL", 60 * 60)),  # backstop; a dropped LISTEN connection clears the cache on reconnect
+)
+analysis_listener = None
+
+LIBRARY_PAGE_SIZE = int(os.environ.get("LIBRARY_PAGE_SIZE", 20))
+LIBRARY_MAX_PAGE_SIZE = 100
+
+def on_analysis_saved(payload: str):
+  watch_cache.pop(payload.rsplit(":", 1)[0])
+
+@app.on_event("startup")
+async def startup():
+  global analysis_listener
+  await adb.open_pool()
+  # notifications sent while the listener was reconnecting are lost, so nothing cached before then can be trusted
+  analysis_listener = await adb.listen(db.ANALYSIS_SAVED_CHANNEL, on_analysis_saved, on_reconnect=watch_cache.clear)
+
+@app.on_event("shutdown")
+async def shutdown():
+  if analysis_listener is not None:
+    analysis_listener.cancel()
+    await asyncio.gather(analysis_listener, return_exceptions=True)
+  await adb.close_pool()
+  await llm.aclose()
+  await yt_video_recommender.aclose()
 
 client_id = os.environ["GOOGLE_CLIENT_ID"]
 client_secret = os.environ["GOOGLE_CLIENT_SECRET"]
@@ -67,9 +106,9 @@ async def auth_google_callback(request: Request):
   user_info_response = requests.get(user_info_url, headers=headers)
   user_info = user_info_response.json()
 
-  if not db.check_user_by_email(user_info['email']):
+  if not await adb.check_user_by_email(user_info['email']):
     # add to db
-    db.create_user(db.User(user_id=user_info['id'], name=user_info['name'], email=user_info['email']))
+    await adb.create_user(db.User(user_id=user_info['id'], name=user_info['name'], email=user_info['email']))
 
   request.session["user"] = {
     "user_id": user_info['id'],
@@ -88,6 +127,26 @@ async def logout(request: Request):
 def get_current_user(request: Request) -> Optional[Dict]:
   return request.session.get("user")
 
+# process internals (pool sizes, cache hit rates, LLM failure rates) are for operators, not every signed-in user
+STATS_ADMIN_EMAILS = {e.strip().lower() for e in os.environ.get("STATS_ADMIN_EMAILS", "").split(",") if e.strip()}
+
+@app.get("/stats")
+async def stats(request: Request):
+  user = get_current_user(request)
+  if not user:
+    raise HTTPException(status_code=401, detail="Unauthorized")
+  if user["email"].lower() not in STATS_ADMIN_EMAILS:
+    raise HTTPException(status_code=403, detail="Forbidden")
+  return {
+    "db_pool": db.pool_stats(),
+    "async_db_pool": adb.pool_stats(),
+    "youtube_search_cache": yt_video_recommender.search_cache.stats(),
+    "keyword_semantic_cache": keyword_cache.stats(),
+    "watch_cache": watch_cache.stats(),
+    "structured_output": llm.stats(),
+    "prompts": prompts.stats(),
+  }
+
 @app.get("/profile")
 async def profile(request: Request):
   user = get_current_user(request)
@@ -114,6 +173,46 @@ class ChatOut(BaseModel):
   reply: Message = Field(..., desc='assistant reply')
   videos: List[Video] = Field(..., desc='video objects')
 
+# near-duplicate conversations reuse the generated query and videos instead of paying for the keyword LLM call
+keyword_cache = SemanticCache(
+  max_size=int(os.environ.get("KEYWORD_CACHE_SIZE", 1024)),
+  ttl=float(os.environ.get("KEYWORD_CACHE_TTL", 24 * 60 * 60)),
+  threshold=float(os.environ.get("KEYWORD_CACHE_THRESHOLD", 0.92)),
+)
+KEYWORD_CACHE_USER_TURNS = 2
+SEARCH_QUERY_COUNT = int(os.environ.get("SEARCH_QUERY_COUNT", 3))
+SEARCH_CONCURRENCY = int(os.environ.get("SEARCH_CONCURRENCY", 4))
+
+class SearchQueries(BaseModel):
+  scratch_pad: str = Field(desc='a scratchpad for you to layout your thoughts, before writing down the queries')
+  queries: list[str] = Field(desc='alternative search queries, 3-8 words each', min_length=1, max_length=SEARCH_QUERY_COUNT)
+
+async def recommend(messages: list[Message], keyword_gen_sys_prompt: str) -> list[VideoIn]:
+  '''
+  - embed the trailing user turns and reuse a cached recommendation for a near-identical conversation
+  - otherwise generate alternative search queries, search for all of them concurrently and fuse the rankings, then cache the result
+  '''
+  user_turns = [m.content for m in messages if m.role.lower() == 'user'][-KEYWORD_CACHE_USER_TURNS:]
+  cache_key = (await embeddings.aembed(['\n'.join(user_turns)]))[0] if user_turns else None
+  cached = keyword_cache.lookup(cache_key) if cache_key is not None else None
+  if cached is not None:
+    return [VideoIn.model_validate(x) for x in cached['videos']]
+
+  res = await llm.arun('gemini-1.5-flash', messages=copy.deepcopy([Message(role='system', content=keyword_gen_sys_prompt),] + messages), response_model=SearchQueries, provider='google', max_retries=3)
+  videos_list = await yt_video_recommender.multi_search(res.queries, max_results=3, concurrency=SEARCH_CONCURRENCY)
+  if cache_key is not None:
+    keyword_cache.add(cache_key, {'queries': res.queries, 'videos': videos_list})
+  return [VideoIn.model_validate(x) for x in videos_list]
+
+def reply_messages(messages: list[Message], videos_list: list[VideoIn], chat_sys_prompt: str) -> list[Message]:
+  '''
+  Conversation for the answer LLM: system prompt + messages, with the recommended videos appended to the last message.
+  '''
+  messages = copy.deepcopy(messages)
+  recommended_yt_videos = yaml.safe_dump([{'title': x.title, 'description': x.description} for x in videos_list])
+  messages[-1].content += f'\n\nRecommended Youtube Videos:\n```yaml\n{recommended_yt_videos}\n```'
+  return [Message(role='system', content=chat_sys_prompt),] + messages
+
 @app.post("/recommend_videos", response_model=ChatOut)
 async def chat(messages: list[Message], request: Request):
   '''
@@ -122,36 +221,190 @@ async def chat(messages: list[Message], request: Request):
   - add title and description at the end of the messages to as context
   - now with the new messages list generate an assistant reply
   '''
-  with open('prompts/recommend_videos_chat.txt', 'r') as f:
-    chat_sys_prompt = f.read()
-  with open('prompts/recommend_videos_keyword_gen.txt', 'r') as f:
-    keyword_gen_sys_prompt = f.read()
+  chat_sys_prompt = prompts.text('recommend_videos_chat')
+  keyword_gen_sys_prompt = prompts.text('recommend_videos_keyword_gen')
 
   user = get_current_user(request)
   if not user:
     raise HTTPException(status_code=401, detail="Unauthorized")
 
-  class SearchQuery(BaseModel):
-    scratch_pad: str = Field(desc='a scratchpad for you to layout your thoughts, before writing down the query')
-    query: str = Field(desc='search query 3-8 words')
-
-  res = llm.run('gemini-1.5-flash', messages=copy.deepcopy([Message(role='system', content=keyword_gen_sys_prompt),] + messages), response_model=SearchQuery, provider='google', max_retries=3)
-  videos_list = await yt_video_recommender.search_youtube_videos(res.query)
-  print(videos_list)
-  videos_list = [VideoIn.model_validate(x) for x in videos_list]
-  recommended_yt_videos = yaml.safe_dump([{'title': x.title, 'description': x.description} for x in videos_list])
-  messages[-1].content += f'\n\nRecommended Youtube Videos:\n```yaml\n{recommended_yt_videos}\n```'
-
-  final_message = [f'{m.role.lower()}:\n{m.content}\n\n---\n' for m in [Message(role='system', content=chat_sys_prompt),]+messages] + ['assitant:',]
-  final_message = ''.join(final_message)
-  model = genai.GenerativeModel(model_name='gemini-1.5-flash')
-  response = model.generate_content([final_message,], request_options={"timeout": 600})
-  llm_res = response.text
+  try:
+    videos_list = await recommend(messages, keyword_gen_sys_prompt)
+  except llm.StructuredOutputError as e:
+    print("Search query generation failed:", e)
+    raise HTTPException(status_code=502, detail="Couldn't generate search queries, please try again")
+  llm_res = await llm.allm_call('gemini-1.5-flash', reply_messages(messages, videos_list, chat_sys_prompt), provider='google')
 
   assistant_reply = {"role": "assistant", "content": llm_res}
   return {"reply": assistant_reply, "videos": videos_list}
 
 
+def sse_event(event: str, data) -> str:
+  return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/recommend_videos/stream")
+async def chat_stream(messages: list[Message], request: Request):
+  '''
+  Server-Sent Events variant of /recommend_videos:
+  - `videos` event with the video cards as soon as the search returns
+  - `token` events with the assistant reply as it is generated
+  - `done` event with the full reply, or `error` with a generic `code` and `detail` if generation failed
+    (the exception itself is only logged, it can carry provider or database internals)
+  '''
+  chat_sys_prompt = prompts.text('recommend_videos_chat')
+  keyword_gen_sys_prompt = prompts.text('recommend_videos_keyword_gen')
+
+  user = get_current_user(request)
+  if not user:
+    raise HTTPException(status_code=401, detail="Unauthorized")
+
+  async def events():
+    try:
+      videos_list = await recommend(messages, keyword_gen_sys_prompt)
+      yield sse_event("videos", [x.model_dump() for x in videos_list])
+
+      reply = []
+      async for token in llm.allm_stream('gemini-1.5-flash', reply_messages(messages, videos_list, chat_sys_prompt), provider='google'):
+        reply.append(token)
+        yield sse_event("token", {"content": token})
+      yield sse_event("done", {"reply": {"role": "assistant", "content": ''.join(reply)}})
+    except llm.StructuredOutputError as e:
+      print("Search query generation failed:", e)
+      yield sse_event("error", {"code": "search_failed", "detail": "Couldn't generate search queries, please try again"})
+    except Exception:
+      print("Error while streaming recommendations:")
+      traceback.print_exc()
+      yield sse_event("error", {"code": "internal_error", "detail": "Something went wrong, please try again"})
+
+  return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+
+# ===
+# Chat sessions: the server keeps a rolling summary plus the last CHAT_HISTORY_TURNS turns in Memory,
+# so clients send only the new message and the prompt stays bounded however long the conversation gets
+# ===
+CHAT_HISTORY_TURNS = int(os.environ.get("CHAT_HISTORY_TURNS", 6))
+CHAT_SUMMARY_BATCH = int(os.environ.get("CHAT_SUMMARY_BATCH", 6))  # summarize once this many turns are past the window
+summarizing = set()  # sessions with a summary update in flight in this process
+MEMORY_TOP_K = int(os.environ.get("MEMORY_TOP_K", 5))
+MEMORY_DEDUPE_DISTANCE = float(os.environ.get("MEMORY_DEDUPE_DISTANCE", 0.1))  # a new memory this close to a stored one is a repeat
+
+class ChatSessionOut(BaseModel):
+  session_id: str
+
+class ChatIn(BaseModel):
+  content: str = Field(..., desc='the new user message')
+
+class ExtractedMemories(BaseModel):
+  memories: list[str] = Field(desc='new long-term memories about the user, one short sentence each', max_length=3)
+
+# tokens of the call that wrote the reply only: keyword generation (skipped on a cache hit) runs before it,
+# memory extraction and summarization after the response is sent, and none of them are counted here
+class ReplyUsage(BaseModel):
+  prompt_tokens: int
+  completion_tokens: int
+  history_turns: int = Field(..., desc='earlier turns sent verbatim; older ones are only in the summary')
+
+class SessionChatOut(ChatOut):
+  reply_usage: ReplyUsage
+
+@app.post("/chat/sessions", response_model=ChatSessionOut, status_code=201)
+async def create_chat_session(request: Request):
+  user = get_current_user(request)
+  if not user:
+    raise HTTPException(status_code=401, detail="Unauthorized")
+
+  session_id = str(uuid.uuid4())
+  await adb.create_chat_session(user['user_id'], session_id)
+  return {"session_id": session_id}
+
+async def summarize_session(user_id: str, session_id: str):
+  '''
+  Folds the turns that fell out of the window into the session summary; runs after the response is sent.
+  '''
+  if session_id in summarizing:
+    return
+  summarizing.add(session_id)
+  try:
+    turns = await adb.read_turns_to_summarize(session_id, CHAT_HISTORY_TURNS)
+    if not turns:
+      return
+    summary, _, _ = await adb.read_chat_context(user_id, session_id, 0)
+    prompt = prompts.render('chat_summary', summary=summary, turns=turns)
+    res = await llm.acomplete('gemini-1.5-flash', [Message(role='user', content=prompt)], temp=0.2, provider='google')
+    await adb.fold_chat_summary(session_id, res.text.strip(), [t.mem_id for t in turns])
+  except Exception as e:
+    print(f"Summarizing chat session {session_id} failed:", e)
+  finally:
+    summarizing.discard(session_id)
+
+async def extract_memories(user_id: str, user_message: str, assistant_reply: str):
+  '''
+  Extracts long-term memories from a turn and stores them with their embeddings, skipping ones already
+  known; runs after the response is sent.
+  '''
+  try:
+    turn = f"user: {user_message}\n\nassistant: {assistant_reply}"
+    res = await llm.arun('gemini-1.5-flash', [Message(role='system', content=prompts.text('memory_extraction')), Message(role='user', content=turn)], response_model=ExtractedMemories, provider='google', max_retries=2)
+    if not res.memories:
+      return
+    vectors = await embeddings.aembed(res.memories, task_type="retrieval_document")
+    new_memories = []
+    for memory, vector in zip(res.memories, vectors):
+      literal = embeddings.to_pgvector(vector)
+      if not await adb.top_k_memories(user_id, literal, 1, max_distance=MEMORY_DEDUPE_DISTANCE):
+        new_memories.append((str(uuid.uuid4()), memory, literal))
+    if new_memories:
+      await adb.create_memories(user_id, new_memories)
+  except Exception as e:
+    print(f"Extracting memories for user {user_id} failed:", e)
+
+async def relevant_memories(user_id: str, content: str) -> list[db.Memory]:
+  query_embedding = (await embeddings.aembed([content]))[0]
+  return await adb.top_k_memories(user_id, embeddings.to_pgvector(query_embedding), MEMORY_TOP_K)
+
+@app.post("/chat/sessions/{session_id}/messages", response_model=SessionChatOut)
+async def session_chat(session_id: str, message: ChatIn, request: Request, background_tasks: BackgroundTasks):
+  '''
+  - same as /recommend_videos, but the history comes from the session: the user's most relevant long-term
+    memories + summary + last turns + the new message
+  - stores the new turns; in the background, extracts new memories and, once enough turns are past the window, summarizes them
+  '''
+  user = get_current_user(request)
+  if not user:
+    raise HTTPException(status_code=401, detail="Unauthorized")
+
+  context, memories = await asyncio.gather(
+    adb.read_chat_context(user['user_id'], session_id, CHAT_HISTORY_TURNS),
+    relevant_memories(user['user_id'], message.content),
+  )
+  if context is None:
+    raise HTTPException(status_code=404, detail="Chat session not found")
+  summary, turns, total_turns = context
+
+  history = [Message(role='system', content='What you know about the user:\n' + '\n'.join(f'- {m.memory}' for m in memories))] if memories else []
+  history += [Message(role='system', content=f'Summary of the earlier conversation:\n{summary}')] if summary else []
+  history += [Message(role=t.role, content=t.memory) for t in turns]
+  messages = history + [Message(role='user', content=message.content)]
+
+  try:
+    videos_list = await recommend(messages, prompts.text('recommend_videos_keyword_gen'))
+  except llm.StructuredOutputError as e:
+    print("Search query generation failed:", e)
+    raise HTTPException(status_code=502, detail="Couldn't generate search queries, please try again")
+  res = await llm.acomplete('gemini-1.5-flash', reply_messages(messages, videos_list, prompts.text('recommend_videos_chat')), provider='google')
+
+  await adb.add_chat_turns(user['user_id'], session_id, [(str(uuid.uuid4()), 'user', message.content), (str(uuid.uuid4()), 'assistant', res.text)])
+  if total_turns + 2 > CHAT_HISTORY_TURNS + CHAT_SUMMARY_BATCH:
+    background_tasks.add_task(summarize_session, user['user_id'], session_id)
+  background_tasks.add_task(extract_memories, user['user_id'], message.content, res.text)
+
+  reply_usage = {"prompt_tokens": res.prompt_tokens, "completion_tokens": res.completion_tokens, "history_turns": len(turns)}
+  print(f"Chat session {session_id} reply usage:", reply_usage, flush=True)
+  return {"reply": {"role": "assistant", "content": res.text}, "videos": videos_list, "reply_usage": reply_usage}
+
+
 
 @app.post("/library", status_code=201)
 async def add_to_library(video: VideoIn, request: Request):
@@ -164,11 +417,15 @@ async def add_to_library(video: VideoIn, request: Request):
   if not user:
     raise HTTPException(status_code=401, detail="Unauthorized")
 
+  # a primary key probe, cheaper than anything a cache in front of it would save
+  if await adb.check_video_in_library(user['user_id'], video.video_id):
+    return JSONResponse({'message': 'video already in user library'}, status_code=200)
+
   # Check if the video already exists in the database
-  existing_video: Optional[db.Video] = db.read_video(video.video_id)
+  existing_video: Optional[db.Video] = await adb.read_video(video.video_id)
   # Create the video if it doesn't exist
   if not existing_video:
-    db.create_video(db.Video(
+    await adb.create_video(db.Video(
       video_id=video.video_id,
       url=video.url,
       description=video.description,
@@ -176,23 +433,54 @@ async def add_to_library(video: VideoIn, request: Request):
       thumbnail_url=video.thumbnail_url,
     ))
 
-  db.create_library(db.Library(user['user_id'], video.video_id))
-  # TODO: add the video_id to the worker queue
+  if not await adb.create_library(db.Library(user['user_id'], video.video_id)):
+    # a concurrent request added it first
+    return JSONResponse({'message': 'video already in user library'}, status_code=200)
+  if not existing_video or existing_video.outline is None:
+    await adb.enqueue_analysis_job(video.video_id)
 
 
+class LibraryVideo(BaseModel):
+  video_id: str
+  url: str
+  title: str
+  thumbnail_url: str
+  analyzed: bool = Field(..., desc="Whether the outline and quiz are ready")
+  added_at: datetime
+
 class LibGetOut(BaseModel):
-  response: list[Video]
+  response: list[LibraryVideo]
+  next_cursor: str | None = Field(None, desc="Pass as `cursor` to get the next page; null on the last page")
+
+def encode_cursor(item: db.LibraryItem) -> str:
+  return base64.urlsafe_b64encode(json.dumps([item.added_at.isoformat(), item.video_id]).encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+  try:
+    added_at, video_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return datetime.fromisoformat(added_at), video_id
+  except (ValueError, TypeError):
+    raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @app.get("/library", response_model=LibGetOut)
-async def get_library(request: Request):
+async def get_library(
+  request: Request,
+  limit: int = Query(LIBRARY_PAGE_SIZE, ge=1, le=LIBRARY_MAX_PAGE_SIZE),
+  cursor: Optional[str] = None,
+  title: Optional[str] = None,
+):
   '''
-  - get list of video objects in the given users library
+  - get a page of video objects in the given users library, newest first, optionally filtered by title
   '''
   user = get_current_user(request)
   if not user:
     raise HTTPException(status_code=401, detail="Unauthorized")
 
-  library = db.get_videos_by_user(user['user_id'])
-  return {"response": library}
+  after = decode_cursor(cursor) if cursor else None
+  # one extra row tells whether there is a next page
+  items = await adb.read_library_page(user['user_id'], limit + 1, after, title or None)
+  next_cursor = encode_cursor(items[limit - 1]) if len(items) > limit else None
+  return {"response": items[:limit], "next_cursor": next_cursor}
 
 
 @app.delete("/library/{video_id}", status_code=204)
@@ -204,10 +492,8 @@ async def remove_from_library(video_id: str, request: Request):
   if not user:
     raise HTTPException(status_code=401, detail="Unauthorized")
   
-  if not db.check_video_in_library(user['user_id'], video_id):
+  if not await adb.delete_library(user['user_id'], video_id):
     raise HTTPException(status_code=404, detail="Video not found in library")
-  
-  db.delete_library(user['user_id'], video_id)
   return JSONResponse({'message': 'video successfully removed from user library'}, status_code=204)  # No Content
 
 
@@ -217,21 +503,50 @@ class QuizQuestion(BaseModel):
   answer: str
 
 class VideoDetails(BaseModel):
-  outline: str = Field(..., desc="Outline of the video")
-  quiz: list[QuizQuestion] = Field(..., desc="List of quiz questions and answers")
+  status: str = Field("done", desc="Analysis status: pending, running, done or failed")
+  outline: str | None = Field(None, desc="Outline of the video")
+  quiz: list[QuizQuestion] = Field(default_factory=list, desc="List of quiz questions and answers")
+
+class JobStatus(BaseModel):
+  video_id: str
+  status: str
+  attempts: int
+  error: str | None = None
+
+@app.get("/jobs/{video_id}", response_model=JobStatus)
+async def job_status(video_id: str, request: Request):
+  user = get_current_user(request)
+  if not user: raise HTTPException(status_code=401, detail="Unauthorized")
+
+  job = await adb.read_analysis_job(video_id)
+  if not job: raise HTTPException(status_code=404, detail="No analysis job for this video")
+  return {"video_id": job.video_id, "status": job.status, "attempts": job.attempts, "error": job.last_error}
+
+def etag_matches(request: Request, etag: str) -> bool:
+  candidates = [t.strip().removeprefix("W/") for t in request.headers.get("if-none-match", "").split(",")]
+  return etag in candidates or "*" in candidates
 
 @app.get("/watch", response_model=VideoDetails)
 async def watch(video_id: str, request: Request):
   user = get_current_user(request)
   if not user: raise HTTPException(status_code=401, detail="Unauthorized")
 
-  quizzes = db.read_quizzes_by_video(video_id)
-  video = db.read_video(video_id)
-  video_details = {
-    "outline": video.outline,
-    "quiz": [{"question":q.question, "answer": q.answer} for q in quizzes]
-  }
-  return video_details
+  cached = watch_cache.get(video_id)
+  if cached is None:
+    analysis = await adb.read_video_analysis(video_id)
+    if not analysis: raise HTTPException(status_code=404, detail="Video not found")
+    if analysis["outline"] is None:
+      return {"status": analysis["status"] or "pending"}
+    cached = {
+      "etag": f'"{video_id}.{analysis["version"]}"',
+      "body": {"status": "done", "outline": analysis["outline"], "quiz": analysis["quiz"]},
+    }
+    watch_cache.set(video_id, cached)
+
+  headers = {"ETag": cached["etag"], "Cache-Control": "private, no-cache"}
+  if etag_matches(request, cached["etag"]):
+    return Response(status_code=304, headers=headers)
+  return JSONResponse(cached["body"], headers=headers)
 
 if __name__ == "__main__":
   import uvicorn
@@ -0,0 +1,211 @@
+'''
+Disk cache for analyzer artifacts (video chunks and their metadata), with a size budget and LRU eviction.
+
+Artifacts are written to a temp file and renamed into place only once complete, so a crashed ffmpeg never
+leaves a partial file that looks cached. The manifest is merged and rewritten atomically under a file lock
+after every change, so the cache survives restarts and can be shared by several processes. Lookups don't
+change it: an artifact's recency is its file's mtime, which a hit touches under a shared lock.
+'''
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class ArtifactCache:
+  def __init__(self, root: str, budget_bytes: int, tmp_max_age: float = 6 * 60 * 60, evict_grace: float = 10 * 60):
+    self.root = root
+    self.budget_bytes = budget_bytes
+    self.tmp_max_age = tmp_max_age
+    self.evict_grace = evict_grace
+    self._objects_dir = os.path.join(root, "objects")
+    self._tmp_dir = os.path.join(root, "tmp")
+    self._manifest_path = os.path.join(root, "manifest.json")
+    self._lock_path = os.path.join(root, "manifest.lock")
+    self._lock = threading.Lock()
+    self._entries = {}
+    self.hits = 0
+    self.misses = 0
+    self.bytes_served = 0
+    self.evictions = 0
+
+    os.makedirs(self._objects_dir, exist_ok=True)
+    os.makedirs(self._tmp_dir, exist_ok=True)
+    self._clean_tmp()
+    with self._manifest() as entries:
+      self._reclaim_orphans(entries)
+      self._evict(keep=None)  # the budget may have shrunk since the last run
+
+  @contextmanager
+  def _manifest(self) -> Iterator[dict]:
+    """
+    Several processes (API, workers, benchmarks) share the cache directory, so every change re-reads the
+    manifest under an exclusive file lock, applies itself to the merged state and writes it back.
+    """
+    with self._lock, open(self._lock_path, "a") as lock_file:
+      fcntl.flock(lock_file, fcntl.LOCK_EX)
+      self._entries = self._load_manifest()
+      yield self._entries
+      self._save_manifest()
+
+  @contextmanager
+  def _shared(self) -> Iterator[dict]:
+    """
+    The manifest as last written, for lookups. Eviction needs the exclusive lock, so while this is held no
+    entry read here can be removed; readers don't block each other.
+    """
+    with open(self._lock_path, "a") as lock_file:
+      fcntl.flock(lock_file, fcntl.LOCK_SH)
+      yield self._read_manifest()
+
+  def _clean_tmp(self):
+    # a write that is still going on in another process is recent; an old one never finished
+    cutoff = time.time() - self.tmp_max_age
+    for name in os.listdir(self._tmp_dir):
+      path = os.path.join(self._tmp_dir, name)
+      try:
+        if os.path.getmtime(path) < cutoff:
+          os.remove(path)
+      except FileNotFoundError:
+        pass
+
+  def _reclaim_orphans(self, entries: dict):
+    # objects only enter objects/ together with their manifest entry (both under the file lock),
+    # so a file without one was dropped from the manifest and would otherwise never count against the budget
+    referenced = {entry["file"] for entry in entries.values()}
+    for name in os.listdir(self._objects_dir):
+      if name not in referenced:
+        try:
+          os.remove(os.path.join(self._objects_dir, name))
+        except FileNotFoundError:
+          pass
+
+  def _read_manifest(self) -> dict:
+    try:
+      with open(self._manifest_path) as f:
+        return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+      return {}
+
+  def _load_manifest(self) -> dict:
+    # drop entries whose file went missing or doesn't match the recorded size
+    return {key: entry for key, entry in self._read_manifest().items() if self._intact(entry)}
+
+  def _intact(self, entry: dict) -> bool:
+    try:
+      return os.path.getsize(self._abspath(entry)) == entry["size"]
+    except FileNotFoundError:
+      return False
+
+  def _save_manifest(self):
+    tmp_path = f"{self._manifest_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+      json.dump(self._entries, f)
+    os.replace(tmp_path, self._manifest_path)
+
+  def _abspath(self, entry: dict) -> str:
+    return os.path.join(self._objects_dir, entry["file"])
+
+  @property
+  def size_bytes(self) -> int:
+    return sum(entry["size"] for entry in self._entries.values())
+
+  def get(self, key: str) -> Optional[str]:
+    """
+    Returns the path of a cached artifact, or None on a miss. A hit sets the file's mtime to now, which
+    keeps it from being evicted for the next `evict_grace` seconds.
+    """
+    with self._shared() as entries:
+      entry = entries.get(key)
+      if entry is not None and self._intact(entry):
+        os.utime(self._abspath(entry))
+      else:
+        entry = None
+    with self._lock:
+      if entry is None:
+        self.misses += 1
+        return None
+      self._entries[key] = entry
+      self.hits += 1
+      self.bytes_served += entry["size"]
+    return self._abspath(entry)
+
+  def path(self, key: str) -> Optional[str]:
+    """
+    Path of a cached artifact without counting a lookup, e.g. right after writing it.
+    """
+    with self._lock:
+      entry = self._entries.get(key)
+      return self._abspath(entry) if entry else None
+
+  @contextmanager
+  def put(self, key: str, suffix: str = "") -> Iterator[str]:
+    """
+    Yields a temp path to write the artifact to. It is moved into the cache only if the block exits cleanly.
+    """
+    tmp_path = os.path.join(self._tmp_dir, f"{uuid.uuid4().hex}{suffix}")
+    try:
+      yield tmp_path
+      file_name = hashlib.sha256(key.encode()).hexdigest() + suffix
+      with self._manifest() as entries:
+        os.replace(tmp_path, os.path.join(self._objects_dir, file_name))
+        entries[key] = {"file": file_name, "size": os.path.getsize(os.path.join(self._objects_dir, file_name))}
+        self._evict(keep=key)
+    finally:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+  def get_json(self, key: str):
+    path = self.get(key)
+    if path is None:
+      return None
+    with open(path) as f:
+      return json.load(f)
+
+  def put_json(self, key: str, value):
+    with self.put(key, ".json") as tmp_path:
+      with open(tmp_path, "w") as f:
+        json.dump(value, f)
+
+  def _evict(self, keep: str):
+    total = self.size_bytes
+    if total <= self.budget_bytes:
+      return
+    # least recently used first, by file mtime (written by put, touched by get); whoever used an entry within
+    # the grace period may still be reading it, so it stays even if that leaves the cache over budget for now
+    mtimes = {key: os.path.getmtime(self._abspath(entry)) for key, entry in self._entries.items()}
+    cutoff = time.time() - self.evict_grace
+    for key in sorted(mtimes, key=mtimes.get):
+      if total <= self.budget_bytes or mtimes[key] > cutoff:
+        break
+      if key == keep:
+        continue
+      entry = self._entries.pop(key)
+      total -= entry["size"]
+      self.evictions += 1
+      try:
+        os.remove(self._abspath(entry))
+      except FileNotFoundError:
+        pass
+
+  def stats(self) -> dict:
+    with self._shared() as entries:
+      entries = {key: entry for key, entry in entries.items() if self._intact(entry)}
+    with self._lock:
+      self._entries = entries
+      lookups = self.hits + self.misses
+      return {
+        "entries": len(self._entries),
+        "size_bytes": self.size_bytes,
+        "budget_bytes": self.budget_bytes,
+        "hits": self.hits,
+        "misses": self.misses,
+        "hit_rate": self.hits / lookups if lookups else 0.0,
+        "bytes_served": self.bytes_served,
+        "evictions": self.evictions,
+      }
@@ -0,0 +1,433 @@
+'''
+Async mirror of db.py on asyncpg, for use from the FastAPI handlers.
+Reuses the dataclasses from db so both layers return the same objects.
+'''
+import asyncio
+import json
+import os
+from typing import Callable, List, Optional
+
+import asyncpg
+
+from db import User, Library, LibraryItem, Video, Quiz, Memory, AnalysisJob, PG_USER, PG_PASSWORD, PG_HOST, PG_PORT, PG_DB
+
+PG_ASYNC_POOL_MIN_SIZE = int(os.environ.get("PG_ASYNC_POOL_MIN_SIZE", 2))
+PG_ASYNC_POOL_MAX_SIZE = int(os.environ.get("PG_ASYNC_POOL_MAX_SIZE", 20))
+PG_ASYNC_POOL_TIMEOUT = float(os.environ.get("PG_ASYNC_POOL_TIMEOUT", 30))
+PG_ASYNC_POOL_MAX_LIFETIME = float(os.environ.get("PG_ASYNC_POOL_MAX_LIFETIME", 30 * 60))
+# how often an idle LISTEN connection is pinged; a half-open TCP connection only shows up this way
+PG_LISTEN_HEALTH_INTERVAL = float(os.environ.get("PG_LISTEN_HEALTH_INTERVAL", 30))
+
+_pool: Optional[asyncpg.Pool] = None
+
+
+async def open_pool() -> asyncpg.Pool:
+  global _pool
+  if _pool is None:
+    _pool = await asyncpg.create_pool(
+      user=PG_USER, password=PG_PASSWORD, host=PG_HOST, port=PG_PORT, database=PG_DB,
+      min_size=PG_ASYNC_POOL_MIN_SIZE,
+      max_size=PG_ASYNC_POOL_MAX_SIZE,
+      max_inactive_connection_lifetime=PG_ASYNC_POOL_MAX_LIFETIME,
+      timeout=PG_ASYNC_POOL_TIMEOUT,
+    )
+  return _pool
+
+async def close_pool():
+  global _pool
+  if _pool is not None:
+    await _pool.close()
+    _pool = None
+
+async def get_pool() -> asyncpg.Pool:
+  return _pool if _pool is not None else await open_pool()
+
+async def _listen_connection(channel: str, callback: Callable[[str], None]) -> tuple[asyncpg.Connection, asyncio.Event]:
+  dropped = asyncio.Event()
+  conn = await asyncpg.connect(user=PG_USER, password=PG_PASSWORD, host=PG_HOST, port=PG_PORT, database=PG_DB)
+  conn.add_termination_listener(lambda _conn: dropped.set())
+  await conn.add_listener(channel, lambda _conn, _pid, _channel, payload: callback(payload))
+  return conn, dropped
+
+async def _still_listening(conn: asyncpg.Connection, dropped: asyncio.Event) -> bool:
+  try:
+    await asyncio.wait_for(dropped.wait(), PG_LISTEN_HEALTH_INTERVAL)
+    return False
+  except asyncio.TimeoutError:
+    pass
+  try:
+    await asyncio.wait_for(conn.execute("SELECT 1"), PG_LISTEN_HEALTH_INTERVAL)
+    return True
+  except Exception:
+    return False
+
+async def listen(channel: str, callback: Callable[[str], None], on_reconnect: Optional[Callable[[], None]] = None) -> asyncio.Task:
+  """
+  Calls `callback(payload)` for every NOTIFY on `channel`. LISTEN holds its connection for as long as it
+  runs, so it gets a dedicated one outside the pool. When that connection drops (the server closes it,
+  or it stops answering the health check) it is replaced, and `on_reconnect()` runs once the new LISTEN
+  is in place, since anything notified in between was missed. The first LISTEN is in place when this
+  returns; cancel the returned task to stop listening.
+  """
+  conn, dropped = await _listen_connection(channel, callback)
+
+  async def supervise(conn, dropped):
+    try:
+      while True:
+        while await _still_listening(conn, dropped):
+          pass
+        print(f"LISTEN {channel} connection lost, reconnecting", flush=True)
+        conn.terminate()
+        delay = 1.0
+        while True:
+          try:
+            conn, dropped = await _listen_connection(channel, callback)
+            break
+          except Exception as e:
+            print(f"LISTEN {channel} reconnect failed, retrying in {delay:.0f}s:", e, flush=True)
+            await asyncio.sleep(delay)
+            delay = min(2 * delay, 60)
+        if on_reconnect is not None:
+          on_reconnect()
+    finally:
+      conn.terminate()
+
+  return asyncio.create_task(supervise(conn, dropped))
+
+def pool_stats() -> dict:
+  if _pool is None:
+    return {"size": 0, "idle": 0, "in_use": 0, "max_size": PG_ASYNC_POOL_MAX_SIZE}
+  size, idle = _pool.get_size(), _pool.get_idle_size()
+  return {"size": size, "idle": idle, "in_use": size - idle, "min_size": _pool.get_min_size(), "max_size": _pool.get_max_size()}
+
+# ===
+# Users
+# ===
+async def create_user(user: User):
+  pool = await get_pool()
+  await pool.execute("INSERT INTO Users (user_id, name, email) VALUES ($1, $2, $3)", user.user_id, user.name, user.email)
+
+async def read_user(user_id: str) -> Optional[User]:
+  pool = await get_pool()
+  row = await pool.fetchrow("SELECT user_id, name, email FROM Users WHERE user_id = $1", user_id)
+  return User(*row) if row else None
+
+async def update_user(user_id: str, user: User):
+  pool = await get_pool()
+  await pool.execute("UPDATE Users SET name = $1, email = $2 WHERE user_id = $3", user.name, user.email, user_id)
+
+async def delete_user(user_id: str):
+  pool = await get_pool()
+  await pool.execute("DELETE FROM Users WHERE user_id = $1", user_id)
+
+CHECK_USER_BY_EMAIL_QUERY = "SELECT EXISTS (SELECT 1 FROM Users WHERE email = $1)"
+
+async def check_user_by_email(email: str) -> bool:
+  pool = await get_pool()
+  return await pool.fetchval(CHECK_USER_BY_EMAIL_QUERY, email)
+
+# ===
+# Videos
+# ===
+async def create_video(video: Video):
+  # concurrent first adds of the same video both try to create it; the loser keeps the winner's row
+  pool = await get_pool()
+  await pool.execute(
+    "INSERT INTO Video (video_id, url, description, title, thumbnail_url, outline) VALUES ($1, $2, $3, $4, $5, $6) ON CONFLICT (video_id) DO NOTHING",
+    video.video_id, video.url, video.description, video.title, video.thumbnail_url, video.outline,
+  )
+
+async def read_video(video_id: str) -> Optional[Video]:
+  pool = await get_pool()
+  row = await pool.fetchrow("SELECT video_id, url, description, title, thumbnail_url, outline FROM Video WHERE video_id = $1", video_id)
+  return Video(*row) if row else None
+
+async def update_video(video_id: str, video: Video):
+  pool = await get_pool()
+  await pool.execute(
+    "UPDATE Video SET url = $1, description = $2, title = $3, thumbnail_url = $4, outline = $5 WHERE video_id = $6",
+    video.url, video.description, video.title, video.thumbnail_url, video.outline, video_id,
+  )
+
+async def delete_video(video_id: str):
+  pool = await get_pool()
+  await pool.execute("DELETE FROM Video WHERE video_id = $1", video_id)
+
+async def get_videos_by_user(user_id: str) -> List[Video]:
+  pool = await get_pool()
+  rows = await pool.fetch('''
+  SELECT v.video_id, v.url, v.description, v.title, v.thumbnail_url, v.outline
+  FROM Library l
+  JOIN Video v ON l.video_id = v.video_id
+  WHERE l.user_id = $1
+  ''', user_id)
+  return [Video(*row) for row in rows]
+
+READ_VIDEO_ANALYSIS_QUERY = '''
+SELECT v.outline, v.analysis_version, j.status,
+  COALESCE(json_agg(json_build_object('question', q.question, 'answer', q.answer) ORDER BY q.qid) FILTER (WHERE q.qid IS NOT NULL), '[]') AS quiz
+FROM Video v
+LEFT JOIN AnalysisJob j ON j.video_id = v.video_id
+LEFT JOIN Quiz q ON q.video_id = v.video_id
+WHERE v.video_id = $1
+GROUP BY v.video_id, j.status
+'''
+
+async def read_video_analysis(video_id: str) -> Optional[dict]:
+  """
+  Outline, analysis version, job status and quiz of a video in a single round trip.
+
+  :return: Dict with outline, version, status and quiz (list of question/answer dicts), or None if the video doesn't exist
+  """
+  pool = await get_pool()
+  row = await pool.fetchrow(READ_VIDEO_ANALYSIS_QUERY, video_id)
+  if row is None:
+    return None
+  return {"outline": row["outline"], "version": row["analysis_version"], "status": row["status"], "quiz": json.loads(row["quiz"])}
+
+# ===
+# Library
+# ===
+async def create_library(library: Library) -> bool:
+  """
+  :return: False if the video was already in the library
+  """
+  pool = await get_pool()
+  status = await pool.execute("INSERT INTO Library (user_id, video_id) VALUES ($1, $2) ON CONFLICT DO NOTHING", library.user_id, library.video_id)
+  return status == "INSERT 0 1"
+
+async def read_library(user_id: str, video_id: Optional[str] = None):
+  pool = await get_pool()
+  rows = await pool.fetch("SELECT user_id, video_id FROM Library WHERE user_id = $1 AND (video_id = $2 OR $2 IS NULL)", user_id, video_id)
+  return [tuple(row) for row in rows]
+
+async def delete_library(user_id: str, video_id: Optional[str] = None) -> int:
+  """
+  :return: Number of library rows removed
+  """
+  pool = await get_pool()
+  status = await pool.execute("DELETE FROM Library WHERE user_id = $1 AND (video_id = $2 OR $2 IS NULL)", user_id, video_id)
+  return int(status.split()[-1])
+
+READ_LIBRARY_PAGE_QUERY = '''
+SELECT v.video_id, v.url, v.title, v.thumbnail_url, v.outline IS NOT NULL, l.added_at
+FROM Library l
+JOIN Video v ON l.video_id = v.video_id
+WHERE l.user_id = $1
+  AND ($2::timestamptz IS NULL OR (l.added_at, l.video_id) < ($2, $3))
+  AND ($4::text IS NULL OR v.title ILIKE $4)
+ORDER BY l.added_at DESC, l.video_id DESC
+LIMIT $5
+'''
+
+async def read_library_page(user_id: str, limit: int, after: Optional[tuple] = None, title: Optional[str] = None) -> List[LibraryItem]:
+  """
+  One page of a user's library, newest first, seeking past the last row of the previous page so deep pages
+  cost the same as the first one.
+
+  :param after: (added_at, video_id) of the last item of the previous page, or None for the first page
+  :param title: Case-insensitive substring the title must contain
+  """
+  pool = await get_pool()
+  after_added_at, after_video_id = after or (None, None)
+  pattern = None if title is None else "%" + title.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+  rows = await pool.fetch(READ_LIBRARY_PAGE_QUERY, user_id, after_added_at, after_video_id, pattern, limit)
+  return [LibraryItem(*row) for row in rows]
+
+CHECK_VIDEO_IN_LIBRARY_QUERY = "SELECT EXISTS (SELECT 1 FROM Library WHERE user_id = $1 AND video_id = $2)"
+
+async def check_video_in_library(user_id: str, video_id: str) -> bool:
+  pool = await get_pool()
+  return await pool.fetchval(CHECK_VIDEO_IN_LIBRARY_QUERY, user_id, video_id)
+
+# ===
+# Quiz
+# ===
+async def create_quiz(quiz: Quiz):
+  pool = await get_pool()
+  await pool.execute("INSERT INTO Quiz (qid, video_id, question, answer) VALUES ($1, $2, $3, $4)", quiz.qid, quiz.video_id, quiz.question, quiz.answer)
+
+async def read_quiz(qid: str) -> Optional[Quiz]:
+  pool = await get_pool()
+  row = await pool.fetchrow("SELECT qid, video_id, question, answer FROM Quiz WHERE qid = $1", qid)
+  return Quiz(qid=row[0], video_id=row[1], question=row[2], answer=row[3]) if row else None
+
+async def update_quiz(qid: str, quiz: Quiz):
+  pool = await get_pool()
+  await pool.execute("UPDATE Quiz SET video_id = $1, question = $2, answer = $3 WHERE qid = $4", quiz.video_id, quiz.question, quiz.answer, qid)
+
+async def delete_quiz(qid: str):
+  pool = await get_pool()
+  await pool.execute("DELETE FROM Quiz WHERE qid = $1", qid)
+
+READ_QUIZZES_BY_VIDEO_QUERY = "SELECT qid, video_id, question, answer FROM Quiz WHERE video_id = $1"
+
+async def read_quizzes_by_video(video_id: str) -> List[Quiz]:
+  pool = await get_pool()
+  rows = await pool.fetch(READ_QUIZZES_BY_VIDEO_QUERY, video_id)
+  return [Quiz(qid=row[0], video_id=row[1], question=row[2], answer=row[3]) for row in rows]
+
+# ===
+# Memory
+# ===
+async def create_memory(memory: Memory):
+  pool = await get_pool()
+  await pool.execute("INSERT INTO Memory (mem_id, memory, user_id) VALUES ($1, $2, $3)", memory.mem_id, memory.memory, memory.user_id)
+
+async def read_memory(mem_id: str) -> Optional[Memory]:
+  pool = await get_pool()
+  row = await pool.fetchrow("SELECT mem_id, memory, user_id FROM Memory WHERE mem_id = $1", mem_id)
+  return Memory(*row) if row else None
+
+async def update_memory(mem_id: str, memory: Memory):
+  pool = await get_pool()
+  await pool.execute("UPDATE Memory SET memory = $1, user_id = $2 WHERE mem_id = $3", memory.memory, memory.user_id, mem_id)
+
+async def delete_memory(mem_id: str):
+  pool = await get_pool()
+  await pool.execute("DELETE FROM Memory WHERE mem_id = $1", mem_id)
+
+READ_MEMORIES_BY_USER_QUERY = "SELECT mem_id, memory, user_id FROM Memory WHERE user_id = $1 AND kind = 'fact'"
+
+async def read_memories_by_user(user_id: str) -> List[Memory]:
+  pool = await get_pool()
+  rows = await pool.fetch(READ_MEMORIES_BY_USER_QUERY, user_id)
+  return [Memory(*row) for row in rows]
+
+async def create_memories(user_id: str, memories: list):
+  """
+  :param memories: (mem_id, memory, embedding) tuples, embedding as a pgvector literal
+  """
+  pool = await get_pool()
+  await pool.executemany(
+    "INSERT INTO Memory (mem_id, memory, user_id, kind, embedding) VALUES ($1, $2, $3, 'fact', $4::text::vector)",
+    [(mem_id, memory, user_id, embedding) for mem_id, memory, embedding in memories],
+  )
+
+# Exact search over the user's own rows (found through the user_id index). A global ANN index would
+# filter by user only after collecting its ef_search candidates, so it returns short or empty results
+# once other users' memories crowd those out; per-user memory sets are small enough to scan exactly.
+TOP_K_MEMORIES_QUERY = '''
+WITH mine AS MATERIALIZED (
+  SELECT mem_id, memory, user_id, embedding <=> $2::text::vector AS distance
+  FROM Memory
+  WHERE user_id = $1 AND kind = 'fact' AND embedding IS NOT NULL
+)
+SELECT mem_id, memory, user_id FROM mine
+WHERE $4::float8 IS NULL OR distance < $4
+ORDER BY distance
+LIMIT $3
+'''
+
+async def top_k_memories(user_id: str, query_embedding: str, k: int, max_distance: Optional[float] = None) -> List[Memory]:
+  """
+  The user's `k` memories closest to the query by cosine distance, nearest first.
+
+  :param query_embedding: Query embedding as a pgvector literal
+  :param max_distance: If set, only memories closer than this are returned
+  """
+  pool = await get_pool()
+  rows = await pool.fetch(TOP_K_MEMORIES_QUERY, user_id, query_embedding, k, max_distance)
+  return [Memory(*row) for row in rows]
+
+# ===
+# Chat Sessions
+# ===
+# A session is a summary row (created empty) plus turn rows in Memory; the summary row also marks
+# who owns the session. Turns older than the last few are folded into the summary and deleted.
+async def create_chat_session(user_id: str, session_id: str):
+  pool = await get_pool()
+  await pool.execute(
+    "INSERT INTO Memory (mem_id, memory, user_id, session_id, kind) VALUES ($1, '', $2, $1, 'summary')",
+    session_id, user_id,
+  )
+
+async def read_chat_context(user_id: str, session_id: str, k: int) -> Optional[tuple]:
+  """
+  The rolling summary and the last `k` turns of a session, oldest first.
+
+  :return: (summary, turns, total number of stored turns), or None if the user has no such session
+  """
+  pool = await get_pool()
+  async with pool.acquire() as conn:
+    summary = await conn.fetchval("SELECT memory FROM Memory WHERE session_id = $1 AND kind = 'summary' AND user_id = $2", session_id, user_id)
+    if summary is None:
+      return None
+    rows = await conn.fetch('''
+    SELECT mem_id, memory, user_id, session_id, kind, role, count(*) OVER () FROM Memory
+    WHERE session_id = $1 AND kind = 'turn'
+    ORDER BY created_at DESC
+    LIMIT $2
+    ''', session_id, k)
+    total = rows[0][6] if rows else 0
+    return summary, [Memory(*row[:6]) for row in reversed(rows)], total
+
+async def add_chat_turns(user_id: str, session_id: str, turns: list):
+  """
+  :param turns: (mem_id, role, content) tuples, in order
+  """
+  pool = await get_pool()
+  # clock_timestamp, not now(): turns written in one transaction still need distinct, ordered times
+  await pool.executemany(
+    "INSERT INTO Memory (mem_id, memory, user_id, session_id, kind, role, created_at) VALUES ($1, $2, $3, $4, 'turn', $5, clock_timestamp())",
+    [(mem_id, content, user_id, session_id, role) for mem_id, role, content in turns],
+  )
+
+async def read_turns_to_summarize(session_id: str, keep: int) -> List[Memory]:
+  """
+  Turns of a session older than the last `keep`, oldest first.
+  """
+  pool = await get_pool()
+  rows = await pool.fetch('''
+  SELECT mem_id, memory, user_id, session_id, kind, role FROM Memory
+  WHERE session_id = $1 AND kind = 'turn'
+  ORDER BY created_at DESC
+  OFFSET $2
+  ''', session_id, keep)
+  return [Memory(*row) for row in reversed(rows)]
+
+async def fold_chat_summary(session_id: str, summary: str, mem_ids: list[str]):
+  """
+  Replaces the session summary and deletes the turns it now covers, atomically.
+  """
+  pool = await get_pool()
+  async with pool.acquire() as conn:
+    async with conn.transaction():
+      await conn.execute("UPDATE Memory SET memory = $1 WHERE session_id = $2 AND kind = 'summary'", summary, session_id)
+      await conn.execute("DELETE FROM Memory WHERE mem_id = ANY($1::text[]) AND session_id = $2", mem_ids, session_id)
+
+# ===
+# Catalog
+# ===
+async def search_videos_by_embedding(embedding: str, k: int) -> List[Video]:
+  """
+  Nearest catalog videos by cosine distance, served from the HNSW index.
+
+  :param embedding: Query embedding as a pgvector literal
+  :param k: Number of videos to return
+  """
+  pool = await get_pool()
+  rows = await pool.fetch('''
+  SELECT video_id, url, description, title, thumbnail_url, outline
+  FROM Video
+  WHERE embedding IS NOT NULL
+  ORDER BY embedding <=> $1::text::vector
+  LIMIT $2
+  ''', embedding, k)
+  return [Video(*row) for row in rows]
+
+# ===
+# Analysis Jobs
+# ===
+async def enqueue_analysis_job(video_id: str):
+  pool = await get_pool()
+  await pool.execute('''
+  INSERT INTO AnalysisJob (video_id) VALUES ($1)
+  ON CONFLICT (video_id) DO UPDATE SET status = 'pending', attempts = 0, run_after = now(), last_error = NULL, updated_at = now()
+  WHERE AnalysisJob.status = 'failed'
+  ''', video_id)
+
+async def read_analysis_job(video_id: str) -> Optional[AnalysisJob]:
+  pool = await get_pool()
+  row = await pool.fetchrow("SELECT video_id, status, attempts, max_attempts, last_error FROM AnalysisJob WHERE video_id = $1", video_id)
+  return AnalysisJob(*row) if row else None
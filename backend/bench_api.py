@@ -0,0 +1,140 @@
+'''
+Load benchmark for the /library and /watch handlers.
+
+Run it against a live backend (e.g. inside the backend container) once on the old build
+and once on the new one to compare:
+
+  python bench_api.py --base-url http://localhost:8081 --concurrency 100 --requests 2000
+
+The client is a single Python process; give it cores of its own, or it saturates before the server
+does and both builds report the client's ceiling.
+
+POST /library adds videos seeded with an outline, so no analysis job is enqueued; the seeded
+videos and library rows are removed afterwards.
+'''
+import argparse
+import asyncio
+import base64
+import json
+import os
+import statistics
+import time
+import uuid
+
+import httpx
+from itsdangerous import TimestampSigner
+from psycopg2.extras import execute_values
+
+import db
+
+BENCH_USER = db.User(user_id="bench-user", name="Bench User", email="bench@example.com")
+BENCH_WATCH_VIDEO_ID = "bench-watch-video"
+BENCH_LIBRARY_VIDEO_PREFIX = "bench-library-"
+
+
+def session_cookie(user: db.User, secret_key: str) -> str:
+  # mirrors starlette.middleware.sessions.SessionMiddleware
+  data = base64.b64encode(json.dumps({"user": {"user_id": user.user_id, "name": user.name, "email": user.email}}).encode())
+  return TimestampSigner(secret_key).sign(data).decode()
+
+
+def seed() -> str:
+  if not db.read_user(BENCH_USER.user_id):
+    db.create_user(BENCH_USER)
+  video_id = BENCH_WATCH_VIDEO_ID
+  if not db.read_video(video_id):
+    db.create_video(db.Video(video_id=video_id, url="https://www.youtube.com/watch?v=bench", description="bench", title="bench", thumbnail_url="", outline="# Bench outline"))
+    for i in range(10):
+      db.create_quiz(db.Quiz(video_id=video_id, question=f"question {i}", answer=f"answer {i}", qid=f"bench-q{i}"))
+  return video_id
+
+
+@db.with_connection
+def seed_library_videos(conn, run_id: str, total: int) -> list[str]:
+  """
+  Videos for POST /library to add. They already have an outline, as a video someone else analyzed
+  would, so adding them doesn't enqueue an analysis job for a video that doesn't exist on YouTube.
+  """
+  video_ids = [f"{BENCH_LIBRARY_VIDEO_PREFIX}{run_id}-{i}" for i in range(total)]
+  with conn.cursor() as cur:
+    execute_values(
+      cur,
+      "INSERT INTO Video (video_id, url, description, title, thumbnail_url, outline) VALUES %s",
+      [(video_id, f"https://www.youtube.com/watch?v={video_id}", "bench", "bench", "", "# Bench outline") for video_id in video_ids],
+    )
+  return video_ids
+
+
+@db.with_connection
+def cleanup(conn):
+  """
+  Removes the library videos seeded by bench runs, with the bench user's library rows for them and
+  any analysis job. Only ids under BENCH_LIBRARY_VIDEO_PREFIX are touched, and the AnalysisJob table
+  is optional, so the same script can clean up after a run against a build from before it existed.
+  """
+  pattern = f"{BENCH_LIBRARY_VIDEO_PREFIX}%"
+  with conn.cursor() as cur:
+    cur.execute("DELETE FROM Library WHERE user_id = %s AND video_id LIKE %s", (BENCH_USER.user_id, pattern))
+    cur.execute("SELECT to_regclass('analysisjob') IS NOT NULL")
+    if cur.fetchone()[0]:
+      cur.execute("DELETE FROM AnalysisJob WHERE video_id LIKE %s", (pattern,))
+    cur.execute("DELETE FROM Video WHERE video_id LIKE %s", (pattern,))
+
+
+async def hammer(client: httpx.AsyncClient, make_request, total: int, concurrency: int):
+  latencies, errors = [], 0
+  sem = asyncio.Semaphore(concurrency)
+
+  async def one(i):
+    nonlocal errors
+    async with sem:
+      start = time.perf_counter()
+      res = await make_request(client, i)
+      latencies.append(time.perf_counter() - start)
+      if res.status_code >= 400:
+        errors += 1
+
+  start = time.perf_counter()
+  await asyncio.gather(*[one(i) for i in range(total)])
+  elapsed = time.perf_counter() - start
+  latencies.sort()
+  return {
+    "requests": total,
+    "errors": errors,
+    "rps": total / elapsed,
+    "p50_ms": 1000 * statistics.median(latencies),
+    "p95_ms": 1000 * latencies[int(0.95 * (len(latencies) - 1))],
+    "p99_ms": 1000 * latencies[int(0.99 * (len(latencies) - 1))],
+  }
+
+
+async def main(base_url: str, concurrency: int, total: int):
+  watch_video_id = seed()
+  run_id = uuid.uuid4().hex[:8]
+  library_video_ids = seed_library_videos(run_id, total)
+  cookies = {"session": session_cookie(BENCH_USER, os.environ["FASTAPI_SESSION_SECRET_KEY"])}
+  limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+  async def add_to_library(client, i):
+    video_id = library_video_ids[i]
+    return await client.post("/library", json={"video_id": video_id, "url": f"https://www.youtube.com/watch?v={video_id}", "description": "bench", "title": "bench", "thumbnail_url": ""})
+
+  async def watch(client, i):
+    return await client.get("/watch", params={"video_id": watch_video_id})
+
+  try:
+    async with httpx.AsyncClient(base_url=base_url, cookies=cookies, limits=limits, timeout=60) as client:
+      for name, make_request in [("POST /library", add_to_library), ("GET /watch", watch)]:
+        res = await hammer(client, make_request, total, concurrency)
+        print(f"{name:14s} " + "  ".join(f"{k}={v:.1f}" if isinstance(v, float) else f"{k}={v}" for k, v in res.items()), flush=True)
+  finally:
+    cleanup()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--base-url", default="http://localhost:8081")
+  parser.add_argument("--concurrency", type=int, default=100)
+  parser.add_argument("--requests", type=int, default=2000)
+  args = parser.parse_args()
+  asyncio.run(main(args.base_url, args.concurrency, args.requests))
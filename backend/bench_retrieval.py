@@ -0,0 +1,107 @@
+'''
+Offline relevance benchmark: single-query search vs multi-query fan-out with reciprocal-rank fusion.
+
+The fixture is a JSON list of cases:
+  [{"queries": ["first phrasing", "second phrasing", ...],
+    "relevant": ["video_id", ...],
+    "results": {"first phrasing": [{"video_id": ...}, ...], ...},   # recorded search results, in rank order
+    "latency_ms": {"first phrasing": 310, ...}}]                     # optional, recorded per-search latency
+
+  python bench_retrieval.py retrieval_cases.synthetic.json   # committed synthetic replay
+  python bench_retrieval.py fixture.json --record   # fill "results"/"latency_ms" from the live YouTube API
+
+retrieval_cases.synthetic.json is SYNTHETIC: hand-written results and latencies over made-up course
+ids. It exercises the scoring and fusion end to end; its recall numbers say nothing about YouTube,
+which needs a --record run.
+
+The fan-out runs its phrasings concurrently, so a fused search costs about as much as its slowest
+phrasing, not its first one; slowest_search_ms is reported next to the fused wall time so the two
+can be compared.
+'''
+import argparse
+import asyncio
+import json
+import time
+
+import search_fusion
+
+K = 3
+
+
+def recall_at_k(ranked: list[str], relevant: set, k: int = K) -> float:
+  return len(set(ranked[:k]) & relevant) / len(relevant) if relevant else 0.0
+
+def mrr(ranked: list[str], relevant: set) -> float:
+  for rank, video_id in enumerate(ranked, start=1):
+    if video_id in relevant:
+      return 1.0 / rank
+  return 0.0
+
+
+def replay_search(case: dict):
+  async def search(query: str, max_results: int = K):
+    await asyncio.sleep(case.get("latency_ms", {}).get(query, 0) / 1000)
+    return case["results"].get(query, [])[:max_results]
+  return search
+
+
+async def record(cases: list[dict]):
+  import yt_video_recommender  # needs the database settings, which replaying doesn't
+  for case in cases:
+    case["results"], case["latency_ms"] = {}, {}
+    for query in case["queries"]:
+      start = time.perf_counter()
+      case["results"][query] = await yt_video_recommender.search_youtube_videos(query, max_results=K)
+      case["latency_ms"][query] = round(1000 * (time.perf_counter() - start))
+  await yt_video_recommender.aclose()
+
+
+async def evaluate(cases: list[dict]):
+  totals = {"single": {"recall": 0.0, "mrr": 0.0, "wall_ms": 0.0}, "fused": {"recall": 0.0, "mrr": 0.0, "wall_ms": 0.0}}
+  slowest_total_ms = 0.0
+  for case in cases:
+    relevant = set(case["relevant"])
+    search = replay_search(case)
+    search_ms = []
+
+    async def timed_search(query: str, max_results: int = K):
+      start = time.perf_counter()
+      try:
+        return await search(query, max_results)
+      finally:
+        search_ms.append(1000 * (time.perf_counter() - start))
+
+    start = time.perf_counter()
+    single = await search(case["queries"][0])
+    single_ms = 1000 * (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    fused = await search_fusion.multi_search(case["queries"], timed_search, max_results=K, concurrency=len(case["queries"]))
+    fused_ms = 1000 * (time.perf_counter() - start)
+    slowest_total_ms += max(search_ms)
+
+    for name, videos, wall_ms in [("single", single, single_ms), ("fused", fused, fused_ms)]:
+      ranked = [v["video_id"] for v in videos]
+      totals[name]["recall"] += recall_at_k(ranked, relevant)
+      totals[name]["mrr"] += mrr(ranked, relevant)
+      totals[name]["wall_ms"] += wall_ms
+
+  print(f"{len(cases)} cases, k={K}")
+  for name, t in totals.items():
+    print(f"{name:7s} recall@{K}={t['recall'] / len(cases):.3f}  mrr={t['mrr'] / len(cases):.3f}  avg_wall_ms={t['wall_ms'] / len(cases):.0f}")
+  print(f"fused   avg_slowest_search_ms={slowest_total_ms / len(cases):.0f}")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("fixture")
+  parser.add_argument("--record", action="store_true")
+  args = parser.parse_args()
+
+  with open(args.fixture) as f:
+    cases = json.load(f)
+  if args.record:
+    asyncio.run(record(cases))
+    with open(args.fixture, "w") as f:
+      json.dump(cases, f, indent=2)
+  asyncio.run(evaluate(cases))
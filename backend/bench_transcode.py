@@ -0,0 +1,54 @@
+'''
+Compares transcoding profiles on local sample clips: upload bytes, transcode CPU time and,
+with --analyze, end-to-end upload + Gemini analysis time.
+
+  python bench_transcode.py /tmp/samples/*.mp4
+  python bench_transcode.py clip.mp4 --profiles source lecture --analyze
+'''
+import argparse
+import os
+import resource
+import tempfile
+import time
+
+import video_analyzer
+
+
+def children_cpu_seconds() -> float:
+  usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+  return usage.ru_utime + usage.ru_stime
+
+
+def bench(clip: str, profile: video_analyzer.TranscodeProfile, analyze: bool, out_dir: str) -> dict:
+  output_path = os.path.join(out_dir, f"{os.path.splitext(os.path.basename(clip))[0]}.{profile.name}.mp4")
+  cpu_before, wall_before = children_cpu_seconds(), time.perf_counter()
+  video_analyzer.transcode(clip, output_path, profile)
+  res = {
+    "clip": os.path.basename(clip),
+    "profile": profile.name,
+    "source_mb": os.path.getsize(clip) / 1e6,
+    "upload_mb": os.path.getsize(output_path) / 1e6,
+    "transcode_cpu_s": children_cpu_seconds() - cpu_before,
+    "transcode_wall_s": time.perf_counter() - wall_before,
+  }
+  if analyze:
+    start = time.perf_counter()
+    video_file = video_analyzer.gemini_files.upload(output_path)
+    res["upload_s"] = time.perf_counter() - start
+    video_analyzer.ask_gemini(video_file)
+    res["end_to_end_s"] = time.perf_counter() - wall_before
+  return res
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("clips", nargs="+")
+  parser.add_argument("--profiles", nargs="+", default=list(video_analyzer.TRANSCODE_PROFILES))
+  parser.add_argument("--analyze", action="store_true", help="also upload each output and run the Gemini analysis")
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as out_dir:
+    for clip in args.clips:
+      for name in args.profiles:
+        res = bench(clip, video_analyzer.TRANSCODE_PROFILES[name], args.analyze, out_dir)
+        print("  ".join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in res.items()), flush=True)
@@ -0,0 +1,144 @@
+'''
+Mirrors the freeCodeCamp channel catalog into the Video table with embeddings, so
+search_youtube_videos(mode="catalog") can answer from the pgvector index.
+
+  python catalog_ingest.py                 # incremental: only uploads newer than the last complete walk
+  python catalog_ingest.py --full          # re-walk the whole uploads playlist
+  EMBEDDING_BACKEND=hash python catalog_ingest.py --fixture catalog.json
+
+A fixture is a JSON list of {"video_id", "title", "description", "thumbnail_url", "published_at"} objects
+(e.g. tests/fixtures/catalog.json).
+'''
+import argparse
+import json
+import os
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+
+import httpx
+
+import db
+import embeddings
+import migrations
+from yt_video_recommender import YOUTUBE_API_URL, FCC_CHANNEL_ID
+
+BATCH_SIZE = 50  # playlistItems.list and videos.list page size cap
+MAX_DESCRIPTION_CHARS = 2000
+
+
+def _parse_ts(ts: str) -> datetime:
+  return datetime.fromisoformat(ts.replace("Z", "+00:00"))
+
+
+def iter_channel_uploads(channel_id: str, since: Optional[datetime] = None) -> Iterator[dict]:
+  """
+  Walks the channel's uploads playlist newest-first, stopping at the first video not newer than `since`.
+  """
+  params = {"key": os.environ["YOUTUBE_DEV_KEY"]}
+  with httpx.Client(base_url=YOUTUBE_API_URL, params=params, timeout=30) as client:
+    res = client.get("/channels", params={"part": "contentDetails", "id": channel_id})
+    res.raise_for_status()
+    uploads_playlist = res.json()["items"][0]["contentDetails"]["relatedPlaylists"]["uploads"]
+
+    page_token = None
+    while True:
+      res = client.get("/playlistItems", params={"part": "contentDetails", "playlistId": uploads_playlist, "maxResults": BATCH_SIZE, "pageToken": page_token or ""})
+      res.raise_for_status()
+      page = res.json()
+      video_ids = [item["contentDetails"]["videoId"] for item in page.get("items", [])]
+      if not video_ids:
+        return
+
+      res = client.get("/videos", params={"part": "snippet", "id": ",".join(video_ids)})
+      res.raise_for_status()
+      for item in res.json().get("items", []):
+        published_at = _parse_ts(item["snippet"]["publishedAt"])
+        if since is not None and published_at <= since:
+          return
+        yield {
+          "video_id": item["id"],
+          "title": item["snippet"]["title"],
+          "description": item["snippet"]["description"],
+          "thumbnail_url": item["snippet"]["thumbnails"]["high"]["url"],
+          "published_at": published_at,
+        }
+
+      page_token = page.get("nextPageToken")
+      if not page_token:
+        return
+
+
+def iter_fixture(path: str, since: Optional[datetime] = None) -> Iterator[dict]:
+  with open(path) as f:
+    items = json.load(f)
+  for item in sorted(items, key=lambda x: x["published_at"], reverse=True):
+    item = dict(item, published_at=_parse_ts(item["published_at"]))
+    if since is not None and item["published_at"] <= since:
+      return
+    yield item
+
+
+def ingest(items: Iterator[dict]) -> int:
+  count = 0
+  batch = []
+
+  def flush():
+    texts = [f"{x['title']}\n\n{x['description'][:MAX_DESCRIPTION_CHARS]}" for x in batch]
+    vectors = embeddings.embed(texts)
+    db.upsert_catalog_videos([
+      (
+        db.Video(video_id=x["video_id"], url=f"https://www.youtube.com/watch?v={x['video_id']}", description=x["description"], title=x["title"], thumbnail_url=x["thumbnail_url"]),
+        x["published_at"],
+        embeddings.to_pgvector(vec),
+      )
+      for x, vec in zip(batch, vectors)
+    ])
+    batch.clear()
+
+  for item in items:
+    batch.append(item)
+    count += 1
+    if len(batch) >= BATCH_SIZE:
+      flush()
+      print(f"ingested {count} videos", flush=True)
+  if batch:
+    flush()
+  return count
+
+
+def sync(source: str, walk: Callable[[Optional[datetime]], Iterator[dict]], full: bool = False) -> int:
+  """
+  Ingests what `walk(since)` yields newest-first, down to the watermark of the last complete walk of `source`.
+  The watermark only advances once a walk finishes, so a run cut short (quota, network) leaves it where it
+  was and the next run walks over the gap again, instead of stopping at the newest video stored so far.
+  """
+  since = None if full else db.read_catalog_watermark(source)
+  print(f"ingesting uploads newer than {since}" if since else "ingesting full catalog", flush=True)
+  newest = None
+
+  def track(items: Iterator[dict]) -> Iterator[dict]:
+    nonlocal newest
+    for item in items:
+      if newest is None or item["published_at"] > newest:
+        newest = item["published_at"]
+      yield item
+
+  count = ingest(track(walk(since)))
+  if newest is not None:
+    db.advance_catalog_watermark(source, newest)
+  return count
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--channel-id", default=FCC_CHANNEL_ID)
+  parser.add_argument("--fixture", help="ingest from a local JSON catalog instead of the YouTube API")
+  parser.add_argument("--full", action="store_true", help="ignore already-ingested videos and re-walk the whole catalog")
+  args = parser.parse_args()
+
+  migrations.migrate()
+  if args.fixture:
+    count = sync(f"fixture:{os.path.abspath(args.fixture)}", lambda since: iter_fixture(args.fixture, since), args.full)
+  else:
+    count = sync(f"channel:{args.channel_id}", lambda since: iter_channel_uploads(args.channel_id, since), args.full)
+  print(f"done, {count} videos ingested", flush=True)
@@ -0,0 +1,95 @@
+'''
+Plans where to cut a long video so each chunk fits the model's token budget, using as few chunks
+(and as little overlap) as possible, optionally snapping cuts to caller-supplied boundaries.
+
+  python chunk_planner.py            # tokens saved vs. the fixed 40 min / 5 min overlap scheme
+'''
+import math
+from typing import Optional, Sequence
+
+# Gemini bills video at ~263 tokens/s (sampled at 1 fps) plus 32 tokens/s of audio
+GEMINI_VIDEO_TOKENS_PER_SECOND = 263 + 32
+MODEL_CONTEXT_TOKENS = {
+  "gemini-1.5-flash": 1_048_576,
+  "gemini-1.5-pro": 2_097_152,
+}
+# prompt, previous outline/quiz and the response all share the context with the video
+DEFAULT_RESERVE_TOKENS = 32_000
+
+
+def fixed_plan(duration: float, chunk_duration: int = 40 * 60, overlap: int = 5 * 60) -> list[tuple[float, float]]:
+  """
+  The original scheme: fixed-length chunks with a fixed overlap, regardless of video length.
+  """
+  chunks = []
+  for start_time in range(0, int(duration), chunk_duration - overlap):
+    end_time = min(start_time + chunk_duration, duration)
+    chunks.append((float(start_time), float(end_time)))
+    if end_time >= duration:
+      break
+  return chunks
+
+
+def plan_chunks(
+  duration: float,
+  context_tokens: int = MODEL_CONTEXT_TOKENS["gemini-1.5-flash"],
+  tokens_per_second: float = GEMINI_VIDEO_TOKENS_PER_SECOND,
+  reserve_tokens: int = DEFAULT_RESERVE_TOKENS,
+  max_chunk_duration: Optional[float] = None,
+  overlap: float = 120,
+  boundaries: Sequence[float] = (),
+  snap_window: float = 120,
+  granularity: float = 0,
+) -> list[tuple[float, float]]:
+  """
+  Returns the minimal list of (start, end) chunks covering [0, duration] such that every chunk fits
+  in the token budget, with `overlap` seconds shared between neighbours. An empty video has no chunks.
+
+  :param boundaries: candidate cut times (e.g. chapter starts); each cut moves to the nearest one within `snap_window`
+  :param granularity: if set, cuts are aligned to multiples of it (e.g. the segmenter's segment length)
+  """
+  budget = (context_tokens - reserve_tokens) / tokens_per_second
+  if max_chunk_duration:
+    budget = min(budget, max_chunk_duration)
+  if duration <= 0:
+    return []
+  if duration <= budget:
+    return [(0.0, float(duration))]
+
+  usable = budget - 2 * granularity  # room for rounding cuts onto the grid
+  if usable <= overlap:
+    raise ValueError(f"Chunk budget of {budget:.0f}s leaves no room for {overlap}s of overlap")
+  n = math.ceil((duration - overlap) / (usable - overlap))
+  step = (duration - overlap) / n
+
+  def build(snap: bool) -> list[tuple[float, float]]:
+    starts = [0.0]
+    for i in range(1, n):
+      cut = i * step
+      if snap:
+        near = [b for b in boundaries if abs(b - cut) <= snap_window]
+        if near:
+          cut = min(near, key=lambda b: abs(b - cut))
+      if granularity:
+        cut = round(cut / granularity) * granularity
+      starts.append(cut)
+    ends = [s + overlap for s in starts[1:]] + [float(duration)]
+    return [(s, min(e, float(duration))) for s, e in zip(starts, ends)]
+
+  chunks = build(snap=bool(boundaries))
+  if boundaries and any(e - s > budget or s >= e for s, e in chunks):
+    chunks = build(snap=False)
+  return chunks
+
+
+def plan_tokens(chunks: list[tuple[float, float]], tokens_per_second: float = GEMINI_VIDEO_TOKENS_PER_SECOND) -> int:
+  return int(sum(end - start for start, end in chunks) * tokens_per_second)
+
+
+if __name__ == '__main__':
+  print(f"{'duration':>9} {'fixed':>6} {'fixed_tok':>11} {'planned':>8} {'planned_tok':>12} {'saved':>7}")
+  for minutes in [10, 30, 45, 60, 90, 120, 180, 360, 600, 720]:
+    duration = minutes * 60
+    fixed, planned = fixed_plan(duration), plan_chunks(duration, granularity=60)
+    fixed_tok, planned_tok = plan_tokens(fixed), plan_tokens(planned)
+    print(f"{minutes:>6}min {len(fixed):>6} {fixed_tok:>11,} {len(planned):>8} {planned_tok:>12,} {1 - planned_tok / fixed_tok:>7.1%}")
@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from datetime import datetime
 from typing import List, Optional
 
 @dataclass
@@ -12,6 +13,16 @@ class Library:
   user_id: str
   video_id: Optional[str] = None  # URL can be inferred if needed
 
+@dataclass
+class LibraryItem:
+  # list-view projection of a library video, without the description and outline
+  video_id: str
+  url: str
+  title: str
+  thumbnail_url: str
+  analyzed: bool
+  added_at: datetime
+
 @dataclass
 class Video:
   video_id: str
@@ -33,14 +44,36 @@ class Memory:
   mem_id: str  # Unique identifier for the memory
   memory: str  # The actual memory content
   user_id: str  # User ID to whom this memory belongs
+  session_id: Optional[str] = None  # chat session, for summary and turn rows
+  kind: str = "fact"  # fact, summary (one per session) or turn
+  role: Optional[str] = None  # user or assistant, for turns
+
+@dataclass
+class GeminiFile:
+  content_hash: str  # sha256 of the uploaded file
+  name: str  # remote name, e.g. files/abc123
+  uri: str
+  state: str
+  expires_at: datetime
+
+@dataclass
+class AnalysisJob:
+  video_id: str
+  status: str  # pending, running, done or failed
+  attempts: int
+  max_attempts: int
+  last_error: Optional[str] = None
 
 # ===
 # DB Functions
 # ===
 import os
+import threading
+import time
+from collections import deque
 import psycopg2
 from psycopg2 import sql
-from psycopg2.errors import UndefinedTable
+from psycopg2.extras import execute_values
 
 # Connect to the database
 PG_USER = os.environ["PG_USER"]
@@ -49,17 +82,268 @@ PG_HOST = os.environ["PG_HOST"]
 PG_PORT = os.environ["PG_PORT"]
 PG_DB = os.environ["PG_DB"]
 
+# Pool sizing
+PG_POOL_MIN_SIZE = int(os.environ.get("PG_POOL_MIN_SIZE", 1))
+PG_POOL_MAX_SIZE = int(os.environ.get("PG_POOL_MAX_SIZE", 10))
+PG_POOL_TIMEOUT = float(os.environ.get("PG_POOL_TIMEOUT", 30))  # seconds to wait for a free connection
+PG_POOL_MAX_LIFETIME = float(os.environ.get("PG_POOL_MAX_LIFETIME", 30 * 60))  # seconds before a connection is recycled
+PG_POOL_HEALTH_CHECK_AFTER = float(os.environ.get("PG_POOL_HEALTH_CHECK_AFTER", 60))  # idle seconds before a ping on checkout
+
+# NOTIFY channel for saved analyses, payload "<video_id>:<analysis_version>"
+ANALYSIS_SAVED_CHANNEL = "analysis_saved"
+
+
+class PoolTimeout(Exception):
+  pass
+
+
+class ConnectionPool:
+  """
+  Thread-safe psycopg2 connection pool.
+
+  Connections idle for longer than `health_check_after` are pinged before being handed out,
+  and connections older than `max_lifetime` are closed and replaced on return or checkout.
+  Connecting and pinging happen outside the pool's lock, so a slow or unreachable server only
+  stalls the thread doing it.
+  """
+
+  def __init__(self, min_size: int, max_size: int, timeout: float, max_lifetime: float, health_check_after: float, **conn_kwargs):
+    self.min_size = min_size
+    self.max_size = max_size
+    self.timeout = timeout
+    self.max_lifetime = max_lifetime
+    self.health_check_after = health_check_after
+    self._conn_kwargs = conn_kwargs
+
+    self._cond = threading.Condition()
+    self._idle = deque()  # (conn, returned_at)
+    self._born = {}  # id(conn) -> created_at
+    self._checked_out = {}  # id(conn) -> checked_out_at
+    self._closed = False
+
+    self._stats = {
+      "connections_created": 0,
+      "connections_discarded": 0,
+      "checkouts": 0,
+      "timeouts": 0,
+      "waits": 0,
+      "wait_time_total": 0.0,
+      "wait_time_max": 0.0,
+      "checkout_time_total": 0.0,
+      "checkout_time_max": 0.0,
+    }
+    for _ in range(min_size):
+      self._idle.append((self._connect(), time.monotonic()))
+
+  def _connect(self):
+    conn = psycopg2.connect(**self._conn_kwargs)
+    self._born[id(conn)] = time.monotonic()
+    self._stats["connections_created"] += 1
+    return conn
+
+  def _forget(self, conn):
+    self._born.pop(id(conn), None)
+    self._stats["connections_discarded"] += 1
+
+  @staticmethod
+  def _close(conn):
+    try:
+      conn.close()
+    except Exception:
+      pass
+
+  def _discard(self, conn):
+    self._forget(conn)
+    self._close(conn)
+
+  def _expired(self, conn) -> bool:
+    return conn.closed or time.monotonic() - self._born.get(id(conn), 0) > self.max_lifetime
+
+  @staticmethod
+  def _healthy(conn) -> bool:
+    try:
+      with conn.cursor() as cur:
+        cur.execute("SELECT 1")
+      conn.rollback()
+      return True
+    except psycopg2.Error:
+      return False
+
+  @property
+  def size(self) -> int:
+    return len(self._born)
+
+  def getconn(self):
+    start = time.monotonic()
+    deadline = start + self.timeout
+    waited = False
+    with self._cond:
+      while True:
+        if self._closed:
+          raise PoolTimeout("connection pool is closed")
+
+        if self._idle:
+          conn, idle_since = self._idle.pop()
+          if self._expired(conn):
+            self._discard(conn)
+            continue
+          if time.monotonic() - idle_since >= self.health_check_after:
+            # still counted in size while it is pinged outside the lock
+            self._cond.release()
+            try:
+              healthy = self._healthy(conn)
+            finally:
+              self._cond.acquire()
+            if not healthy or self._closed:
+              self._discard(conn)
+              self._cond.notify()  # its slot is free for a new connection
+              continue
+          return self._checkout(conn, start, waited)
+
+        if self.size < self.max_size:
+          # reserve the slot before releasing the lock for the (slow) connect
+          placeholder = object()
+          self._born[id(placeholder)] = time.monotonic()
+          self._cond.release()
+          try:
+            conn = psycopg2.connect(**self._conn_kwargs)
+          finally:
+            self._cond.acquire()
+            self._born.pop(id(placeholder), None)
+            self._cond.notify()
+          self._born[id(conn)] = time.monotonic()
+          self._stats["connections_created"] += 1
+          return self._checkout(conn, start, waited)
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          self._stats["timeouts"] += 1
+          raise PoolTimeout(f"no connection available within {self.timeout}s (max_size={self.max_size})")
+        waited = True
+        self._cond.wait(remaining)
+
+  def _checkout(self, conn, start: float, waited: bool):
+    now = time.monotonic()
+    wait_time = now - start
+    self._stats["checkouts"] += 1
+    if waited:
+      self._stats["waits"] += 1
+    self._stats["wait_time_total"] += wait_time
+    self._stats["wait_time_max"] = max(self._stats["wait_time_max"], wait_time)
+    self._checked_out[id(conn)] = now
+    return conn
+
+  def putconn(self, conn, discard: bool = False):
+    """
+    Returns a connection to the pool. Never raises: it runs in with_connection's finally, where an
+    exception would replace the call's result or its original error.
+    """
+    placeholder = None
+    with self._cond:
+      checked_out_at = self._checked_out.pop(id(conn), None)
+      if checked_out_at is not None:
+        held = time.monotonic() - checked_out_at
+        self._stats["checkout_time_total"] += held
+        self._stats["checkout_time_max"] = max(self._stats["checkout_time_max"], held)
+
+      if not (discard or self._closed or self._expired(conn)):
+        self._idle.append((conn, time.monotonic()))
+        self._cond.notify()
+        return
+      self._forget(conn)
+      if not self._closed and self.size < self.min_size:
+        # reserve the slot for the replacement, connected below without the lock
+        placeholder = object()
+        self._born[id(placeholder)] = time.monotonic()
+      self._cond.notify()
+
+    self._close(conn)
+    if placeholder is None:
+      return
+    try:
+      new_conn = psycopg2.connect(**self._conn_kwargs)
+    except Exception as e:
+      # getconn connects on demand, so the pool only runs below min_size until then
+      print(f"Couldn't replenish the connection pool: {e}", flush=True)
+      new_conn = None
+    with self._cond:
+      self._born.pop(id(placeholder), None)
+      if new_conn is not None and not self._closed:
+        self._born[id(new_conn)] = time.monotonic()
+        self._stats["connections_created"] += 1
+        self._idle.append((new_conn, time.monotonic()))
+        new_conn = None
+      self._cond.notify()
+    if new_conn is not None:
+      self._close(new_conn)
+
+  def close(self):
+    with self._cond:
+      self._closed = True
+      while self._idle:
+        conn, _ = self._idle.pop()
+        self._discard(conn)
+      self._cond.notify_all()
+
+  def stats(self) -> dict:
+    with self._cond:
+      ret = dict(self._stats)
+      checkouts = ret["checkouts"] or 1
+      ret.update({
+        "size": self.size,
+        "in_use": len(self._checked_out),
+        "idle": len(self._idle),
+        "min_size": self.min_size,
+        "max_size": self.max_size,
+        "wait_time_avg": ret["wait_time_total"] / checkouts,
+        "checkout_time_avg": ret["checkout_time_total"] / checkouts,
+      })
+      return ret
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+  global _pool
+  if _pool is None:
+    with _pool_lock:
+      if _pool is None:
+        _pool = ConnectionPool(
+          min_size=PG_POOL_MIN_SIZE,
+          max_size=PG_POOL_MAX_SIZE,
+          timeout=PG_POOL_TIMEOUT,
+          max_lifetime=PG_POOL_MAX_LIFETIME,
+          health_check_after=PG_POOL_HEALTH_CHECK_AFTER,
+          dbname=PG_DB, user=PG_USER, password=PG_PASSWORD, host=PG_HOST, port=PG_PORT,
+        )
+  return _pool
+
+def pool_stats() -> dict:
+  return get_pool().stats()
+
+def close_pool():
+  global _pool
+  with _pool_lock:
+    if _pool is not None:
+      _pool.close()
+      _pool = None
+
 
 def with_connection(func):
   """
-  Function decorator for passing connections
+  Function decorator for passing pooled connections
   """
 
   def connection(*args, **kwargs):
-    # Here, you may even use a connection pool
-    conn = psycopg2.connect(dbname=PG_DB, user=PG_USER, password=PG_PASSWORD, host=PG_HOST, port=PG_PORT)
+    pool = get_pool()
+    conn = pool.getconn()
+    broken = False
     try:
       rv = func(conn, *args, **kwargs)
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+      broken = True
+      raise e
     except Exception as e:
       conn.rollback()
       raise e
@@ -67,69 +351,11 @@ def with_connection(func):
       # Can decide to see if you need to commit the transaction or not
       conn.commit()
     finally:
-      conn.close()
+      pool.putconn(conn, discard=broken or conn.closed)
     return rv
 
   return connection
 
-@with_connection
-def create_tables(conn):
-  cur = conn.cursor()
-  query = '''
--- User Table
-CREATE TABLE IF NOT EXISTS Users (
-  user_id TEXT PRIMARY KEY,
-  name TEXT NOT NULL,
-  email TEXT NOT NULL
-);
-
--- Video Table
-CREATE TABLE IF NOT EXISTS Video (
-  video_id TEXT PRIMARY KEY,
-  url TEXT NOT NULL,
-  description TEXT NOT NULL,
-  title TEXT NOT NULL,
-  thumbnail_url TEXT NOT NULL,
-  outline TEXT
-);
-
--- Library Table
-CREATE TABLE IF NOT EXISTS Library (
-  user_id TEXT NOT NULL REFERENCES Users(user_id),
-  video_id TEXT NOT NULL REFERENCES Video(video_id),
-  PRIMARY KEY (user_id, video_id)
-);
-
--- Quiz Table
-CREATE TABLE IF NOT EXISTS Quiz (
-  qid TEXT PRIMARY KEY,
-  video_id TEXT NOT NULL REFERENCES Video(video_id),
-  question TEXT NOT NULL,
-  answer TEXT NOT NULL
-);
-
--- Memory Table
-CREATE TABLE IF NOT EXISTS Memory (
-  mem_id TEXT PRIMARY KEY,
-  memory TEXT NOT NULL,
-  user_id TEXT NOT NULL REFERENCES Users(user_id)
-);
-  '''
-  cur.execute(query)
-  cur.close()
-
-@with_connection
-def check_and_create_tables(conn):
-    required_tables = ["users", "video", "library", "memory", "quiz"]
-    for table in required_tables:
-        try:
-            with conn.cursor() as cur:
-                cur.execute(f"SELECT 1 FROM {table} LIMIT 1")
-        except UndefinedTable:
-            print(f"Table {table} is missing. Creating tables...")
-            create_tables()  # Call to create tables if any are missing
-            break
-
 # ===
 # Users
 # ===
@@ -198,6 +424,7 @@ def check_user_by_email(conn, email: str) -> bool:
 def create_video(conn, video: Video):
   insert_query = """
   INSERT INTO Video (video_id, url, description, title, thumbnail_url, outline) VALUES (%s, %s, %s, %s, %s, %s)
+  ON CONFLICT (video_id) DO NOTHING
   """
   with conn.cursor() as cur:
     cur.execute(insert_query, (video.video_id, video.url, video.description, video.title, video.thumbnail_url, video.outline))
@@ -251,6 +478,52 @@ def get_videos_by_user(conn, user_id: str) -> List[Video]:
     results = cur.fetchall()
     return [Video(video_id=row[0], url=row[1], description=row[2], title=row[3], thumbnail_url=row[4], outline=row[5]) for row in results]
 
+@with_connection
+def read_catalog_watermark(conn, source: str) -> Optional[datetime]:
+  """
+  Returns the publish time of the newest video seen by the last complete walk of `source`, or None if none completed.
+  """
+  with conn.cursor() as cur:
+    cur.execute("SELECT synced_until FROM CatalogSync WHERE source = %s", (source,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+@with_connection
+def advance_catalog_watermark(conn, source: str, synced_until: datetime):
+  """
+  Records a complete walk of `source` down to the previous watermark; the watermark never moves back.
+  """
+  upsert_query = """
+  INSERT INTO CatalogSync (source, synced_until) VALUES (%s, %s)
+  ON CONFLICT (source) DO UPDATE SET
+    synced_until = GREATEST(CatalogSync.synced_until, EXCLUDED.synced_until),
+    completed_at = now()
+  """
+  with conn.cursor() as cur:
+    cur.execute(upsert_query, (source, synced_until))
+
+@with_connection
+def upsert_catalog_videos(conn, rows: list):
+  """
+  Inserts or refreshes catalog videos, leaving any existing outline untouched.
+
+  :param conn: Database connection
+  :param rows: List of (Video, published_at, embedding) tuples, embedding as a pgvector literal
+  """
+  insert_query = """
+  INSERT INTO Video (video_id, url, description, title, thumbnail_url, published_at, embedding) VALUES %s
+  ON CONFLICT (video_id) DO UPDATE SET
+    url = EXCLUDED.url,
+    description = EXCLUDED.description,
+    title = EXCLUDED.title,
+    thumbnail_url = EXCLUDED.thumbnail_url,
+    published_at = EXCLUDED.published_at,
+    embedding = EXCLUDED.embedding
+  """
+  values = [(v.video_id, v.url, v.description, v.title, v.thumbnail_url, published_at, embedding) for v, published_at, embedding in rows]
+  with conn.cursor() as cur:
+    execute_values(cur, insert_query, values, template="(%s, %s, %s, %s, %s, %s, %s::vector)")
+
 # ===
 # Library
 # ===
@@ -362,6 +635,34 @@ def read_quizzes_by_video(conn, video_id: str) -> List[Quiz]:
     results = cur.fetchall()
     return [Quiz(qid=row[0], video_id=row[1], question=row[2], answer=row[3]) for row in results]
 
+@with_connection
+def save_analysis(conn, video_id: str, outline: str, quizzes: List[Quiz]) -> int:
+  """
+  Stores a video's outline and replaces its quiz set in a single transaction, so readers see either
+  the previous analysis or the new one, never a mix. The video row is locked first, which also
+  serializes concurrent re-analyses of the same video. Listeners on ANALYSIS_SAVED_CHANNEL are
+  notified when the transaction commits.
+
+  :param conn: Database connection
+  :param video_id: Video ID the analysis belongs to
+  :param outline: The new outline
+  :param quizzes: The new quiz questions, replacing all existing ones
+  :return: The new analysis version of the video
+  """
+  with conn.cursor() as cur:
+    cur.execute("UPDATE Video SET outline = %s, analysis_version = analysis_version + 1 WHERE video_id = %s RETURNING analysis_version", (outline, video_id))
+    result = cur.fetchone()
+    if result is None:
+      raise ValueError(f"Video {video_id} does not exist")
+    cur.execute("DELETE FROM Quiz WHERE video_id = %s", (video_id,))
+    execute_values(
+      cur,
+      "INSERT INTO Quiz (qid, video_id, question, answer) VALUES %s",
+      [(q.qid, video_id, q.question, q.answer) for q in quizzes],
+    )
+    cur.execute("SELECT pg_notify(%s, %s)", (ANALYSIS_SAVED_CHANNEL, f"{video_id}:{result[0]}"))
+    return result[0]
+
 # ===
 # Memory
 # ===
@@ -405,7 +706,7 @@ def delete_memory(conn, mem_id: str):
 @with_connection
 def read_memories_by_user(conn, user_id: str) -> List[Memory]:
   """
-  Reads all memories for a specific user.
+  Reads all long-term memories (not chat session rows) for a specific user.
 
   :param conn: Database connection
   :param user_id: User ID whose memories are to be retrieved
@@ -414,10 +715,134 @@ def read_memories_by_user(conn, user_id: str) -> List[Memory]:
   select_query = """
   SELECT mem_id, memory, user_id
   FROM Memory
-  WHERE user_id = %s
+  WHERE user_id = %s AND kind = 'fact'
   """
   with conn.cursor() as cur:
     cur.execute(select_query, (user_id,))
     results = cur.fetchall()
     return [Memory(mem_id=row[0], memory=row[1], user_id=row[2]) for row in results]
 
+
+# ===
+# Analysis Jobs
+# ===
+@with_connection
+def enqueue_analysis_job(conn, video_id: str):
+  """
+  Queues a video for analysis. A video has at most one job, so repeated enqueues are no-ops,
+  except that a job which previously failed for good is reset and retried.
+
+  :param conn: Database connection
+  :param video_id: Video ID to analyze
+  """
+  insert_query = """
+  INSERT INTO AnalysisJob (video_id) VALUES (%s)
+  ON CONFLICT (video_id) DO UPDATE SET status = 'pending', attempts = 0, run_after = now(), last_error = NULL, updated_at = now()
+  WHERE AnalysisJob.status = 'failed'
+  """
+  with conn.cursor() as cur:
+    cur.execute(insert_query, (video_id,))
+
+
+@with_connection
+def read_analysis_job(conn, video_id: str) -> Optional[AnalysisJob]:
+  select_query = """
+  SELECT video_id, status, attempts, max_attempts, last_error FROM AnalysisJob WHERE video_id = %s
+  """
+  with conn.cursor() as cur:
+    cur.execute(select_query, (video_id,))
+    result = cur.fetchone()
+    return AnalysisJob(*result) if result else None
+
+
+@with_connection
+def claim_analysis_jobs(conn, limit: int, visibility_timeout: float) -> List[AnalysisJob]:
+  """
+  Claims up to `limit` runnable jobs for this worker. Claimed jobs stay invisible to other workers for
+  `visibility_timeout` seconds; if the worker dies without finishing, they become claimable again.
+
+  :param conn: Database connection
+  :param limit: Maximum number of jobs to claim
+  :param visibility_timeout: Seconds before an unfinished claim expires
+  :return: List of claimed AnalysisJob objects
+  """
+  expire_query = """
+  UPDATE AnalysisJob SET status = 'failed', last_error = COALESCE(last_error, 'visibility timeout exceeded'), locked_until = NULL, updated_at = now()
+  WHERE status = 'running' AND locked_until < now() AND attempts >= max_attempts
+  """
+  claim_query = """
+  UPDATE AnalysisJob j
+  SET status = 'running', attempts = j.attempts + 1, locked_until = now() + make_interval(secs => %s), updated_at = now()
+  FROM (
+    SELECT video_id FROM AnalysisJob
+    WHERE (status = 'pending' AND run_after <= now()) OR (status = 'running' AND locked_until < now())
+    ORDER BY run_after
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+  ) claimable
+  WHERE j.video_id = claimable.video_id
+  RETURNING j.video_id, j.status, j.attempts, j.max_attempts, j.last_error
+  """
+  with conn.cursor() as cur:
+    cur.execute(expire_query)
+    cur.execute(claim_query, (visibility_timeout, limit))
+    return [AnalysisJob(*row) for row in cur.fetchall()]
+
+
+@with_connection
+def extend_analysis_job(conn, video_id: str, visibility_timeout: float):
+  update_query = """
+  UPDATE AnalysisJob SET locked_until = now() + make_interval(secs => %s), updated_at = now()
+  WHERE video_id = %s AND status = 'running'
+  """
+  with conn.cursor() as cur:
+    cur.execute(update_query, (visibility_timeout, video_id))
+
+
+@with_connection
+def complete_analysis_job(conn, video_id: str):
+  update_query = """
+  UPDATE AnalysisJob SET status = 'done', locked_until = NULL, last_error = NULL, updated_at = now() WHERE video_id = %s
+  """
+  with conn.cursor() as cur:
+    cur.execute(update_query, (video_id,))
+
+
+@with_connection
+def fail_analysis_job(conn, job: AnalysisJob, error: str, retry_delay: float, permanent: bool = False):
+  """
+  Records a failed attempt: the job is retried after `retry_delay` seconds, or marked failed once out of attempts
+  (or right away if `permanent`, for errors a retry can't fix).
+  """
+  update_query = """
+  UPDATE AnalysisJob
+  SET status = CASE WHEN attempts >= max_attempts OR %s THEN 'failed' ELSE 'pending' END,
+      run_after = now() + make_interval(secs => %s),
+      locked_until = NULL, last_error = %s, updated_at = now()
+  WHERE video_id = %s
+  """
+  with conn.cursor() as cur:
+    cur.execute(update_query, (permanent, retry_delay, error, job.video_id))
+
+# ===
+# Gemini Files
+# ===
+@with_connection
+def read_gemini_file(conn, content_hash: str) -> Optional[GeminiFile]:
+  select_query = """
+  SELECT content_hash, name, uri, state, expires_at FROM GeminiFile WHERE content_hash = %s
+  """
+  with conn.cursor() as cur:
+    cur.execute(select_query, (content_hash,))
+    result = cur.fetchone()
+    return GeminiFile(*result) if result else None
+
+
+@with_connection
+def upsert_gemini_file(conn, gemini_file: GeminiFile):
+  insert_query = """
+  INSERT INTO GeminiFile (content_hash, name, uri, state, expires_at) VALUES (%s, %s, %s, %s, %s)
+  ON CONFLICT (content_hash) DO UPDATE SET name = EXCLUDED.name, uri = EXCLUDED.uri, state = EXCLUDED.state, expires_at = EXCLUDED.expires_at, created_at = now()
+  """
+  with conn.cursor() as cur:
+    cur.execute(insert_query, (gemini_file.content_hash, gemini_file.name, gemini_file.uri, gemini_file.state, gemini_file.expires_at))
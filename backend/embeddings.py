@@ -0,0 +1,45 @@
+'''
+Text embeddings for pgvector search.
+
+EMBEDDING_BACKEND=gemini (default) uses the Gemini embedding API.
+EMBEDDING_BACKEND=hash uses a deterministic, offline feature-hashing stand-in so
+ingestion and search can be exercised against fixtures without network access.
+'''
+import hashlib
+import math
+import os
+import re
+
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "gemini")
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "models/text-embedding-004")
+EMBEDDING_DIM = int(os.environ.get("EMBEDDING_DIM", 768))  # the schema's vector columns are fixed by migration, see migrations.py
+
+
+def hash_embed(text: str, dim: int = EMBEDDING_DIM) -> list[float]:
+  vec = [0.0] * dim
+  tokens = re.findall(r"\w+", text.lower())
+  for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+    h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+    vec[h % dim] += 1.0 if (h >> 63) & 1 else -1.0
+  norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+  return [x / norm for x in vec]
+
+
+def embed(texts: list[str], task_type: str = "retrieval_document") -> list[list[float]]:
+  if EMBEDDING_BACKEND == "hash":
+    return [hash_embed(t) for t in texts]
+  import google.generativeai as genai
+  res = genai.embed_content(model=EMBEDDING_MODEL, content=texts, task_type=task_type)
+  return res["embedding"]
+
+
+async def aembed(texts: list[str], task_type: str = "retrieval_query") -> list[list[float]]:
+  if EMBEDDING_BACKEND == "hash":
+    return [hash_embed(t) for t in texts]
+  import google.generativeai as genai
+  res = await genai.embed_content_async(model=EMBEDDING_MODEL, content=texts, task_type=task_type)
+  return res["embedding"]
+
+
+def to_pgvector(vec: list[float]) -> str:
+  return "[" + ",".join(f"{x:.6f}" for x in vec) + "]"
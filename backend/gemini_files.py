@@ -0,0 +1,78 @@
+'''
+Registry of files uploaded to the Gemini File API, keyed by content hash, so identical chunks are
+uploaded once and reused across jobs and users until they expire.
+'''
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+import db
+
+# reuse an upload only if it stays valid at least this long (an analysis can take a while)
+GEMINI_FILE_EXPIRY_MARGIN = timedelta(seconds=float(os.environ.get("GEMINI_FILE_EXPIRY_MARGIN", 2 * 60 * 60)))
+GEMINI_FILE_POLL_MAX_DELAY = float(os.environ.get("GEMINI_FILE_POLL_MAX_DELAY", 30))
+GEMINI_FILE_PROCESSING_TIMEOUT = float(os.environ.get("GEMINI_FILE_PROCESSING_TIMEOUT", 30 * 60))
+
+_hashes = {}  # (path, size, mtime) -> sha256
+_hashes_lock = threading.Lock()
+
+
+def file_hash(file_path: str) -> str:
+  stat = os.stat(file_path)
+  key = (file_path, stat.st_size, stat.st_mtime_ns)
+  with _hashes_lock:
+    if key in _hashes:
+      return _hashes[key]
+  h = hashlib.sha256()
+  with open(file_path, "rb") as f:
+    for block in iter(lambda: f.read(1 << 20), b""):
+      h.update(block)
+  with _hashes_lock:
+    _hashes[key] = h.hexdigest()
+  return _hashes[key]
+
+
+def upload(file_path: str):
+  video_file = genai.upload_file(path=file_path)
+  print(f'Uploading {file_path} as {video_file.name}', flush=True)
+  # poll with exponential backoff: small clips are ready in a second or two, long ones take minutes
+  delay, deadline = 1.0, time.monotonic() + GEMINI_FILE_PROCESSING_TIMEOUT
+  while video_file.state.name == "PROCESSING":
+    if time.monotonic() > deadline:
+      raise TimeoutError(f"{video_file.name} still processing after {GEMINI_FILE_PROCESSING_TIMEOUT}s")
+    time.sleep(delay)
+    delay = min(delay * 2, GEMINI_FILE_POLL_MAX_DELAY)
+    video_file = genai.get_file(video_file.name)
+
+  if video_file.state.name == "FAILED":
+    raise ValueError(video_file.state.name)
+  return video_file
+
+
+def get_or_upload(file_path: str):
+  """
+  Returns an ACTIVE Gemini file for the given local file, reusing a registered upload of the same
+  content when it is not about to expire, and uploading (then registering) it otherwise.
+  """
+  content_hash = file_hash(file_path)
+  registered = db.read_gemini_file(content_hash)
+  if registered and registered.state == "ACTIVE" and registered.expires_at > datetime.now(timezone.utc) + GEMINI_FILE_EXPIRY_MARGIN:
+    try:
+      return genai.get_file(registered.name)
+    except (google_exceptions.NotFound, google_exceptions.PermissionDenied):
+      print(f"Registered upload {registered.name} is gone, re-uploading", flush=True)
+
+  video_file = upload(file_path)
+  db.upsert_gemini_file(db.GeminiFile(
+    content_hash=content_hash,
+    name=video_file.name,
+    uri=video_file.uri,
+    state=video_file.state.name,
+    expires_at=video_file.expiration_time,
+  ))
+  return video_file
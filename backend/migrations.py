@@ -0,0 +1,205 @@
+'''
+Versioned schema migrations. Pending migrations run in order, in one transaction, under an advisory lock,
+so concurrent starts (API replicas, workers) wait for whichever applies them. Applied versions are
+recorded in schema_migrations. Migrations are append-only: never edit one that has shipped.
+
+  python migrations.py            # apply pending migrations
+  python migrations.py --check    # EXPLAIN the hot queries and fail if one of them stops using an index
+'''
+import argparse
+import json
+import sys
+
+import async_db
+import db
+from embeddings import EMBEDDING_DIM, to_pgvector
+
+MIGRATION_LOCK_ID = 7_204_311  # arbitrary, shared by every process that migrates this database
+
+MIGRATIONS = [
+  (1, "initial schema", '''
+-- User Table
+CREATE TABLE IF NOT EXISTS Users (
+  user_id TEXT PRIMARY KEY,
+  name TEXT NOT NULL,
+  email TEXT NOT NULL
+);
+
+-- Video Table
+CREATE TABLE IF NOT EXISTS Video (
+  video_id TEXT PRIMARY KEY,
+  url TEXT NOT NULL,
+  description TEXT NOT NULL,
+  title TEXT NOT NULL,
+  thumbnail_url TEXT NOT NULL,
+  outline TEXT,
+  analysis_version INT NOT NULL DEFAULT 0
+);
+ALTER TABLE Video ADD COLUMN IF NOT EXISTS analysis_version INT NOT NULL DEFAULT 0;
+
+-- Library Table
+CREATE TABLE IF NOT EXISTS Library (
+  user_id TEXT NOT NULL REFERENCES Users(user_id),
+  video_id TEXT NOT NULL REFERENCES Video(video_id),
+  PRIMARY KEY (user_id, video_id)
+);
+
+-- Quiz Table
+CREATE TABLE IF NOT EXISTS Quiz (
+  qid TEXT PRIMARY KEY,
+  video_id TEXT NOT NULL REFERENCES Video(video_id),
+  question TEXT NOT NULL,
+  answer TEXT NOT NULL
+);
+
+-- Memory Table
+CREATE TABLE IF NOT EXISTS Memory (
+  mem_id TEXT PRIMARY KEY,
+  memory TEXT NOT NULL,
+  user_id TEXT NOT NULL REFERENCES Users(user_id)
+);
+
+-- Analysis Job Table (one row per video, so concurrent enqueues dedupe)
+CREATE TABLE IF NOT EXISTS AnalysisJob (
+  video_id TEXT PRIMARY KEY REFERENCES Video(video_id),
+  status TEXT NOT NULL DEFAULT 'pending',
+  attempts INT NOT NULL DEFAULT 0,
+  max_attempts INT NOT NULL DEFAULT 5,
+  run_after TIMESTAMPTZ NOT NULL DEFAULT now(),
+  locked_until TIMESTAMPTZ,
+  last_error TEXT,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS analysisjob_claim_idx ON AnalysisJob (run_after) WHERE status IN ('pending', 'running');
+
+-- Gemini File Table (uploaded chunks, reusable until they expire)
+CREATE TABLE IF NOT EXISTS GeminiFile (
+  content_hash TEXT PRIMARY KEY,
+  name TEXT NOT NULL,
+  uri TEXT NOT NULL,
+  state TEXT NOT NULL,
+  expires_at TIMESTAMPTZ NOT NULL,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+'''),
+  (2, "indexes for hot lookups", '''
+CREATE INDEX IF NOT EXISTS quiz_video_id_idx ON Quiz (video_id);
+CREATE INDEX IF NOT EXISTS memory_user_id_idx ON Memory (user_id);
+CREATE INDEX IF NOT EXISTS users_email_idx ON Users (email);
+CREATE INDEX IF NOT EXISTS library_video_id_idx ON Library (video_id);
+'''),
+  (3, "library added_at for keyset pagination", '''
+ALTER TABLE Library ADD COLUMN IF NOT EXISTS added_at TIMESTAMPTZ NOT NULL DEFAULT now();
+CREATE INDEX IF NOT EXISTS library_user_added_idx ON Library (user_id, added_at DESC, video_id DESC);
+'''),
+  (4, "chat sessions in Memory", '''
+ALTER TABLE Memory ADD COLUMN IF NOT EXISTS session_id TEXT;
+ALTER TABLE Memory ADD COLUMN IF NOT EXISTS kind TEXT NOT NULL DEFAULT 'fact';
+ALTER TABLE Memory ADD COLUMN IF NOT EXISTS role TEXT;
+ALTER TABLE Memory ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ NOT NULL DEFAULT now();
+CREATE INDEX IF NOT EXISTS memory_session_idx ON Memory (session_id, kind, created_at) WHERE session_id IS NOT NULL;
+'''),
+  # vector(768) is text-embedding-004's size; changing EMBEDDING_DIM needs a new migration that alters both columns
+  (5, "memory embeddings", '''
+CREATE EXTENSION IF NOT EXISTS vector;
+ALTER TABLE Memory ADD COLUMN IF NOT EXISTS embedding vector(768);
+'''),
+  (6, "catalog search", '''
+CREATE EXTENSION IF NOT EXISTS vector;
+ALTER TABLE Video ADD COLUMN IF NOT EXISTS published_at TIMESTAMPTZ;
+ALTER TABLE Video ADD COLUMN IF NOT EXISTS embedding vector(768);
+CREATE INDEX IF NOT EXISTS video_embedding_hnsw_idx ON Video USING hnsw (embedding vector_cosine_ops);
+'''),
+  (7, "catalog sync watermark", '''
+CREATE TABLE IF NOT EXISTS CatalogSync (
+  source TEXT PRIMARY KEY,
+  synced_until TIMESTAMPTZ NOT NULL,
+  completed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+'''),
+]
+
+# queries run on every page view or login, taken from async_db, with sample parameters; each must be served from an index
+HOT_QUERIES = {
+  "read_quizzes_by_video": (async_db.READ_QUIZZES_BY_VIDEO_QUERY, ("video",)),
+  "read_memories_by_user": (async_db.READ_MEMORIES_BY_USER_QUERY, ("user",)),
+  "check_user_by_email": (async_db.CHECK_USER_BY_EMAIL_QUERY, ("user@example.com",)),
+  "check_video_in_library": (async_db.CHECK_VIDEO_IN_LIBRARY_QUERY, ("user", "video")),
+  "top_k_memories": (async_db.TOP_K_MEMORIES_QUERY, ("user", to_pgvector([1.0] + [0.0] * (EMBEDDING_DIM - 1)), 5, None)),
+  "read_library_page": (async_db.READ_LIBRARY_PAGE_QUERY, ("user", None, None, None, 20)),
+  "read_library_page_search": (async_db.READ_LIBRARY_PAGE_QUERY, ("user", "2024-01-01T00:00:00Z", "video", "%python%", 20)),
+  "read_video_analysis": (async_db.READ_VIDEO_ANALYSIS_QUERY, ("video",)),
+}
+
+
+@db.with_connection
+def migrate(conn) -> list[int]:
+  """
+  Applies pending migrations.
+
+  :param conn: Database connection
+  :return: Versions applied by this call
+  """
+  with conn.cursor() as cur:
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+      version INT PRIMARY KEY,
+      name TEXT NOT NULL,
+      applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    ''')
+    cur.execute("SELECT version FROM schema_migrations")
+    applied = {row[0] for row in cur.fetchall()}
+    pending = [m for m in MIGRATIONS if m[0] not in applied]
+    for version, name, query in pending:
+      print(f"Applying migration {version}: {name}", flush=True)
+      cur.execute(query)
+      cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+  return [version for version, _, _ in pending]
+
+
+def _seq_scans(plan: dict) -> list[str]:
+  scans = [plan.get("Relation Name", "?")] if plan["Node Type"] == "Seq Scan" else []
+  for child in plan.get("Plans", []):
+    scans += _seq_scans(child)
+  return scans
+
+
+@db.with_connection
+def check_indexes(conn) -> dict:
+  """
+  EXPLAINs every hot query with sequential scans disabled; the planner still picks one when no usable
+  index exists, so any Seq Scan left in the plan is a missing index. The queries use asyncpg's $n
+  placeholders, so each is PREPAREd (as asyncpg does) and its EXECUTE with the sample parameters explained.
+
+  :param conn: Database connection
+  :return: Query name -> list of tables still scanned sequentially
+  """
+  ret = {}
+  with conn.cursor() as cur:
+    cur.execute("SET LOCAL enable_seqscan = off")
+    for name, (query, params) in HOT_QUERIES.items():
+      cur.execute(f"PREPARE hot_query AS {query}")
+      cur.execute(f"EXPLAIN (FORMAT JSON) EXECUTE hot_query ({', '.join(['%s'] * len(params))})", params)
+      plan = cur.fetchone()[0]
+      cur.execute("DEALLOCATE hot_query")
+      plan = json.loads(plan) if isinstance(plan, str) else plan
+      ret[name] = _seq_scans(plan[0]["Plan"])
+  return ret
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--check", action="store_true", help="fail if a hot query stops using an index")
+  args = parser.parse_args()
+
+  applied = migrate()
+  print(f"Applied migrations: {applied}" if applied else "Schema is up to date", flush=True)
+  if args.check:
+    failures = {name: tables for name, tables in check_indexes().items() if tables}
+    for name, tables in failures.items():
+      print(f"FAIL {name}: sequential scan on {', '.join(tables)}")
+    print("All hot queries use an index" if not failures else f"{len(failures)} hot queries without an index")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,100 @@
+'''
+Prompt templates from prompts/, read and compiled once and recompiled only when a file's mtime changes,
+so editing a prompt takes effect without a restart while requests don't touch the disk.
+
+  python prompt_registry.py       # micro-benchmark of per-request prompt assembly, before and after
+'''
+import os
+import threading
+import time
+
+from jinja2 import Template
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts")
+PROMPT_RELOAD_CHECK_INTERVAL = float(os.environ.get("PROMPT_RELOAD_CHECK_INTERVAL", 2))  # seconds between mtime checks of a file
+
+
+class PromptRegistry:
+  def __init__(self, root: str = PROMPTS_DIR, check_interval: float = PROMPT_RELOAD_CHECK_INTERVAL):
+    self.root = root
+    self.check_interval = check_interval
+    self._entries = {}  # name -> (mtime_ns, checked_at, source, template)
+    self._lock = threading.Lock()
+    self.reloads = 0
+    for file_name in sorted(os.listdir(root)):
+      if file_name.endswith(".txt"):
+        self._get(file_name[:-len(".txt")])
+
+  def _get(self, name: str) -> tuple:
+    now = time.monotonic()
+    entry = self._entries.get(name)
+    if entry is not None and now - entry[1] < self.check_interval:
+      return entry
+    path = os.path.join(self.root, f"{name}.txt")
+    mtime = os.stat(path).st_mtime_ns
+    with self._lock:
+      entry = self._entries.get(name)
+      if entry is None or entry[0] != mtime:
+        with open(path) as f:
+          source = f.read()
+        if entry is not None:
+          self.reloads += 1
+        entry = (mtime, now, source, Template(source))
+      else:
+        entry = (entry[0], now, entry[2], entry[3])
+      self._entries[name] = entry
+    return entry
+
+  def text(self, name: str) -> str:
+    """
+    Raw contents of prompts/<name>.txt, for prompts used as-is (e.g. system prompts).
+    """
+    return self._get(name)[2]
+
+  def template(self, name: str) -> Template:
+    return self._get(name)[3]
+
+  def render(self, name: str, **kwargs) -> str:
+    return self.template(name).render(**kwargs)
+
+  def stats(self) -> dict:
+    return {"prompts": sorted(self._entries), "reloads": self.reloads}
+
+
+registry = PromptRegistry()
+
+
+if __name__ == '__main__':
+  import json
+  import timeit
+
+  from pydantic import BaseModel, Field
+
+  import structured_llm_output as llm
+
+  class SearchQueries(BaseModel):
+    scratch_pad: str = Field(desc='a scratchpad for you to layout your thoughts, before writing down the queries')
+    queries: list[str] = Field(desc='alternative search queries, 3-8 words each', min_length=1, max_length=3)
+
+  quiz = json.dumps([{"question": f"Question {i}?", "answer": f"Answer {i}"} for i in range(30)])
+  uncached_schema_prompt = llm.generate_response_prompt.__wrapped__
+
+  def before():
+    with open(os.path.join(PROMPTS_DIR, "recommend_videos_chat.txt")) as f:
+      f.read()
+    with open(os.path.join(PROMPTS_DIR, "recommend_videos_keyword_gen.txt")) as f:
+      f.read()
+    with open(os.path.join(PROMPTS_DIR, "video_analyzer.txt")) as f:
+      Template(f.read()).render(outline="# Outline", quiz_questions=quiz, part=None)
+    uncached_schema_prompt(SearchQueries)
+
+  def after():
+    registry.text("recommend_videos_chat")
+    registry.text("recommend_videos_keyword_gen")
+    registry.render("video_analyzer", outline="# Outline", quiz_questions=quiz, part=None)
+    llm.generate_response_prompt(SearchQueries)
+
+  n = 2000
+  for name, fn in [("read + compile per request", before), ("registry", after)]:
+    seconds = min(timeit.repeat(fn, number=n, repeat=3)) / n
+    print(f"{name:>28}: {seconds * 1e6:8.1f} us per request")
@@ -0,0 +1,37 @@
+import asyncio
+
+
+def reciprocal_rank_fusion(result_lists: list[list[dict]], k: int = 60) -> list[dict]:
+    """
+    Merge ranked video lists, scoring each video by sum(1 / (k + rank)) over the lists it appears in.
+    """
+    scores, videos = {}, {}
+    for results in result_lists:
+        for rank, video in enumerate(results, start=1):
+            scores[video["video_id"]] = scores.get(video["video_id"], 0.0) + 1.0 / (k + rank)
+            videos.setdefault(video["video_id"], video)
+    return [videos[video_id] for video_id in sorted(scores, key=scores.get, reverse=True)]
+
+
+async def multi_search(queries: list[str], search_fn, max_results: int = 3, concurrency: int = 4):
+    """
+    Run `search_fn` for several phrasings concurrently (at most `concurrency` in flight),
+    then dedupe by video_id and merge with reciprocal-rank fusion. A failed phrasing is
+    dropped; the error is raised only if every phrasing fails.
+    """
+    sem = asyncio.Semaphore(concurrency)
+
+    async def bounded(query):
+        async with sem:
+            return await search_fn(query, max_results=max_results)
+
+    results = await asyncio.gather(*[bounded(q) for q in dict.fromkeys(queries)], return_exceptions=True)
+    result_lists = []
+    for query, res in zip(dict.fromkeys(queries), results):
+        if isinstance(res, Exception):
+            print(f"Search failed for {query!r}:", res)
+        else:
+            result_lists.append(res)
+    if not result_lists and results:
+        raise results[0]
+    return reciprocal_rank_fusion(result_lists)[:max_results]
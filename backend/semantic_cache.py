@@ -0,0 +1,80 @@
+'''
+In-process nearest-neighbour cache: values are looked up by embedding similarity instead of exact key.
+'''
+import time
+from typing import Any, Optional
+
+import numpy as np
+
+
+class SemanticCache:
+  """
+  Fixed-capacity cache of (embedding, value) pairs. A lookup returns the value of the most similar
+  live entry if its cosine similarity is at least `threshold`. Entries expire after `ttl` seconds;
+  when full, expired entries are reused first, then the least recently used one.
+  """
+
+  def __init__(self, max_size: int = 1024, ttl: float = 24 * 60 * 60, threshold: float = 0.92):
+    self.max_size = max_size
+    self.ttl = ttl
+    self.threshold = threshold
+    self._vectors: Optional[np.ndarray] = None  # (max_size, dim), rows L2-normalized
+    self._expires_at = np.zeros(max_size)
+    self._last_used = np.zeros(max_size)
+    self._values: list[Any] = [None] * max_size
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  @staticmethod
+  def _normalize(embedding) -> np.ndarray:
+    vec = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+  def lookup(self, embedding) -> Optional[Any]:
+    now = time.monotonic()
+    if self._vectors is None:
+      self.misses += 1
+      return None
+    sims = self._vectors @ self._normalize(embedding)
+    sims[self._expires_at <= now] = -1.0
+    idx = int(np.argmax(sims))
+    if sims[idx] < self.threshold:
+      self.misses += 1
+      return None
+    self._last_used[idx] = now
+    self.hits += 1
+    return self._values[idx]
+
+  def add(self, embedding, value):
+    now = time.monotonic()
+    vec = self._normalize(embedding)
+    if self._vectors is None:
+      self._vectors = np.zeros((self.max_size, vec.shape[0]), dtype=np.float32)
+
+    live = self._expires_at > now
+    if live.all():
+      idx = int(np.argmin(self._last_used))
+      self.evictions += 1
+    else:
+      idx = int(np.argmin(live))  # first free or expired slot
+    self._vectors[idx] = vec
+    self._expires_at[idx] = now + self.ttl
+    self._last_used[idx] = now
+    self._values[idx] = value
+
+  def __len__(self):
+    return int((self._expires_at > time.monotonic()).sum())
+
+  def stats(self) -> dict:
+    lookups = self.hits + self.misses
+    return {
+      "size": len(self),
+      "max_size": self.max_size,
+      "threshold": self.threshold,
+      "hits": self.hits,
+      "misses": self.misses,
+      "evictions": self.evictions,
+      "hit_rate": self.hits / lookups if lookups else 0.0,
+    }
@@ -1,6 +1,11 @@
+import asyncio
 import dataclasses
+import functools
 import os
+import random
 import re
+import threading
+import time
 import yaml
 
 from pydantic import BaseModel, ValidationError
@@ -12,7 +17,22 @@ class Message:
   role: str
   content: str
 
-def llm_call(model: str, messages: list[Message], temp: float= 0.8, provider='openai'):
+@dataclasses.dataclass
+class Completion:
+  text: str
+  prompt_tokens: int = 0
+  completion_tokens: int = 0
+
+# max in-flight async calls per provider, per process
+LLM_MAX_CONCURRENCY = {
+  'openai': int(os.environ.get("OPENAI_MAX_CONCURRENCY", 32)),
+  'google': int(os.environ.get("GEMINI_MAX_CONCURRENCY", 32)),
+}
+# "native" constrains the reply with the provider's JSON schema support where available,
+# "prompt" describes the model in the prompt and parses a ```yaml block out of the reply
+STRUCTURED_OUTPUT_MODE = os.environ.get("STRUCTURED_OUTPUT_MODE", "native")
+
+def _to_dicts(messages: list[Message]) -> list[dict]:
   message_list = []
   for message in messages:
     if dataclasses.is_dataclass(message):
@@ -21,6 +41,88 @@ def llm_call(model: str, messages: list[Message], temp: float= 0.8, provider='op
       message_list.append(message.model_dump())
     else:
       message_list.append(message)
+  return message_list
+
+def _flatten(message_list: list[dict]) -> str:
+  final_message = [f"{m['role'].lower()}:\n{m['content']}\n\n---\n" for m in message_list] + ['assitant:',]
+  return ''.join(final_message)
+
+def native_structured_output(model: str, provider: str) -> bool:
+  # the Together endpoint has no json_schema response format, so its models use the prompt
+  return STRUCTURED_OUTPUT_MODE == "native" and (provider == 'google' or model.startswith('gpt'))
+
+# JSON schema keywords each provider accepts in a response schema
+_SCHEMA_KEYS = {
+  'openai': {"type", "properties", "items", "required", "enum", "description", "anyOf", "minItems", "maxItems"},
+  'google': {"type", "properties", "items", "required", "enum", "description", "nullable", "minItems", "maxItems"},
+}
+# Gemini's Schema proto spells the array limits in snake_case
+_GOOGLE_KEY_NAMES = {"minItems": "min_items", "maxItems": "max_items"}
+
+@functools.lru_cache(maxsize=None)
+def native_schema(response_model: type[BaseModel], provider: str) -> dict:
+  """
+  The model's JSON schema reduced to what the provider accepts: refs inlined, `desc` renamed to
+  `description`, strict objects for OpenAI, and Optional fields as `nullable` for Gemini.
+  Array length limits are kept (and also spelled out in the description for Gemini), so list fields with a
+  max_length don't fail validation for having too many items.
+  """
+  schema = response_model.model_json_schema()
+  defs = schema.get("$defs", {})
+
+  def clean(node: dict) -> dict:
+    if "$ref" in node:
+      return clean(defs[node["$ref"].rsplit("/", 1)[-1]])
+    node = dict(node)
+    if "desc" in node:
+      node.setdefault("description", node.pop("desc"))
+    if provider == 'google' and "anyOf" in node:
+      variants = [v for v in node.pop("anyOf") if v.get("type") != "null"]
+      node = {**variants[0], **node, "nullable": True}
+    out = {k: v for k, v in node.items() if k in _SCHEMA_KEYS[provider]}
+    if "properties" in out:
+      out["properties"] = {k: clean(v) for k, v in out["properties"].items()}
+    if "items" in out:
+      out["items"] = clean(out["items"])
+    if "anyOf" in out:
+      out["anyOf"] = [clean(v) for v in out["anyOf"]]
+    if provider == 'openai' and out.get("type") == "object":
+      # strict mode: every property required, nothing extra
+      out["required"], out["additionalProperties"] = list(out.get("properties", {})), False
+    if provider == 'google':
+      if "maxItems" in out:
+        out["description"] = f"{out.get('description', '').rstrip('.')}. At most {out['maxItems']} items".lstrip(". ")
+      out = {_GOOGLE_KEY_NAMES.get(k, k): v for k, v in out.items()}
+      if "type" in out:
+        out["type"] = out["type"].upper()
+    return out
+
+  return clean(schema)
+
+def _openai_kwargs(response_model: Optional[type[BaseModel]]) -> dict:
+  if response_model is None:
+    return {}
+  return {"response_format": {"type": "json_schema", "json_schema": {"name": response_model.__name__, "schema": native_schema(response_model, 'openai'), "strict": True}}}
+
+def _google_kwargs(response_model: Optional[type[BaseModel]], temp: Optional[float]) -> dict:
+  config = {} if temp is None else {"temperature": temp}
+  if response_model is not None:
+    config.update(response_mime_type="application/json", response_schema=native_schema(response_model, 'google'))
+  return {"generation_config": config} if config else {}
+
+def _openai_completion(res) -> Completion:
+  usage = res.usage
+  return Completion(res.choices[0].message.content, usage.prompt_tokens if usage else 0, usage.completion_tokens if usage else 0)
+
+def _google_completion(response) -> Completion:
+  usage = getattr(response, "usage_metadata", None)
+  return Completion(response.text, usage.prompt_token_count if usage else 0, usage.candidates_token_count if usage else 0)
+
+def complete(model: str, messages: list[Message], temp: float = 0.8, provider='openai', response_model: Optional[type[BaseModel]] = None) -> Completion:
+  """
+  One request. With a response_model, the reply is constrained to its JSON schema by the provider.
+  """
+  message_list = _to_dicts(messages)
 
   if provider == 'openai':
     import openai
@@ -28,17 +130,91 @@ def llm_call(model: str, messages: list[Message], temp: float= 0.8, provider='op
       client = openai.OpenAI(api_key=os.environ["OPENAI_API_KEY"])
     else:
       client = openai.OpenAI(api_key=os.environ["TOGETHER_API_KEY"], base_url="https://api.together.xyz/v1")
-    res = client.chat.completions.create(model=model, messages=message_list, temperature=temp, max_tokens=1024)
-    return res.choices[0].message.content
+    res = client.chat.completions.create(model=model, messages=message_list, temperature=temp, max_tokens=1024, **_openai_kwargs(response_model))
+    return _openai_completion(res)
   elif provider == 'google':
     import google.generativeai as genai
-    final_message = [f'{m["role"].lower()}:\n{m['content']}\n\n---\n' for m in message_list] + ['assitant:',]
-    final_message = ''.join(final_message)
     gemini_model = genai.GenerativeModel(model_name=model)
-    response = gemini_model.generate_content([final_message,], request_options={"timeout": 600})
-    return response.text
+    response = gemini_model.generate_content([_flatten(message_list),], request_options={"timeout": 600}, **_google_kwargs(response_model, temp))
+    return _google_completion(response)
+
+def llm_call(model: str, messages: list[Message], temp: float= 0.8, provider='openai'):
+  return complete(model, messages, temp, provider).text
 
 
+# ===
+# Async
+# ===
+_async_clients = {}
+_semaphores = {}
+
+def _async_client(model: str, provider: str):
+  """
+  Long-lived clients, one per provider endpoint (openai) or model (google), so keep-alive
+  connections are reused across requests instead of being rebuilt on every call.
+  """
+  if provider == 'openai':
+    key = ('openai', model.startswith('gpt'))
+    if key not in _async_clients:
+      import openai
+      if model.startswith('gpt'):
+        _async_clients[key] = openai.AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"])
+      else:
+        _async_clients[key] = openai.AsyncOpenAI(api_key=os.environ["TOGETHER_API_KEY"], base_url="https://api.together.xyz/v1")
+  elif provider == 'google':
+    key = ('google', model)
+    if key not in _async_clients:
+      import google.generativeai as genai
+      _async_clients[key] = genai.GenerativeModel(model_name=model)
+  else:
+    raise ValueError(f"Unknown provider: {provider}")
+  return _async_clients[key]
+
+def _semaphore(provider: str) -> asyncio.Semaphore:
+  if provider not in _semaphores:
+    _semaphores[provider] = asyncio.Semaphore(LLM_MAX_CONCURRENCY[provider])
+  return _semaphores[provider]
+
+async def acomplete(model: str, messages: list[Message], temp: float = 0.8, provider='openai', response_model: Optional[type[BaseModel]] = None) -> Completion:
+  message_list = _to_dicts(messages)
+  client = _async_client(model, provider)
+  async with _semaphore(provider):
+    if provider == 'openai':
+      res = await client.chat.completions.create(model=model, messages=message_list, temperature=temp, max_tokens=1024, **_openai_kwargs(response_model))
+      return _openai_completion(res)
+    elif provider == 'google':
+      response = await client.generate_content_async([_flatten(message_list),], request_options={"timeout": 600}, **_google_kwargs(response_model, temp))
+      return _google_completion(response)
+
+async def allm_call(model: str, messages: list[Message], temp: float = 0.8, provider='openai'):
+  return (await acomplete(model, messages, temp, provider)).text
+
+async def allm_stream(model: str, messages: list[Message], temp: float = 0.8, provider='openai'):
+  '''
+  Async generator yielding the reply text as it is generated.
+  '''
+  message_list = _to_dicts(messages)
+  client = _async_client(model, provider)
+  async with _semaphore(provider):
+    if provider == 'openai':
+      stream = await client.chat.completions.create(model=model, messages=message_list, temperature=temp, max_tokens=1024, stream=True)
+      async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+          yield chunk.choices[0].delta.content
+    elif provider == 'google':
+      response = await client.generate_content_async([_flatten(message_list),], stream=True, request_options={"timeout": 600}, **_google_kwargs(None, temp))
+      async for chunk in response:
+        if chunk.parts:  # .text raises on chunks that only carry finish/safety metadata
+          yield chunk.text
+
+async def aclose():
+  for (provider, _), client in list(_async_clients.items()):
+    if provider == 'openai':
+      await client.close()
+  _async_clients.clear()
+
+
+@functools.lru_cache(maxsize=None)  # pure function of the model class
 def generate_response_prompt(model: type(BaseModel)) -> str:
   TAB = "    "
   ret = "Respond in YAML format, following the below Pydantic model:\n```python\n"
@@ -59,34 +235,83 @@ def generate_response_prompt(model: type(BaseModel)) -> str:
   return ret
 
 
+def _parse_yaml(model: type[BaseModel], llm_res: str) -> tuple:
+  match = re.search(r"```yaml(.*?)```", llm_res, re.DOTALL)
+  if not match:
+    return None, "Couldn't find a ```yaml block in the response"
+  try:
+    res_dict = yaml.safe_load(match.group(1))
+    if isinstance(res_dict, dict): return model.model_validate(res_dict), None
+    elif isinstance(res_dict, list): return [model.model_validate(x) for x in res_dict], None
+    else: return None, f"Expected a YAML mapping or list, but got {type(res_dict).__name__}"
+  except ValidationError as e:
+    return None, f"Pydantic Validation Error: {e}"
+  except yaml.YAMLError as e:
+    return None, f"YAML parsing error: {e}"
+
+def _parse_json(model: type[BaseModel], llm_res: str) -> tuple:
+  try:
+    return model.model_validate_json(llm_res), None  # parses and validates in one pass, in pydantic-core
+  except ValidationError as e:
+    return None, f"Pydantic Validation Error: {e}"
+
 def parse_llm_response(model: type[BaseModel], llm_res: str):
-  ptrn = re.compile(r"```yaml(.*?)```", re.DOTALL)
-  match = re.search(ptrn, llm_res)
-  if match:
-    try:
-      res_dict = yaml.safe_load(match.group(1))
-      if isinstance(res_dict, dict): ret = model.model_validate(res_dict)
-      elif isinstance(res_dict, list): ret = [model.model_validate(x) for x in res_dict]
-      else: raise Exception(f"Shouldn't have reached here. Expected type of dict or list, but got {type(res_dict)}")
-      return ret
+  ret, error = _parse_yaml(model, llm_res)
+  if error:
+    print(error)
+    print(llm_res)
+  return ret
 
-    except ValidationError as e:
-      print("Pydantic Validation Error:", e)
-      print(llm_res)
-    except yaml.YAMLError as e:
-      print("YAML parsing error:", e)
-      print(llm_res)
-    except Exception as e:
-      print("Error:", e)
-      print(llm_res)
-  else:
-    print("Couldn't find yaml tags\nResponse:")
+def parse_json_response(model: type[BaseModel], llm_res: str):
+  ret, error = _parse_json(model, llm_res)
+  if error:
+    print(error)
     print(llm_res)
+  return ret
+
+
+# ===
+# Stats
+# ===
+_stats = {}
+_stats_lock = threading.Lock()
+
+def _record(model: str, **counts):
+  with _stats_lock:
+    entry = _stats.setdefault(model, {
+      "requests": 0, "attempts": 0, "repairs": 0, "parse_failures": 0, "transient_errors": 0, "failures": 0,
+      "prompt_tokens": 0, "completion_tokens": 0, "wasted_tokens": 0, "latency_s": 0.0,
+    })
+    for key, value in counts.items():
+      entry[key] += value
+
+def _record_attempt(model: str, attempt: "Attempt"):
+  tokens = attempt.prompt_tokens + attempt.completion_tokens
+  _record(
+    model, attempts=1, repairs=int(attempt.kind == "repair"), latency_s=attempt.latency,
+    parse_failures=int(attempt.error is not None and not attempt.raised), transient_errors=int(attempt.transient),
+    prompt_tokens=attempt.prompt_tokens, completion_tokens=attempt.completion_tokens, wasted_tokens=tokens if attempt.error else 0,
+  )
 
-  return None
+def stats() -> dict:
+  """
+  Per-model structured-output counters: how often replies fail to parse, how often a request needs
+  a retry, and how many tokens went to attempts that were thrown away.
+  """
+  with _stats_lock:
+    ret = {}
+    for model, entry in _stats.items():
+      tokens = entry["prompt_tokens"] + entry["completion_tokens"]
+      ret[model] = {
+        **entry,
+        "parse_failure_rate": entry["parse_failures"] / entry["attempts"] if entry["attempts"] else 0.0,
+        "retries_per_request": (entry["attempts"] - entry["requests"]) / entry["requests"] if entry["requests"] else 0.0,
+        "wasted_token_share": entry["wasted_tokens"] / tokens if tokens else 0.0,
+      }
+    return ret
 
 
-def run(model: str, messages: list[Message], max_retries: int, response_model: Optional[type(BaseModel)] = None, temp: float = None, provider: str = 'openai'):
+def _append_schema(messages: list[Message], response_model: type(BaseModel)):
   #messages[0].content += f"\n---\n\n{generate_response_prompt(response_model)}---\n"
   suffix = f"\n---\n\n{generate_response_prompt(response_model)}---\n"
   if dataclasses.is_dataclass(messages[-1]):
@@ -103,8 +328,157 @@ def run(model: str, messages: list[Message], max_retries: int, response_model: O
           break
       else:
         raise ValueError("Couldn't find text type in the last message")
-  while max_retries:
-    res = llm_call(model, messages, temp, provider=provider)
-    ret = parse_llm_response(response_model, res)
-    if ret is None: max_retries -= 1
-    else: return ret
+
+
+# ===
+# Retries
+# ===
+# matched by class name so neither SDK has to be imported: openai's and google.api_core's rate-limit,
+# timeout, connection and 5xx errors
+TRANSIENT_ERRORS = {
+  "RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError",
+  "TooManyRequests", "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded",
+}
+
+def is_transient(e: BaseException) -> bool:
+  return isinstance(e, (TimeoutError, ConnectionError)) or any(cls.__name__ in TRANSIENT_ERRORS for cls in type(e).__mro__)
+
+
+@dataclasses.dataclass(frozen=True)
+class RetryPolicy:
+  max_attempts: int = 3
+  base_delay: float = 0.5  # seconds before the first retry after a transient error, doubled for each one after
+  max_delay: float = 8.0
+  repair: bool = True  # answer a parse failure with a short repair request instead of re-sending the conversation
+
+  def delay(self, attempt: int) -> float:
+    # full jitter, so clients throttled together don't retry together
+    return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+@dataclasses.dataclass
+class Attempt:
+  kind: str  # initial, retry or repair
+  latency: float
+  prompt_tokens: int = 0
+  completion_tokens: int = 0
+  error: Optional[str] = None
+  raised: bool = False  # the call raised instead of replying
+  transient: bool = False
+
+
+class StructuredOutputError(Exception):
+  """
+  No attempt produced a valid response; `attempts` has the cost and error of each one. When the
+  provider raised an error that retrying won't fix, it is chained as __cause__.
+  """
+  def __init__(self, model: str, attempts: list[Attempt]):
+    self.model = model
+    self.attempts = attempts
+    super().__init__(f"{model}: no valid structured output after {len(attempts)} attempts, last error: {attempts[-1].error if attempts else None}")
+
+
+REPAIR_PROMPT = """Your previous output could not be used. Return the same content, corrected so that it parses and validates.
+Reply with the corrected output only.
+
+Output:
+{output}
+
+Error:
+{error}
+"""
+
+class _Attempts:
+  """
+  Attempt bookkeeping shared by run and arun: decides what to send next and records what came back.
+  """
+  def __init__(self, model: str, messages: list[Message], response_model: type[BaseModel], temp: float, provider: str, policy: RetryPolicy):
+    self.model, self.messages, self.response_model, self.temp, self.policy = model, messages, response_model, temp, policy
+    self.native = native_structured_output(model, provider)
+    self.attempts: list[Attempt] = []
+    self.broken = None  # (output, error) of the last reply that didn't parse
+    if not self.native:
+      _append_schema(messages, response_model)
+    _record(model, requests=1)
+
+  def next_request(self) -> tuple:
+    """
+    Returns (kind, messages, temp, response_model) for the next call.
+    """
+    schema = self.response_model if self.native else None
+    if self.broken is not None and self.policy.repair:
+      content = REPAIR_PROMPT.format(output=self.broken[0], error=self.broken[1])
+      if not self.native:
+        content += f"\n---\n\n{generate_response_prompt(self.response_model)}---\n"
+      return "repair", [Message(role="user", content=content)], 0.0, schema
+    return ("initial" if not self.attempts else "retry"), self.messages, self.temp, schema
+
+  def failed(self, kind: str, started: float, e: Exception) -> float:
+    """
+    Records a failed call and returns the backoff before the next attempt. Errors that aren't transient
+    (e.g. a blocked Gemini reply, whose .text raises ValueError) end the request with a StructuredOutputError.
+    """
+    transient = is_transient(e)
+    self._add(Attempt(kind, time.perf_counter() - started, error=f"{type(e).__name__}: {e}", raised=True, transient=transient))
+    if not transient:
+      raise self.exhausted() from e
+    return self.policy.delay(sum(a.transient for a in self.attempts))
+
+  def completed(self, kind: str, started: float, res: Completion):
+    ret, error = _parse_json(self.response_model, res.text) if self.native else _parse_yaml(self.response_model, res.text)
+    self._add(Attempt(kind, time.perf_counter() - started, res.prompt_tokens, res.completion_tokens, error))
+    if error:
+      print(f"Attempt {len(self.attempts)} for {self.model} failed: {error}")
+      self.broken = (res.text, error)
+    return ret
+
+  def _add(self, attempt: Attempt):
+    self.attempts.append(attempt)
+    _record_attempt(self.model, attempt)
+
+  def remaining(self) -> bool:
+    return len(self.attempts) < self.policy.max_attempts
+
+  def exhausted(self) -> StructuredOutputError:
+    _record(self.model, failures=1)
+    return StructuredOutputError(self.model, self.attempts)
+
+
+def run(model: str, messages: list[Message], max_retries: int = 3, response_model: Optional[type(BaseModel)] = None, temp: float = None, provider: str = 'openai', policy: Optional[RetryPolicy] = None):
+  """
+  Returns a `response_model` instance, retrying per `policy` (by default, up to `max_retries` attempts).
+  Raises StructuredOutputError when every attempt failed.
+  """
+  state = _Attempts(model, messages, response_model, temp, provider, policy or RetryPolicy(max_attempts=max_retries))
+  while state.remaining():
+    kind, request, request_temp, schema = state.next_request()
+    started = time.perf_counter()
+    try:
+      res = complete(model, request, request_temp, provider=provider, response_model=schema)
+    except Exception as e:
+      delay = state.failed(kind, started, e)
+      if state.remaining():
+        time.sleep(delay)
+      continue
+    ret = state.completed(kind, started, res)
+    if ret is not None:
+      return ret
+  raise state.exhausted()
+
+
+async def arun(model: str, messages: list[Message], max_retries: int = 3, response_model: Optional[type(BaseModel)] = None, temp: float = None, provider: str = 'openai', policy: Optional[RetryPolicy] = None):
+  state = _Attempts(model, messages, response_model, temp, provider, policy or RetryPolicy(max_attempts=max_retries))
+  while state.remaining():
+    kind, request, request_temp, schema = state.next_request()
+    started = time.perf_counter()
+    try:
+      res = await acomplete(model, request, request_temp, provider=provider, response_model=schema)
+    except Exception as e:
+      delay = state.failed(kind, started, e)
+      if state.remaining():
+        await asyncio.sleep(delay)
+      continue
+    ret = state.completed(kind, started, res)
+    if ret is not None:
+      return ret
+  raise state.exhausted()
@@ -0,0 +1,27 @@
+import os
+import sys
+
+# backend modules import each other as top-level modules, as when run from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+PG_ENV = ("PG_USER", "PG_PASSWORD", "PG_HOST", "PG_PORT", "PG_DB")
+
+
+@pytest.fixture(scope="session")
+def database():
+  """
+  A migrated Postgres with pgvector, from the PG_* environment variables (e.g. the docker-compose one).
+  Tests using it are skipped when none is configured or reachable.
+  """
+  if not all(os.environ.get(k) for k in PG_ENV):
+    pytest.skip("PG_* environment variables not set")
+  psycopg2 = pytest.importorskip("psycopg2")
+  pytest.importorskip("asyncpg")
+  try:
+    psycopg2.connect(user=os.environ["PG_USER"], password=os.environ["PG_PASSWORD"], host=os.environ["PG_HOST"], port=os.environ["PG_PORT"], dbname=os.environ["PG_DB"]).close()
+  except psycopg2.OperationalError as e:
+    pytest.skip(f"Postgres not reachable: {e}")
+  import migrations
+  migrations.migrate()
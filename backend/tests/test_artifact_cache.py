@@ -0,0 +1,91 @@
+import os
+import time
+
+from artifact_cache import ArtifactCache
+
+
+def write(cache: ArtifactCache, key: str, size: int):
+  with cache.put(key, ".bin") as tmp_path:
+    with open(tmp_path, "wb") as f:
+      f.write(b"x" * size)
+
+
+def test_processes_sharing_a_directory_keep_each_others_entries(tmp_path):
+  a, b = ArtifactCache(str(tmp_path), 1 << 20), ArtifactCache(str(tmp_path), 1 << 20)
+  write(a, "a", 10)
+  write(b, "b", 10)
+  write(a, "c", 10)
+  fresh = ArtifactCache(str(tmp_path), 1 << 20)
+  assert all(fresh.get(k) for k in ("a", "b", "c"))
+  assert fresh.stats()["size_bytes"] == 30
+
+
+def test_budget_holds_across_instances(tmp_path):
+  a, b = ArtifactCache(str(tmp_path), 25, evict_grace=0), ArtifactCache(str(tmp_path), 25, evict_grace=0)
+  write(a, "a", 10)
+  write(b, "b", 10)
+  write(a, "c", 10)
+  assert a.stats()["size_bytes"] <= 25
+  assert a.get("a") is None and a.get("c") is not None
+  assert sum(os.path.getsize(tmp_path / "objects" / f) for f in os.listdir(tmp_path / "objects")) <= 25
+
+
+def age(cache: ArtifactCache, key: str, seconds: float):
+  path = cache.path(key)
+  os.utime(path, (time.time() - seconds, time.time() - seconds))
+  return path
+
+
+def test_hits_touch_the_file_instead_of_rewriting_the_manifest(tmp_path):
+  cache = ArtifactCache(str(tmp_path), 1 << 20)
+  write(cache, "a", 10)
+  path = age(cache, "a", 60 * 60)
+  manifest = tmp_path / "manifest.json"
+  before = (manifest.stat().st_mtime_ns, manifest.read_text())
+
+  assert cache.get("a") == path
+  assert (manifest.stat().st_mtime_ns, manifest.read_text()) == before
+  assert os.path.getmtime(path) > time.time() - 60
+
+
+def test_eviction_spares_entries_used_within_the_grace_period(tmp_path):
+  cache = ArtifactCache(str(tmp_path), 25, evict_grace=60)
+  write(cache, "a", 10)
+  write(cache, "b", 10)
+  age(cache, "a", 60 * 60)
+  age(cache, "b", 30 * 60)
+  assert cache.get("a")  # a is now the most recently used, though written first
+
+  write(cache, "c", 10)
+  assert cache.get("b") is None
+  assert cache.get("a") and cache.get("c")
+
+  write(cache, "d", 10)  # everything left was used within the grace period, so nothing goes yet
+  assert all(cache.get(k) for k in ("a", "c", "d"))
+  assert cache.stats()["size_bytes"] == 30
+
+
+def test_startup_only_removes_stale_tmp_files_and_reclaims_orphans(tmp_path):
+  ArtifactCache(str(tmp_path), 1 << 20)
+  in_flight, stale, orphan = tmp_path / "tmp" / "in_flight.mp4", tmp_path / "tmp" / "stale.mp4", tmp_path / "objects" / "orphan.mp4"
+  for path in (in_flight, stale, orphan):
+    path.write_bytes(b"x")
+  old = time.time() - 7 * 60 * 60
+  os.utime(stale, (old, old))
+
+  ArtifactCache(str(tmp_path), 1 << 20)
+  assert in_flight.exists()
+  assert not stale.exists()
+  assert not orphan.exists()
+
+
+def test_failed_write_is_not_cached(tmp_path):
+  cache = ArtifactCache(str(tmp_path), 1 << 20)
+  try:
+    with cache.put("k", ".bin") as tmp:
+      open(tmp, "w").write("partial")
+      raise RuntimeError("ffmpeg died")
+  except RuntimeError:
+    pass
+  assert cache.get("k") is None
+  assert os.listdir(tmp_path / "tmp") == []
@@ -0,0 +1,72 @@
+import asyncio
+import os
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "catalog.json")
+
+
+@pytest.fixture
+def catalog_ingest(database, monkeypatch):
+  pytest.importorskip("httpx")
+  import catalog_ingest
+  import db
+  import embeddings
+  monkeypatch.setattr(embeddings, "EMBEDDING_BACKEND", "hash")
+  source = f"test:{uuid.uuid4()}"
+  yield catalog_ingest, source
+
+  @db.with_connection
+  def cleanup(conn):
+    with conn.cursor() as cur:
+      cur.execute("DELETE FROM Video WHERE video_id LIKE 'fixture-catalog-%%'")
+      cur.execute("DELETE FROM CatalogSync WHERE source = %s", (source,))
+  cleanup()
+
+
+def test_ingested_fixture_is_searchable(catalog_ingest):
+  catalog_ingest, source = catalog_ingest
+  import async_db as adb
+  import embeddings
+
+  assert catalog_ingest.sync(source, lambda since: catalog_ingest.iter_fixture(FIXTURE, since)) == 6
+
+  async def search(text):
+    await adb.open_pool()
+    try:
+      return await adb.search_videos_by_embedding(embeddings.to_pgvector(embeddings.hash_embed(text)), 3)
+    finally:
+      await adb.close_pool()
+
+  # the same text the ingest embedded for the Django course
+  text = "Python Django Web Framework - Full Course\n\nBuild and deploy a web application with Django models, views and templates."
+  videos = asyncio.run(search(text))
+  assert videos[0].video_id == "fixture-catalog-django"
+  assert videos[0].url == "https://www.youtube.com/watch?v=fixture-catalog-django"
+
+
+def test_interrupted_walk_does_not_advance_the_watermark(catalog_ingest, monkeypatch):
+  catalog_ingest, source = catalog_ingest
+  import db
+  monkeypatch.setattr(catalog_ingest, "BATCH_SIZE", 2)
+
+  def interrupted(since):
+    for i, item in enumerate(catalog_ingest.iter_fixture(FIXTURE, since)):
+      if i == 3:
+        raise RuntimeError("quota exceeded")
+      yield item
+
+  with pytest.raises(RuntimeError):
+    catalog_ingest.sync(source, interrupted)
+  # the newest two were stored, but the walk never reached the older ones
+  assert db.read_video("fixture-catalog-rust") is not None
+  assert db.read_video("fixture-catalog-python") is None
+  assert db.read_catalog_watermark(source) is None
+
+  walk = lambda since: catalog_ingest.iter_fixture(FIXTURE, since)
+  assert catalog_ingest.sync(source, walk) == 6
+  assert db.read_video("fixture-catalog-python") is not None
+  assert db.read_catalog_watermark(source) == datetime(2024, 6, 30, 15, tzinfo=timezone.utc)
+  assert catalog_ingest.sync(source, walk) == 0
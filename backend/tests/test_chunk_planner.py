@@ -0,0 +1,83 @@
+import pytest
+
+import chunk_planner
+from chunk_planner import plan_chunks
+
+# a small budget keeps the numbers readable: (10_000 - 1_000) / 10 = 900s per chunk
+PLAN = dict(context_tokens=10_000, tokens_per_second=10, reserve_tokens=1_000, overlap=60)
+BUDGET = 900
+
+
+def assert_valid(chunks, duration, budget=BUDGET, overlap=PLAN["overlap"]):
+  assert chunks[0][0] == 0
+  assert chunks[-1][1] == duration
+  for start, end in chunks:
+    assert 0 <= start < end <= duration
+    assert end - start <= budget
+  for (_, prev_end), (next_start, _) in zip(chunks, chunks[1:]):
+    assert prev_end - next_start == pytest.approx(overlap)
+
+
+def test_fits_in_a_single_chunk_up_to_the_budget():
+  assert plan_chunks(BUDGET, **PLAN) == [(0.0, BUDGET)]
+  assert len(plan_chunks(BUDGET + 1, **PLAN)) == 2
+
+
+def test_max_chunk_duration_caps_the_budget():
+  chunks = plan_chunks(1_000, max_chunk_duration=400, **PLAN)
+  assert_valid(chunks, 1_000, budget=400)
+
+
+def test_zero_duration_has_no_chunks():
+  assert plan_chunks(0, **PLAN) == []
+
+
+@pytest.mark.parametrize("duration", [901, 1_800, 5_000, 12_345.5])
+def test_chunks_cover_the_video_within_budget(duration):
+  chunks = plan_chunks(duration, **PLAN)
+  assert_valid(chunks, duration)
+  # no plan with one chunk fewer could cover the video
+  assert (len(chunks) - 1) * (BUDGET - PLAN["overlap"]) + PLAN["overlap"] < duration
+
+
+@pytest.mark.parametrize("duration", [1_800, 5_000, 12_345])
+def test_cuts_are_aligned_to_granularity(duration):
+  chunks = plan_chunks(duration, granularity=60, **PLAN)
+  assert_valid(chunks, duration)
+  for start, _ in chunks:
+    assert start % 60 == 0
+
+
+def test_cuts_snap_to_nearby_boundaries():
+  unsnapped = plan_chunks(1_800, **PLAN)
+  cut = unsnapped[1][0]
+  chunks = plan_chunks(1_800, boundaries=[cut - 30], **PLAN)
+  assert_valid(chunks, 1_800)
+  assert chunks[1][0] == cut - 30
+
+
+def test_boundaries_out_of_the_window_are_ignored():
+  unsnapped = plan_chunks(1_800, **PLAN)
+  chunks = plan_chunks(1_800, boundaries=[unsnapped[1][0] + 300], **PLAN)
+  assert chunks == unsnapped
+
+
+def test_falls_back_when_snapping_breaks_the_budget():
+  unsnapped = plan_chunks(2_000, **PLAN)
+  assert len(unsnapped) == 3
+  first_cut = unsnapped[1][0]
+  # moving the first cut later would make the first chunk too long
+  chunks = plan_chunks(2_000, boundaries=[first_cut + 250], snap_window=300, **PLAN)
+  assert chunks == unsnapped
+
+
+def test_overlap_larger_than_the_budget_is_rejected():
+  with pytest.raises(ValueError):
+    plan_chunks(5_000, **{**PLAN, "overlap": BUDGET})
+
+
+def test_planned_tokens_beat_the_fixed_plan_on_long_videos():
+  duration = 3 * 3600
+  fixed = chunk_planner.plan_tokens(chunk_planner.fixed_plan(duration))
+  planned = chunk_planner.plan_tokens(plan_chunks(duration, granularity=60))
+  assert planned < fixed
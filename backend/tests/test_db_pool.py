@@ -0,0 +1,126 @@
+import os
+import threading
+
+import pytest
+
+from conftest import PG_ENV
+
+
+@pytest.fixture
+def db(monkeypatch):
+  pytest.importorskip("psycopg2")
+  for k in PG_ENV:
+    if k not in os.environ:
+      monkeypatch.setenv(k, "unused")
+  import db
+  return db
+
+
+class FakeConnection:
+  def __init__(self, on_execute=None):
+    self.closed = 0
+    self.on_execute = on_execute
+
+  def cursor(self):
+    return self
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+  def execute(self, query, params=None):
+    if self.on_execute:
+      self.on_execute()
+
+  def rollback(self):
+    pass
+
+  def commit(self):
+    pass
+
+  def close(self):
+    self.closed = 1
+
+
+def lock_is_free(pool) -> bool:
+  # the pool's condition is reentrant, so probe it from another thread
+  acquired = []
+
+  def probe():
+    if pool._cond.acquire(timeout=1):
+      pool._cond.release()
+      acquired.append(True)
+  thread = threading.Thread(target=probe)
+  thread.start()
+  thread.join()
+  return acquired == [True]
+
+
+def make_pool(db, monkeypatch, connect, **kwargs):
+  monkeypatch.setattr(db.psycopg2, "connect", connect)
+  options = dict(min_size=1, max_size=2, timeout=1, max_lifetime=3600, health_check_after=3600)
+  return db.ConnectionPool(**{**options, **kwargs})
+
+
+def test_failed_replenish_does_not_raise_from_putconn(db, monkeypatch):
+  pool = make_pool(db, monkeypatch, lambda **kw: FakeConnection())
+  conn = pool.getconn()
+
+  def refuse(**kw):
+    raise db.psycopg2.OperationalError("server is down")
+  monkeypatch.setattr(db.psycopg2, "connect", refuse)
+  pool.putconn(conn, discard=True)
+
+  assert pool.size == 0
+  monkeypatch.setattr(db.psycopg2, "connect", lambda **kw: FakeConnection())
+  assert pool.getconn() is not None
+
+
+def test_with_connection_keeps_the_original_error_when_replenish_fails(db, monkeypatch):
+  pool = make_pool(db, monkeypatch, lambda **kw: FakeConnection())
+  monkeypatch.setattr(db, "_pool", pool)
+
+  @db.with_connection
+  def query(conn):
+    def refuse(**kw):
+      raise RuntimeError("replenish failed")
+    monkeypatch.setattr(db.psycopg2, "connect", refuse)
+    raise db.psycopg2.OperationalError("connection lost")
+
+  with pytest.raises(db.psycopg2.OperationalError, match="connection lost"):
+    query()
+
+
+def test_replenish_connects_outside_the_lock(db, monkeypatch):
+  pool = make_pool(db, monkeypatch, lambda **kw: FakeConnection())
+  conn = pool.getconn()
+  free = []
+
+  def connect(**kw):
+    free.append(lock_is_free(pool))
+    return FakeConnection()
+  monkeypatch.setattr(db.psycopg2, "connect", connect)
+  pool.putconn(conn, discard=True)
+
+  assert free == [True]
+  assert pool.stats()["idle"] == 1
+
+
+def test_health_check_pings_outside_the_lock(db, monkeypatch):
+  free = []
+  pool = make_pool(db, monkeypatch, lambda **kw: FakeConnection(on_execute=lambda: free.append(lock_is_free(pool))), health_check_after=0)
+  pool.getconn()
+  assert free == [True]
+
+
+def test_unhealthy_idle_connection_is_replaced(db, monkeypatch):
+  def broken():
+    raise db.psycopg2.OperationalError("server closed the connection")
+  connections = [FakeConnection(on_execute=broken), FakeConnection()]
+  pool = make_pool(db, monkeypatch, lambda **kw: connections.pop(0), health_check_after=0)
+
+  conn = pool.getconn()
+  assert conn.on_execute is None
+  assert pool.size == 1
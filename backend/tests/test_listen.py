@@ -0,0 +1,33 @@
+import asyncio
+import uuid
+
+import pytest
+
+
+def test_listen_reconnects_after_the_connection_drops(database):
+  pytest.importorskip("asyncpg")
+  import async_db as adb
+
+  channel = f"test_{uuid.uuid4().hex}"
+
+  async def scenario():
+    payloads, reconnected = asyncio.Queue(), asyncio.Event()
+    pool = await adb.open_pool()
+    listener = await adb.listen(channel, payloads.put_nowait, on_reconnect=reconnected.set)
+    try:
+      await pool.execute("SELECT pg_notify($1, 'before')", channel)
+      assert await asyncio.wait_for(payloads.get(), 5) == "before"
+
+      # the server closing the connection is seen right away, well inside the health check interval
+      killed = await pool.fetchval("SELECT count(*) FROM (SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE query = 'LISTEN \"' || $1 || '\"') t", channel)
+      assert killed == 1
+      await asyncio.wait_for(reconnected.wait(), 10)
+
+      await pool.execute("SELECT pg_notify($1, 'after')", channel)
+      assert await asyncio.wait_for(payloads.get(), 5) == "after"
+    finally:
+      listener.cancel()
+      await asyncio.gather(listener, return_exceptions=True)
+      await adb.close_pool()
+
+  asyncio.run(scenario())
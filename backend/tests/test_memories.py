@@ -0,0 +1,44 @@
+import asyncio
+import uuid
+
+import pytest
+
+K = 5
+
+
+def test_top_k_memories_is_not_crowded_out_by_other_users(database):
+  pytest.importorskip("asyncpg")
+  import async_db as adb
+  import db
+  import embeddings
+
+  query = "wants to learn django web development"
+  user_id, other_id = f"test-{uuid.uuid4()}", f"test-{uuid.uuid4()}"
+
+  async def scenario():
+    await adb.open_pool()
+    try:
+      await adb.create_user(db.User(name="target", email=f"{user_id}@example.com", user_id=user_id))
+      await adb.create_user(db.User(name="other", email=f"{other_id}@example.com", user_id=other_id))
+      # the other user's memories are all closer to the query than any of the target user's
+      others = [f"{query} part {i}" for i in range(300)]
+      mine = [f"knows rust and embedded systems, fact {i}" for i in range(K + 3)]
+      for uid, texts in ((other_id, others), (user_id, mine)):
+        await adb.create_memories(uid, [(str(uuid.uuid4()), t, embeddings.to_pgvector(embeddings.hash_embed(t))) for t in texts])
+
+      query_embedding = embeddings.to_pgvector(embeddings.hash_embed(query))
+      top = await adb.top_k_memories(user_id, query_embedding, K)
+      assert len(top) == K
+      assert all(m.user_id == user_id for m in top)
+
+      # the dedupe lookup in extract_memories: an exact repeat is found, an unrelated text is not
+      repeat = embeddings.to_pgvector(embeddings.hash_embed(mine[0]))
+      assert [m.memory for m in await adb.top_k_memories(user_id, repeat, 1, max_distance=0.1)] == [mine[0]]
+      assert await adb.top_k_memories(user_id, query_embedding, 1, max_distance=0.1) == []
+    finally:
+      pool = await adb.get_pool()
+      await pool.execute("DELETE FROM Memory WHERE user_id = ANY($1::text[])", [user_id, other_id])
+      await pool.execute("DELETE FROM Users WHERE user_id = ANY($1::text[])", [user_id, other_id])
+      await adb.close_pool()
+
+  asyncio.run(scenario())
@@ -0,0 +1,30 @@
+def test_catalog_columns_exist_after_migrating(database):
+  import db
+
+  @db.with_connection
+  def video_columns(conn):
+    with conn.cursor() as cur:
+      cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = 'video'")
+      return {row[0] for row in cur.fetchall()}
+
+  assert {"published_at", "embedding"} <= video_columns()
+
+
+def test_hot_queries_use_an_index(database):
+  import migrations
+
+  failures = {name: tables for name, tables in migrations.check_indexes().items() if tables}
+  assert not failures, f"sequential scans in hot queries: {failures}"
+
+
+def test_embedding_columns_match_the_embedding_size(database):
+  import db
+  from embeddings import EMBEDDING_DIM
+
+  @db.with_connection
+  def embedding_types(conn):
+    with conn.cursor() as cur:
+      cur.execute("SELECT attrelid::regclass::text, format_type(atttypid, atttypmod) FROM pg_attribute WHERE attname = 'embedding' AND attrelid IN ('memory'::regclass, 'video'::regclass)")
+      return dict(cur.fetchall())
+
+  assert embedding_types() == {"memory": f"vector({EMBEDDING_DIM})", "video": f"vector({EMBEDDING_DIM})"}
@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+import search_fusion
+
+
+def videos(*ids):
+  return [{"video_id": video_id} for video_id in ids]
+
+
+def test_videos_ranked_well_by_several_phrasings_win():
+  fused = search_fusion.reciprocal_rank_fusion([videos("a", "b", "c"), videos("b", "d"), videos("d", "b")])
+  assert [v["video_id"] for v in fused] == ["b", "d", "a", "c"]
+
+
+def test_multi_search_drops_failed_phrasings_and_dedupes_queries():
+  calls = []
+
+  async def search(query, max_results):
+    calls.append(query)
+    if query == "broken":
+      raise RuntimeError("quota")
+    return videos(*query.split())[:max_results]
+
+  fused = asyncio.run(search_fusion.multi_search(["a b", "broken", "b c", "a b"], search, max_results=2))
+  assert sorted(calls) == ["a b", "b c", "broken"]
+  assert [v["video_id"] for v in fused] == ["b", "a"]
+
+
+def test_multi_search_raises_when_every_phrasing_fails():
+  async def search(query, max_results):
+    raise RuntimeError(f"failed {query}")
+
+  with pytest.raises(RuntimeError, match="failed first"):
+    asyncio.run(search_fusion.multi_search(["first", "second"], search))
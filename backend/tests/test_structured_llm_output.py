@@ -0,0 +1,122 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Optional
+
+import pytest
+from pydantic import BaseModel, Field
+
+import structured_llm_output as llm
+
+
+class Queries(BaseModel):
+  scratch_pad: str
+  queries: list[str] = Field(description='search queries', min_length=1, max_length=3)
+  note: Optional[str] = None
+
+
+def test_google_schema_keeps_array_limits():
+  queries = llm.native_schema(Queries, 'google')["properties"]["queries"]
+  assert queries["min_items"] == 1
+  assert queries["max_items"] == 3
+  assert "At most 3 items" in queries["description"]
+  assert queries["type"] == "ARRAY"
+
+
+def test_google_schema_optional_is_nullable():
+  schema = llm.native_schema(Queries, 'google')
+  assert schema["properties"]["note"] == {"type": "STRING", "nullable": True}
+  assert "note" not in schema["required"]
+
+
+def test_openai_schema_is_strict():
+  schema = llm.native_schema(Queries, 'openai')
+  assert schema["additionalProperties"] is False
+  assert schema["required"] == ["scratch_pad", "queries", "note"]
+  assert schema["properties"]["queries"]["maxItems"] == 3
+
+
+def test_parse_json_response_validates():
+  assert llm.parse_json_response(Queries, '{"scratch_pad": "", "queries": ["a"]}').queries == ["a"]
+  assert llm.parse_json_response(Queries, '{"scratch_pad": "", "queries": ["a", "b", "c", "d"]}') is None
+
+
+VALID = '{"scratch_pad": "", "queries": ["django"]}'
+
+
+class RateLimitError(Exception):
+  pass
+
+
+class StubClient:
+  """
+  Stands in for complete(): replays `replies` in order, raising the ones that are exceptions.
+  """
+  def __init__(self, *replies):
+    self.replies, self.calls = list(replies), []
+
+  def __call__(self, model, messages, temp, provider, response_model):
+    self.calls.append((messages, temp))
+    reply = self.replies.pop(0)
+    if isinstance(reply, Exception):
+      raise reply
+    return llm.Completion(reply, prompt_tokens=10, completion_tokens=5)
+
+
+def run(monkeypatch, stub, max_retries=3):
+  monkeypatch.setattr(llm, "complete", stub)
+  policy = llm.RetryPolicy(max_attempts=max_retries, base_delay=0)
+  return llm.run("gpt-4o-mini", [llm.Message(role="user", content="find videos")], response_model=Queries, temp=0.7, policy=policy)
+
+
+def test_transient_errors_are_retried(monkeypatch):
+  stub = StubClient(RateLimitError("slow down"), VALID)
+  assert run(monkeypatch, stub).queries == ["django"]
+  assert len(stub.calls) == 2
+  assert stub.calls[1] == stub.calls[0]
+
+
+def test_parse_failure_is_repaired(monkeypatch):
+  stub = StubClient('{"scratch_pad": ""}', VALID)
+  assert run(monkeypatch, stub).queries == ["django"]
+  repair_messages, repair_temp = stub.calls[1]
+  assert repair_temp == 0.0
+  assert repair_messages[0].content.startswith("Your previous output could not be used")
+  assert '{"scratch_pad": ""}' in repair_messages[0].content
+
+
+def test_gives_up_after_max_retries(monkeypatch):
+  stub = StubClient("not json", "still not json", RateLimitError("slow down"), VALID)
+  with pytest.raises(llm.StructuredOutputError) as e:
+    run(monkeypatch, stub, max_retries=3)
+  assert len(e.value.attempts) == 3
+  assert [a.kind for a in e.value.attempts] == ["initial", "repair", "repair"]
+  assert e.value.attempts[-1].transient
+  assert stub.replies == [VALID]
+
+
+def test_errors_that_wont_go_away_are_not_retried(monkeypatch):
+  blocked = ValueError("response.text requires a valid Part, but the candidate was blocked")
+  stub = StubClient(blocked, VALID)
+  with pytest.raises(llm.StructuredOutputError) as e:
+    run(monkeypatch, stub)
+  assert e.value.__cause__ is blocked
+  assert len(e.value.attempts) == 1
+  assert len(stub.calls) == 1
+
+
+def test_google_requests_carry_the_temperature(monkeypatch):
+  calls = []
+
+  class StubGemini:
+    async def generate_content_async(self, contents, **kwargs):
+      calls.append(kwargs)
+      return SimpleNamespace(text=VALID, usage_metadata=None)
+
+  monkeypatch.setattr(llm, "_async_client", lambda model, provider: StubGemini())
+  messages = [llm.Message(role="user", content="find videos")]
+  asyncio.run(llm.acomplete("gemini-1.5-flash", messages, temp=0.2, provider='google', response_model=Queries))
+  asyncio.run(llm.acomplete("gemini-1.5-flash", messages, temp=0.9, provider='google'))
+
+  assert calls[0]["generation_config"]["temperature"] == 0.2
+  assert calls[0]["generation_config"]["response_mime_type"] == "application/json"
+  assert calls[1]["generation_config"] == {"temperature": 0.9}
@@ -0,0 +1,84 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from transcript_analyzer import Cue, analyze, is_sparse, parse_subtitles
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(BACKEND, "tests", "fixtures")
+
+
+def read_fixture(name: str) -> str:
+  with open(os.path.join(FIXTURES, name)) as f:
+    return f.read()
+
+
+def test_parse_auto_captions_drops_scrolled_repeats_and_tags():
+  cues = parse_subtitles(read_fixture("auto_captions.en.vtt"))
+  assert cues == [
+    Cue(0.0, 3.12, "welcome to this python course"),
+    Cue(3.13, 6.4, "today we will learn about variables"),
+    Cue(62.0, 65.5, "a variable is a name for a value"),
+  ]
+
+
+def test_parse_srt_joins_multiline_cues():
+  cues = parse_subtitles(read_fixture("lecture.srt"))
+  assert [c.text for c in cues] == [
+    "Welcome to this Python course.",
+    "Today we will learn about variables, types and functions.",
+    "Thanks for watching, see you in the next one.",
+  ]
+  assert cues[1].start == 4.0 and cues[1].end == 9.5
+  assert cues[2].start == pytest.approx(90 * 60 + 5.25)
+
+
+def test_parse_handles_crlf():
+  assert parse_subtitles(read_fixture("lecture.srt").replace("\n", "\r\n")) == parse_subtitles(read_fixture("lecture.srt"))
+
+
+def test_is_sparse():
+  assert is_sparse(None)
+  assert is_sparse([])
+  assert is_sparse(parse_subtitles(read_fixture("lecture.srt")))  # three lines over 90 minutes
+  words = " ".join(["word"] * 150)
+  assert not is_sparse([Cue(60.0 * i, 60.0 * (i + 1), words) for i in range(10)])
+
+
+def response(outline: str, questions: list[str]) -> str:
+  quiz = [{"question": q, "answer": f"Answer to {q}"} for q in questions]
+  return f"Here you go:\n```json\n{json.dumps({'outline': outline, 'quiz': quiz})}\n```"
+
+
+def test_analyze_feeds_each_chunk_the_result_so_far():
+  cues = parse_subtitles(read_fixture("lecture.srt"))
+  prompts = []
+
+  def generate(prompt: str) -> str:
+    prompts.append(prompt)
+    return response(f"# Outline after {len(prompts)} chunks", [f"Question {i}?" for i in range(len(prompts))])
+
+  outline, quiz = analyze(cues, generate=generate)
+
+  assert len(prompts) == 2  # the last cue starts past TRANSCRIPT_CHUNK_DURATION
+  assert "[00:00:04] Today we will learn about variables" in prompts[0]
+  assert "[01:30:05] Thanks for watching" in prompts[1]
+  assert "# Outline after 1 chunks" in prompts[1]
+  assert outline == "# Outline after 2 chunks"
+  assert [q.question for q in quiz] == ["Question 0?", "Question 1?"]
+
+
+def test_analyze_raises_on_unparseable_response():
+  cues = parse_subtitles(read_fixture("auto_captions.en.vtt"))
+  with pytest.raises(ValueError):
+    analyze(cues, generate=lambda prompt: "no json here")
+
+
+def test_import_does_not_pull_in_the_video_analyzer():
+  # a fresh interpreter, since other tests may have imported these already
+  code = "import sys, transcript_analyzer; print(sorted({'video_analyzer', 'db', 'google.cloud.storage'} & set(sys.modules)))"
+  res = subprocess.run([sys.executable, "-c", code], cwd=BACKEND, capture_output=True, text=True, check=True)
+  assert res.stdout.strip() == "[]"
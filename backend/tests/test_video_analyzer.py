@@ -0,0 +1,136 @@
+import json
+import os
+import stat
+import sys
+import threading
+import time
+
+import pytest
+
+from conftest import PG_ENV
+
+FAKE_YTDLP = '''#!/bin/sh
+# --quiet --print-to-file <template> <path> ...: write the metadata, then stream some bytes
+printf '%s' '{info}' > "$4"
+head -c 1000 /dev/zero
+'''
+
+FAKE_FFMPEG = '''#!{python}
+import os, sys, time
+a = sys.argv
+if "segment" in a:
+  sys.stdin.buffer.read()
+  seg_list = a[a.index("-segment_list") + 1]
+  with open(os.path.join(os.path.dirname(seg_list), "..", "segmenter.pid"), "w") as f:
+    f.write(str(os.getpid()))
+  for i in range({segments}):
+    time.sleep({segment_seconds})
+    open(os.path.join(os.path.dirname(seg_list), f"seg_{{i:05d}}.mp4"), "w").close()
+    with open(seg_list, "a") as f:
+      f.write(f"seg_{{i:05d}}.mp4,{{i * 60}},{{i * 60 + 60}}\\n")
+else:
+  # concat: the "chunk" records the segments it was stitched from
+  with open(a[a.index("-i") + 1]) as f:
+    segments = [line.split("/")[-1].strip("'\\n") for line in f]
+  with open(a[-1], "w") as f:
+    f.write("\\n".join(segments))
+'''
+
+
+@pytest.fixture
+def video_analyzer(monkeypatch, tmp_path):
+  for module in ("psycopg2", "google.cloud.storage", "google.generativeai", "tomlkit"):
+    pytest.importorskip(module)
+  for k in PG_ENV:
+    if k not in os.environ:
+      monkeypatch.setenv(k, "unused")
+  monkeypatch.setenv("ARTIFACT_CACHE_DIR", str(tmp_path / "import_cache"))
+  import video_analyzer
+  from artifact_cache import ArtifactCache
+  monkeypatch.setattr(video_analyzer, "artifact_cache", ArtifactCache(str(tmp_path / "cache"), 10 ** 9))
+  return video_analyzer
+
+
+def fake_tools(tmp_path, monkeypatch, info: dict, segments: int, segment_seconds: float = 0):
+  bin_dir = tmp_path / "bin"
+  bin_dir.mkdir()
+  for name, script in [("yt-dlp", FAKE_YTDLP.format(info=json.dumps(info))), ("ffmpeg", FAKE_FFMPEG.format(python=sys.executable, segments=segments, segment_seconds=segment_seconds))]:
+    path = bin_dir / name
+    path.write_text(script)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+  monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+
+def stream(video_analyzer, tmp_path, monkeypatch, info: dict):
+  planned = []
+  plan_video_chunks = video_analyzer.plan_video_chunks
+
+  def spy(duration, chapters=()):
+    planned.append((duration, list(chapters)))
+    return plan_video_chunks(duration, chapters)
+  monkeypatch.setattr(video_analyzer, "plan_video_chunks", spy)
+  fake_tools(tmp_path, monkeypatch, info, segments=91)
+  monkeypatch.setattr(video_analyzer.time, "sleep", lambda s: None)
+
+  chunks = []
+  for path in video_analyzer.stream_chunks("https://www.youtube.com/watch?v=abcdefghijk", str(tmp_path / "work")):
+    with open(path) as f:
+      chunks.append(f.read().split("\n"))
+  return planned, chunks
+
+
+def test_chapters_reach_the_planner_and_move_the_cut(video_analyzer, tmp_path, monkeypatch):
+  # 90.5 min at the default token budget is two chunks with the cut near 44 min; a chapter starts at 43:20
+  info = {"duration": 5430, "chapters": [{"start_time": 0, "title": "Intro"}, {"start_time": 2600, "title": "Part 2"}]}
+  planned, chunks = stream(video_analyzer, tmp_path, monkeypatch, info)
+
+  assert planned == [(5430.0, [2600.0])]
+  assert len(chunks) == 2
+  # the cut moves from segment 44 (2640s) to segment 43 (2580s, the segment boundary nearest the chapter)
+  assert chunks[1][0] == "seg_00043.mp4"
+  assert chunks[1][-1] == "seg_00090.mp4"
+
+
+def test_videos_without_chapters_are_planned_on_duration(video_analyzer, tmp_path, monkeypatch):
+  planned, chunks = stream(video_analyzer, tmp_path, monkeypatch, {"duration": 5430, "chapters": None})
+
+  assert planned == [(5430.0, [])]
+  assert chunks[1][0] == "seg_00044.mp4"
+
+
+def test_failed_analysis_stops_the_download(video_analyzer, tmp_path, monkeypatch):
+  # the segmenter needs ~9s for all 91 segments; the first chunk is ready after 45 of them
+  fake_tools(tmp_path, monkeypatch, {"duration": 5430}, segments=91, segment_seconds=0.1)
+  sleep = time.sleep
+  monkeypatch.setattr(video_analyzer.time, "sleep", lambda s: sleep(0.01))
+  monkeypatch.setattr(video_analyzer.gemini_files, "get_or_upload", lambda path: path)
+
+  def ask_gemini(*args, **kwargs):
+    raise RuntimeError("analysis failed")
+  monkeypatch.setattr(video_analyzer, "ask_gemini", ask_gemini)
+
+  stop = threading.Event()
+  chunks = video_analyzer.stream_chunks("https://www.youtube.com/watch?v=abcdefghijk", str(tmp_path / "work"), stop)
+  started = time.monotonic()
+  with pytest.raises(RuntimeError, match="analysis failed"):
+    video_analyzer.analyze_sequential(chunks, stop)
+
+  assert time.monotonic() - started < 8
+  with open(tmp_path / "work" / "segmenter.pid") as f:
+    pid = int(f.read())
+  with pytest.raises(ProcessLookupError):
+    os.kill(pid, 0)  # killed and reaped before analyze_sequential raised
+
+
+@pytest.mark.parametrize("mode", ["analyze_sequential", "analyze_map_reduce"])
+def test_no_chunks_is_an_error(video_analyzer, mode):
+  with pytest.raises(ValueError, match="no chunks"):
+    getattr(video_analyzer, mode)(iter([]))
+
+
+@pytest.mark.parametrize("mode", ["analyze_sequential", "analyze_map_reduce"])
+def test_unparseable_chunk_is_an_error(video_analyzer, monkeypatch, mode):
+  monkeypatch.setattr(video_analyzer.gemini_files, "get_or_upload", lambda path: path)
+  monkeypatch.setattr(video_analyzer, "ask_gemini", lambda *args, **kwargs: None)
+  with pytest.raises(ValueError, match="Couldn't analyze chunk 0"):
+    getattr(video_analyzer, mode)(iter(["chunk_0.mp4"]))
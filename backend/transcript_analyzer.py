@@ -0,0 +1,145 @@
+'''
+Transcript-first analysis: builds the outline and quiz from timestamped captions (or local speech-to-text)
+instead of uploading the video, through the same ResponseStruct contract (analysis_response) as video_analyzer.ask_gemini.
+'''
+import dataclasses
+import glob
+import json
+import os
+import re
+import subprocess
+from typing import Callable, Optional
+
+from analysis_response import QnA, parse_response
+from prompt_registry import registry as prompts
+
+TRANSCRIPT_CHUNK_DURATION = int(os.environ.get("TRANSCRIPT_CHUNK_DURATION", 90 * 60))  # text is cheap, so chunks can be longer than video ones
+TRANSCRIPT_MIN_WORDS_PER_MINUTE = float(os.environ.get("TRANSCRIPT_MIN_WORDS_PER_MINUTE", 40))  # below this the narration is too sparse to rely on
+WHISPER_MODEL = os.environ.get("WHISPER_MODEL", "base")
+
+
+@dataclasses.dataclass
+class Cue:
+  start: float
+  end: float
+  text: str
+
+
+def _seconds(ts: str) -> float:
+  parts = [float(x) for x in ts.replace(",", ".").split(":")]
+  while len(parts) < 3:
+    parts.insert(0, 0.0)
+  return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+def _timestamp(seconds: float) -> str:
+  seconds = int(seconds)
+  return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+_TIMING = re.compile(r"((?:\d+:)?\d{2}:\d{2}[.,]\d{3})\s*-->\s*((?:\d+:)?\d{2}:\d{2}[.,]\d{3})")
+_TAG = re.compile(r"<[^>]+>")
+
+def parse_subtitles(text: str) -> list[Cue]:
+  """
+  Parses WebVTT or SRT. YouTube auto-captions repeat each line in the next cue as it scrolls,
+  so lines identical to the previous emitted line are dropped.
+  """
+  cues, last_line = [], None
+  # only truly empty lines separate cues: auto-captions put a line holding a single space inside cues
+  for block in re.split(r"\n{2,}", text.replace("\r\n", "\n")):
+    lines = block.strip().split("\n")
+    for i, line in enumerate(lines):
+      match = _TIMING.search(line)
+      if not match:
+        continue
+      new_lines = []
+      for raw in lines[i + 1:]:
+        clean = " ".join(_TAG.sub("", raw).split())
+        if clean and clean != last_line:
+          new_lines.append(clean)
+          last_line = clean
+      if new_lines:
+        cues.append(Cue(_seconds(match.group(1)), _seconds(match.group(2)), " ".join(new_lines)))
+      break
+  return cues
+
+
+def fetch_captions(yt_link: str, work_dir: str) -> Optional[list[Cue]]:
+  """
+  Downloads English captions with yt-dlp, preferring uploaded subtitles over auto-generated ones.
+  """
+  os.makedirs(work_dir, exist_ok=True)
+  for flag in ("--write-subs", "--write-auto-subs"):
+    for path in glob.glob(f"{work_dir}/captions*.vtt"):
+      os.remove(path)
+    subprocess.run(
+      ["yt-dlp", "--quiet", "--skip-download", flag, "--sub-langs", "en.*,en", "--sub-format", "vtt", "-o", f"{work_dir}/captions.%(ext)s", yt_link],
+      check=False,
+    )
+    paths = sorted(glob.glob(f"{work_dir}/captions*.vtt"))
+    if paths:
+      with open(paths[0]) as f:
+        return parse_subtitles(f.read())
+  return None
+
+
+def transcribe_audio(yt_link: str, work_dir: str) -> Optional[list[Cue]]:
+  """
+  Local speech-to-text with faster-whisper, if it is installed.
+  """
+  try:
+    from faster_whisper import WhisperModel
+  except ImportError:
+    return None
+  audio_path = f"{work_dir}/audio.m4a"
+  if not os.path.exists(audio_path):
+    subprocess.run(["yt-dlp", "--quiet", "-f", "ba[ext=m4a]/ba", "-o", audio_path, yt_link], check=True)
+  segments, _ = WhisperModel(WHISPER_MODEL, compute_type="int8").transcribe(audio_path, language="en")
+  return [Cue(s.start, s.end, s.text.strip()) for s in segments]
+
+
+def is_sparse(cues: Optional[list[Cue]]) -> bool:
+  if not cues:
+    return True
+  minutes = max(cues[-1].end - cues[0].start, 60) / 60
+  words = sum(len(c.text.split()) for c in cues)
+  return words / minutes < TRANSCRIPT_MIN_WORDS_PER_MINUTE
+
+
+def chunk_transcript(cues: list[Cue], chunk_duration: int = TRANSCRIPT_CHUNK_DURATION) -> list[str]:
+  chunks = {}
+  for c in cues:
+    chunks.setdefault(int(c.start // chunk_duration), []).append(f"[{_timestamp(c.start)}] {c.text}")
+  return ["\n".join(lines) for _, lines in sorted(chunks.items())]
+
+
+def gemini_generate(prompt: str) -> str:
+  import google.generativeai as genai
+  model = genai.GenerativeModel(model_name="gemini-1.5-flash")
+  return model.generate_content([prompt], request_options={"timeout": 600}).text
+
+
+def analyze(cues: list[Cue], generate: Callable[[str], str] = gemini_generate) -> tuple[str, list[QnA]]:
+  outline, quiz = None, None
+  for transcript in chunk_transcript(cues):
+    prompt = prompts.render("transcript_analyzer", outline=outline, quiz_questions=json.dumps([x.model_dump() for x in quiz]) if quiz else None, transcript=transcript)
+    res = parse_response(generate(prompt))
+    if res is None:
+      raise ValueError("Couldn't parse transcript analysis")
+    outline, quiz = res
+  return outline, quiz
+
+
+def run(yt_link: str, work_dir: str, generate: Callable[[str], str] = gemini_generate) -> Optional[tuple[str, list[QnA]]]:
+  """
+  Returns (outline, quiz), or None when no usable transcript could be found and the caller
+  should fall back to video analysis.
+  """
+  cues = fetch_captions(yt_link, work_dir)
+  if is_sparse(cues):
+    print("Captions missing or too sparse, trying local speech-to-text", flush=True)
+    cues = transcribe_audio(yt_link, work_dir)
+  if is_sparse(cues):
+    return None
+  print(f"Analyzing transcript with {len(cues)} cues", flush=True)
+  return analyze(cues, generate)
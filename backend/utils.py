@@ -1,3 +1,5 @@
+import time
+from collections import OrderedDict
 from urllib.parse import urlparse, parse_qs
 
 def get_youtube_video_id(url):
@@ -22,3 +24,60 @@ def get_youtube_video_id(url):
         return parsed_url.path.lstrip("/")  # Video ID is the path
 
     return None
+
+
+class TTLCache:
+    """
+    Bounded in-process cache with per-entry TTL and LRU eviction.
+
+    Args:
+        max_size (int): Maximum number of entries kept.
+        ttl (float): Seconds an entry stays valid after being set.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -1,135 +1,394 @@
+import dataclasses
 import time
 import re
 import subprocess
 import hashlib
+import math
 import os
+import shutil
+from typing import Iterable, Iterator, Optional, Sequence
 from urllib.parse import urlparse
 from google.cloud import storage
 import google.generativeai as genai
-from jinja2 import Template
-from pydantic import BaseModel, ValidationError
 import yaml
 import tomlkit
 import json
+import argparse
+import queue
+import threading
+import gemini_files
+import chunk_planner
+from analysis_response import QnA, parse_response
+from artifact_cache import ArtifactCache
+from prompt_registry import registry as prompts
+from utils import get_youtube_video_id
+from concurrent.futures import ThreadPoolExecutor
 
 
 BUCKET_NAME = "fcc-advisor-bucket-1"
 CREDENTIALS_FILE = "gcs_obj_creation_sa.json"
 
-class QnA(BaseModel):
-  question: str
-  answer: str
+ANALYZER_ENGINE = os.environ.get("ANALYZER_ENGINE", "transcript")  # transcript (falls back to video) or video
+ANALYZER_MODE = os.environ.get("ANALYZER_MODE", "sequential")  # sequential or map_reduce
+ANALYZER_CONCURRENCY = int(os.environ.get("ANALYZER_CONCURRENCY", 4))  # chunks analyzed at once in map_reduce mode
+# a single progressive (muxed) stream, so yt-dlp can pipe it without merging; 360-480p is plenty for slides and code
+ANALYZER_YTDLP_FORMAT = os.environ.get("ANALYZER_YTDLP_FORMAT", "18/b[height<=480]/w")
+# chunks are sized from the video's duration and the model's token budget (see chunk_planner)
+ANALYZER_CONTEXT_TOKENS = int(os.environ.get("ANALYZER_CONTEXT_TOKENS", chunk_planner.MODEL_CONTEXT_TOKENS["gemini-1.5-flash"]))
+ANALYZER_MAX_CHUNK_DURATION = float(os.environ.get("ANALYZER_MAX_CHUNK_DURATION", 0)) or None  # optional cap below the token budget
+ANALYZER_CHUNK_OVERLAP = int(os.environ.get("ANALYZER_CHUNK_OVERLAP", 2 * 60))
+ANALYZER_SEGMENT_DURATION = int(os.environ.get("ANALYZER_SEGMENT_DURATION", 60))  # cut points are multiples of this
+ANALYZER_CHAPTER_SNAP_WINDOW = float(os.environ.get("ANALYZER_CHAPTER_SNAP_WINDOW", 120))  # seconds a cut may move to a chapter start; 0 disables
 
-class ResponseStruct(BaseModel):
-  outline: str
-  quiz: list[QnA]
 
+@dataclasses.dataclass(frozen=True)
+class TranscodeProfile:
+  name: str
+  fps: Optional[float] = None  # None keeps the source frame rate
+  height: Optional[int] = None  # None keeps the source resolution
+  video_codec: str = "copy"
+  crf: int = 30
+  preset: str = "veryfast"
+  audio_bitrate: Optional[str] = None  # None copies the source audio
 
+  def ffmpeg_args(self) -> list[str]:
+    if self.video_codec == "copy":
+      video = ["-c:v", "copy"]
+    else:
+      filters = [f for f in (f"fps={self.fps}" if self.fps else None, f"scale=-2:{self.height}" if self.height else None) if f]
+      video = (["-vf", ",".join(filters)] if filters else []) + ["-c:v", self.video_codec, "-crf", str(self.crf), "-preset", self.preset]
+    audio = ["-c:a", "aac", "-b:a", self.audio_bitrate, "-ac", "1"] if self.audio_bitrate else ["-c:a", "copy"]
+    return video + audio
 
-def run(yt_link: str) -> None:
+# Gemini samples video at 1 fps, so anything above that is paid for in upload bytes only
+TRANSCODE_PROFILES = {p.name: p for p in [
+  TranscodeProfile("source"),
+  TranscodeProfile("lecture", fps=1, height=480, video_codec="libx264", crf=32, audio_bitrate="32k"),
+  TranscodeProfile("lecture_hd", fps=2, height=720, video_codec="libx264", crf=28, audio_bitrate="48k"),
+  TranscodeProfile("lecture_hevc", fps=1, height=480, video_codec="libx265", crf=34, audio_bitrate="32k"),
+]}
+ANALYZER_TRANSCODE_PROFILE = os.environ.get("ANALYZER_TRANSCODE_PROFILE", "lecture")
+
+artifact_cache = ArtifactCache(
+  os.environ.get("ARTIFACT_CACHE_DIR", "/tmp/fcc_artifacts"),
+  int(os.environ.get("ARTIFACT_CACHE_BYTES", 20 * 1024 ** 3)),
+  evict_grace=float(os.environ.get("ARTIFACT_CACHE_EVICT_GRACE", 10 * 60)),  # longer than a chunk takes to upload
+)
+
+def run(yt_link: str, mode: str = None, engine: str = None) -> tuple[str, list[QnA]]:
+  """
+  engine="transcript" analyzes the captions (or a local transcription) and only falls back to the video
+  when no usable transcript exists; engine="video" always analyzes the video.
+
+  mode="sequential" analyzes chunks one after another, feeding each the outline and quiz so far.
+  mode="map_reduce" uploads and analyzes all chunks independently in parallel, then merges the partial results.
+  In both modes a chunk is analyzed as soon as it has been downloaded.
+  """
+  mode = mode or ANALYZER_MODE
+  engine = engine or ANALYZER_ENGINE
+  started = time.perf_counter()
   url_hash = hashlib.md5(yt_link.encode()).hexdigest()
   temp_dir = f"/tmp/{url_hash}"
   os.makedirs(temp_dir, exist_ok=True)
-  os.makedirs(f"{temp_dir}/chunks", exist_ok=True)
-
-  # Use yt-dlp to get the filename
-  result = subprocess.run(
-      ["yt-dlp", "--print", "filename", "-o", f"{temp_dir}/full_video.%(ext)s", yt_link],
-      capture_output=True,
-      text=True,
-      check=True
+
+  if engine == "transcript":
+    import transcript_analyzer
+    res = transcript_analyzer.run(yt_link, temp_dir)
+    if res is not None:
+      shutil.rmtree(temp_dir, ignore_errors=True)
+      print(f"Analyzed transcript in {time.perf_counter() - started:.0f}s", flush=True)
+      return res
+    print("No usable transcript, falling back to video analysis", flush=True)
+  elif engine != "video":
+    raise ValueError(f"Unknown analyzer engine: {engine}")
+
+  # set once analysis fails, so the download and segmenter stop instead of running on behind it
+  stop = threading.Event()
+  chunks = stream_chunks(yt_link, temp_dir, stop)
+
+  if mode == "map_reduce":
+    outline, quiz, n_chunks = analyze_map_reduce(chunks, stop)
+  elif mode == "sequential":
+    outline, quiz, n_chunks = analyze_sequential(chunks, stop)
+  else:
+    raise ValueError(f"Unknown analyzer mode: {mode}")
+
+  print('Final Outline:')
+  print(outline)
+  print('Quiz:')
+  print(yaml.safe_dump([x.model_dump() for x in quiz]), flush=True)
+  print(f"Analyzed {n_chunks} chunks in {mode} mode in {time.perf_counter() - started:.0f}s", flush=True)
+  print("Artifact cache:", artifact_cache.stats(), flush=True)
+  shutil.rmtree(temp_dir, ignore_errors=True)
+  return outline, quiz
+
+
+def plan_video_chunks(duration: float, chapters: Sequence[float] = ()) -> list[tuple[float, float]]:
+  """
+  :param chapters: chapter start times; cuts move to the nearest one within ANALYZER_CHAPTER_SNAP_WINDOW so a
+    chunk doesn't split a topic
+  """
+  return chunk_planner.plan_chunks(
+    duration,
+    context_tokens=ANALYZER_CONTEXT_TOKENS,
+    max_chunk_duration=ANALYZER_MAX_CHUNK_DURATION,
+    overlap=ANALYZER_CHUNK_OVERLAP,
+    boundaries=chapters if ANALYZER_CHAPTER_SNAP_WINDOW else (),
+    snap_window=ANALYZER_CHAPTER_SNAP_WINDOW,
+    granularity=ANALYZER_SEGMENT_DURATION,
+  )
+
+
+def stream_chunks(yt_link: str, work_dir: str, stop: Optional[threading.Event] = None) -> Iterator[str]:
+  """
+  Downloads the video once, piping it straight into a single ffmpeg segmenter, and yields the path of
+  each overlapping chunk as soon as all of its segments have been written. Chunks are stored in the
+  artifact cache, keyed by video, format and chunking parameters; a fully cached video is not downloaded.
+
+  The segmenter cuts the stream into non-overlapping segments of ANALYZER_SEGMENT_DURATION seconds.
+  yt-dlp reports the duration and chapters before streaming starts, which is enough to plan the chunks
+  against the token budget, with cuts moved onto chapter starts where possible; each chunk is then
+  stitched from consecutive segments with the concat demuxer (no re-read of the full video) and
+  transcoded with the ANALYZER_TRANSCODE_PROFILE to shrink the upload.
+
+  Setting `stop` (or closing the generator) kills yt-dlp and ffmpeg within a poll interval.
+  """
+  video_id = get_youtube_video_id(yt_link) or hashlib.md5(yt_link.encode()).hexdigest()
+  profile = TRANSCODE_PROFILES[ANALYZER_TRANSCODE_PROFILE]
+  seg_len = ANALYZER_SEGMENT_DURATION
+  key_prefix = (
+    f"{video_id}/{ANALYZER_YTDLP_FORMAT}/{profile.name}"
+    f"/t{ANALYZER_CONTEXT_TOKENS}-m{ANALYZER_MAX_CHUNK_DURATION or 0:.0f}-o{ANALYZER_CHUNK_OVERLAP}-s{seg_len}-c{ANALYZER_CHAPTER_SNAP_WINDOW:.0f}"
+  )
+  index = artifact_cache.get_json(f"{key_prefix}/index")
+  if index is not None:
+    cached = [artifact_cache.get(f"{key_prefix}/clip_{i}") for i in range(index["chunks"])]
+    if all(cached):
+      yield from cached
+      return
+
+  seg_dir = f"{work_dir}/segments"
+  shutil.rmtree(seg_dir, ignore_errors=True)
+  os.makedirs(seg_dir)
+  seg_list = f"{seg_dir}/segments.csv"
+  info_path = f"{seg_dir}/info.json"
+
+  download = subprocess.Popen(
+    ["yt-dlp", "--quiet", "--print-to-file", "%(.{duration,chapters})j", info_path, "-f", ANALYZER_YTDLP_FORMAT, "-o", "-", yt_link],
+    stdout=subprocess.PIPE,
   )
-  full_video_path = result.stdout.strip()
-  print('yt-dlp path:', full_video_path)
-  # Download YouTube video
-  subprocess.run(["yt-dlp", "-o", full_video_path, yt_link], check=True)
-
-  # Get video duration
-  duration_output = subprocess.check_output(["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", full_video_path])
-  duration = float(duration_output)
-
-  # Split video into chunks
-  chunk_duration = 40 * 60  # 40 minutes in seconds
-  overlap = 5 * 60  # 5 minutes overlap in seconds
-  outline, quiz = None, None
-  
-  # TODO: delete this. refactor. should be done async
-  uploaded_files = ["files/9mrh9xq2q119", "files/9rup881ton4o"]
-  for i, start_time in enumerate(range(0, int(duration), chunk_duration - overlap)):
-    end_time = min(start_time + chunk_duration, duration)
-    output_path = f"{temp_dir}/chunks/clip_{i}.mp4"
-    
-    if not os.path.exists(output_path):
-      subprocess.run([
-        "ffmpeg",
-        "-i", full_video_path,
-        "-ss", str(start_time),
-        "-to", str(end_time),
-        "-c", "copy",
-        output_path
-      ], check=True)
-    #upload_to_gcs(BUCKET_NAME, output_path, destination_blob_name, credentials_file)
-    #video_file = upload_to_gemini(output_path)
-    for f in genai.list_files():
-      if f.name == uploaded_files[i]:
-        video_file = f
+  segmenter = subprocess.Popen([
+    "ffmpeg", "-loglevel", "error", "-y",
+    "-i", "pipe:0",
+    "-map", "0", "-c", "copy",
+    "-f", "segment", "-segment_time", str(seg_len), "-reset_timestamps", "1",
+    "-segment_list", seg_list, "-segment_list_type", "csv",
+    f"{seg_dir}/seg_%05d.mp4",
+  ], stdin=download.stdout)
+  download.stdout.close()  # so yt-dlp gets SIGPIPE if ffmpeg exits
+
+  plan, n_chunks = None, 0  # chunks as (first, last) segment ranges; chunks yielded
+  try:
+    while True:
+      if stop is not None and stop.is_set():
+        return
+      finished = segmenter.poll() is not None
+      segments = _read_segment_list(seg_list)
+      if plan is None:
+        duration, chapters = _read_video_info(info_path)
+        if duration is None and finished:
+          duration = len(segments) * seg_len  # no duration in the metadata (e.g. a live recording)
+        if duration is not None:
+          plan = [(round(start / seg_len), math.ceil(end / seg_len)) for start, end in plan_video_chunks(duration, chapters)]
+          print(f"Planned {len(plan)} chunks for {duration:.0f}s of video with {len(chapters)} chapters", flush=True)
+      while plan is not None and n_chunks < len(plan):
+        first, last = plan[n_chunks]
+        if finished and n_chunks == len(plan) - 1:
+          last = len(segments)  # the stream can run a little past the reported duration
+        if last > len(segments) and not finished:
+          break
+        last = min(last, len(segments))
+        if first >= last:
+          break
+        key = f"{key_prefix}/clip_{n_chunks}"
+        with artifact_cache.put(key, ".mp4") as tmp_path:
+          _concat_segments([f"{seg_dir}/{s}" for s in segments[first:last]], tmp_path, profile)
+        n_chunks += 1
+        yield artifact_cache.path(key)
+      if finished:
         break
+      time.sleep(1)
+
+    if download.wait() != 0:
+      raise subprocess.CalledProcessError(download.returncode, "yt-dlp")
+    if segmenter.returncode != 0:
+      raise subprocess.CalledProcessError(segmenter.returncode, "ffmpeg")
+  finally:
+    for proc in (download, segmenter):
+      if proc.poll() is None:
+        proc.kill()
+        proc.wait()
+
+  artifact_cache.put_json(f"{key_prefix}/index", {"chunks": n_chunks})
+  shutil.rmtree(seg_dir, ignore_errors=True)
+
+
+def _read_video_info(info_path: str) -> tuple[Optional[float], list[float]]:
+  """
+  Duration (None until yt-dlp has written it, or if unknown) and chapter start times after 0.
+  """
+  try:
+    with open(info_path) as f:
+      info = json.loads(f.read())
+  except (FileNotFoundError, ValueError):
+    return None, []
+  duration = info.get("duration")
+  chapters = [float(c["start_time"]) for c in info.get("chapters") or [] if c.get("start_time")]
+  return (float(duration) if duration else None), chapters
+
+
+def _read_segment_list(seg_list: str) -> list[str]:
+  # ffmpeg appends a line once a segment has been fully written
+  if not os.path.exists(seg_list):
+    return []
+  with open(seg_list) as f:
+    return [line.split(",")[0] for line in f.read().splitlines() if line]
 
-    outline, quiz = ask_gemini(video_file, outline, json.dumps([x.model_dump() for x in quiz]) if quiz else None)
-    if end_time >= duration:
-      print('Final Outline:')
-      print(outline)
-      print('Quiz:')
-      print(yaml.dumps([x.model_dump() for x in quiz]), flush=True)
-      break
 
-def upload_to_gemini(file_path):
-  # Check whether the file is ready to be used.
-  video_file = genai.upload_file(path=file_path)
-  print('Uploading file')
-  while video_file.state.name == "PROCESSING":
-      print('.')
-      time.sleep(10)
-      video_file = genai.get_file(video_file.name)
+def _concat_segments(segment_paths: list[str], output_path: str, profile: TranscodeProfile):
+  list_path = f"{output_path}.txt"
+  with open(list_path, "w") as f:
+    f.writelines(f"file '{p}'\n" for p in segment_paths)
+  try:
+    subprocess.run(["ffmpeg", "-loglevel", "error", "-y", "-f", "concat", "-safe", "0", "-i", list_path, *profile.ffmpeg_args(), output_path], check=True)
+  finally:
+    os.remove(list_path)
 
-  if video_file.state.name == "FAILED":
-    raise ValueError(video_file.state.name)
-  return video_file
 
+def transcode(src_path: str, output_path: str, profile: TranscodeProfile):
+  subprocess.run(["ffmpeg", "-loglevel", "error", "-y", "-i", src_path, *profile.ffmpeg_args(), output_path], check=True)
 
-def ask_gemini(video_file, outline=None, quiz_questions=None):
-  # load prompts from prompts/video_analyzer.txt as jinja2 template and pass it outline and quiz_questions
-  with open("prompts/video_analyzer.txt") as file:
-    template_content = file.read()
 
-  template = Template(template_content)
-  formatted_prompt = template.render(outline=outline, quiz_questions=quiz_questions)
+def upload_ahead(chunks: Iterable[str], pool: ThreadPoolExecutor, stop: Optional[threading.Event] = None) -> Iterator:
+  """
+  Starts the upload of every chunk as soon as it is available and yields the uploaded files in order,
+  so later chunks upload while earlier ones are being analyzed.
+
+  When the consumer stops early (an analysis failed, or it returned), `stop` is set and the producer closes
+  `chunks` before this generator finishes, so no download or transcode outlives the analysis.
+  """
+  stop = stop or threading.Event()
+  pending = queue.Queue()
+
+  def produce():
+    try:
+      for output_path in chunks:
+        if stop.is_set():
+          break
+        pending.put(pool.submit(gemini_files.get_or_upload, output_path))
+    except Exception as e:
+      pending.put(e)
+    finally:
+      # the generator runs on this thread, so it has to be closed here
+      if hasattr(chunks, "close"):
+        chunks.close()
+      pending.put(None)
+
+  producer = threading.Thread(target=produce, daemon=True)
+  producer.start()
+  try:
+    while (item := pending.get()) is not None:
+      if isinstance(item, Exception):
+        raise item
+      yield item.result()
+  finally:
+    stop.set()
+    producer.join()
+
+
+def analyze_sequential(chunks: Iterable[str], stop: Optional[threading.Event] = None) -> tuple[str, list[QnA], int]:
+  outline, quiz, n_chunks = None, None, 0
+  with ThreadPoolExecutor(max_workers=ANALYZER_CONCURRENCY) as pool:
+    uploads = upload_ahead(chunks, pool, stop)
+    try:
+      for video_file in uploads:
+        #upload_to_gcs(BUCKET_NAME, output_path, destination_blob_name, credentials_file)
+        res = ask_gemini(video_file, outline, json.dumps([x.model_dump() for x in quiz]) if quiz else None)
+        if res is None:
+          raise ValueError(f"Couldn't analyze chunk {n_chunks}")
+        outline, quiz = res
+        n_chunks += 1
+    finally:
+      uploads.close()  # stops and joins the producer before the pool shuts down
+  if not n_chunks:
+    raise ValueError("Video produced no chunks to analyze")
+  return outline, quiz, n_chunks
+
+
+def analyze_map_reduce(chunks: Iterable[str], stop: Optional[threading.Event] = None) -> tuple[str, list[QnA], int]:
+  def analyze_chunk(output_path, i):
+    video_file = gemini_files.get_or_upload(output_path)
+    res = ask_gemini(video_file, part=i + 1)
+    if res is None:
+      raise ValueError(f"Couldn't analyze chunk {i}")
+    return res
+
+  with ThreadPoolExecutor(max_workers=ANALYZER_CONCURRENCY) as pool:
+    futures = []
+    try:
+      for i, output_path in enumerate(chunks):
+        futures.append(pool.submit(analyze_chunk, output_path, i))
+        # a failed chunk fails the whole analysis, so don't keep downloading the rest
+        if any(f.done() and f.exception() for f in futures):
+          break
+    finally:
+      if stop is not None:
+        stop.set()
+      if hasattr(chunks, "close"):
+        chunks.close()
+    partials = [f.result() for f in futures]
+  if not partials:
+    raise ValueError("Video produced no chunks to analyze")
+  if len(partials) == 1:
+    return partials[0][0], partials[0][1], 1
+  outline, quiz = merge_analyses(partials)
+  return outline, quiz, len(partials)
+
+
+def dedupe_quiz(quiz: list[QnA]) -> list[QnA]:
+  seen, ret = set(), []
+  for q in quiz:
+    key = " ".join(re.sub(r"[^\w\s]", "", q.question.lower()).split())
+    if key not in seen:
+      seen.add(key)
+      ret.append(q)
+  return ret
+
+
+def merge_analyses(partials: list[tuple[str, list[QnA]]]) -> tuple[str, list[QnA]]:
+  quiz = dedupe_quiz([q for _, part_quiz in partials for q in part_quiz])
+  formatted_prompt = prompts.render("video_analyzer_merge", outlines=[outline for outline, _ in partials], quiz_questions=json.dumps([x.model_dump() for x in quiz]))
+
+  model = genai.GenerativeModel(model_name="gemini-1.5-flash")
+  print(f"Merging {len(partials)} partial analyses...", flush=True)
+  response = model.generate_content([formatted_prompt], request_options={"timeout": 600})
+  res = parse_response(response.text)
+  if res is None:
+    raise ValueError("Couldn't parse merged analysis")
+  return res[0], dedupe_quiz(res[1])
+
+
+def ask_gemini(video_file, outline=None, quiz_questions=None, part=None):
+  # render prompts/video_analyzer.txt with the outline and quiz_questions so far
+  formatted_prompt = prompts.render("video_analyzer", outline=outline, quiz_questions=quiz_questions, part=part)
 
 
   # Choose a Gemini model.
   model = genai.GenerativeModel(model_name="gemini-1.5-flash")
   print("Making LLM inference request...", flush=True)
   response = model.generate_content([video_file, formatted_prompt], request_options={"timeout": 600})
-  llm_res = response.text
-  ptrn = re.compile(r"```json(.*?)```", re.DOTALL)
-  match = re.search(ptrn, llm_res)
-  if match:
-    try:
-      res_dict = json.loads(match.group(1))
-      if isinstance(res_dict, dict): ret = ResponseStruct.model_validate(res_dict)
-      elif isinstance(res_dict, list): ret = [ResponseStruct.model_validate(x) for x in res_dict]
-      else: raise Exception(f"Shouldn't have reached here. Expected type of dict or list, but got {type(res_dict)}")
-      return ret.outline, ret.quiz
-
-    except ValidationError as e:
-      print("Pydantic Validation Error:", e)
-      print(llm_res)
-    except yaml.YAMLError as e:
-      print("YAML parsing error:", e)
-      print(llm_res)
-    except Exception as e:
-      print("Error:", e)
-      print(llm_res)
+  return parse_response(response.text)
+
 
 def upload_to_gcs(bucket_name, source_file_path, destination_blob_name, credentials_file):
   # Initialize the Google Cloud Storage client with the credentials
@@ -149,11 +408,17 @@ def upload_to_gcs(bucket_name, source_file_path, destination_blob_name, credenti
 
 # Example usage
 if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("yt_link", nargs="?", default='https://www.youtube.com/watch?v=lG7Uxts9SXs')
+  parser.add_argument("--mode", choices=["sequential", "map_reduce"], default=ANALYZER_MODE)
+  parser.add_argument("--engine", choices=["transcript", "video"], default=ANALYZER_ENGINE)
+  args = parser.parse_args()
+
   print("My files:")
   for f in genai.list_files():
       print("  ", f.name)
 
-  run('https://www.youtube.com/watch?v=lG7Uxts9SXs')
+  run(args.yt_link, mode=args.mode, engine=args.engine)
   #SOURCE_FILE_PATH = "/tmp/2fe387470299859be578fe0a78329ba9/chunks/clip_0.mp4"
   #DESTINATION_BLOB_NAME = "2fe387470299859be578fe0a78329ba9/clip_0.mp4"
   #upload_to_gcs(BUCKET_NAME, SOURCE_FILE_PATH, DESTINATION_BLOB_NAME, CREDENTIALS_FILE)
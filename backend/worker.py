@@ -0,0 +1,100 @@
+'''
+Video analysis worker: claims jobs from the AnalysisJob table and runs several analyses concurrently.
+
+  python worker.py
+'''
+import os
+import random
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import migrations
+import video_analyzer
+
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", 2))
+WORKER_POLL_INTERVAL = float(os.environ.get("WORKER_POLL_INTERVAL", 5))
+JOB_VISIBILITY_TIMEOUT = float(os.environ.get("JOB_VISIBILITY_TIMEOUT", 30 * 60))
+JOB_RETRY_BASE_DELAY = float(os.environ.get("JOB_RETRY_BASE_DELAY", 60))
+JOB_RETRY_MAX_DELAY = float(os.environ.get("JOB_RETRY_MAX_DELAY", 60 * 60))
+
+
+def retry_delay(attempts: int) -> float:
+  delay = min(JOB_RETRY_MAX_DELAY, JOB_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+  return delay * random.uniform(0.5, 1.0)
+
+
+def heartbeat(video_id: str, stop: threading.Event):
+  # keep the claim alive while the analysis is still running; a failed beat (e.g. the database restarting)
+  # is retried sooner rather than ending the thread, or the job would be claimed again mid-analysis
+  interval = JOB_VISIBILITY_TIMEOUT / 3
+  while not stop.wait(interval):
+    try:
+      db.extend_analysis_job(video_id, JOB_VISIBILITY_TIMEOUT)
+      interval = JOB_VISIBILITY_TIMEOUT / 3
+    except Exception as e:
+      print(f"[{video_id}] heartbeat failed, retrying: {type(e).__name__}: {e}", flush=True)
+      interval = min(WORKER_POLL_INTERVAL, JOB_VISIBILITY_TIMEOUT / 3)
+
+
+def save_results(video: db.Video, outline: str, quiz: list) -> int:
+  quizzes = [db.Quiz(video_id=video.video_id, question=q.question, answer=q.answer, qid=str(uuid.uuid4())) for q in quiz]
+  return db.save_analysis(video.video_id, outline, quizzes)
+
+
+def process(job: db.AnalysisJob):
+  stop = threading.Event()
+  threading.Thread(target=heartbeat, args=(job.video_id, stop), daemon=True).start()
+  try:
+    video = db.read_video(job.video_id)
+    if video is None:
+      db.fail_analysis_job(job, "Video no longer exists", 0, permanent=True)
+      print(f"[{job.video_id}] video no longer exists, failed permanently", flush=True)
+      return
+    print(f"[{job.video_id}] analyzing (attempt {job.attempts}/{job.max_attempts})", flush=True)
+    outline, quiz = video_analyzer.run(video.url)
+    save_results(video, outline, quiz)
+    db.complete_analysis_job(job.video_id)
+    print(f"[{job.video_id}] done", flush=True)
+  except Exception as e:
+    traceback.print_exc()
+    delay = retry_delay(job.attempts)
+    db.fail_analysis_job(job, f"{type(e).__name__}: {e}", delay)
+    print(f"[{job.video_id}] failed, retrying in {delay:.0f}s" if job.attempts < job.max_attempts else f"[{job.video_id}] failed permanently", flush=True)
+  finally:
+    stop.set()
+
+
+def main():
+  migrations.migrate()
+  running = set()
+  lock = threading.Lock()
+
+  def done(video_id):
+    with lock:
+      running.discard(video_id)
+
+  with ThreadPoolExecutor(max_workers=WORKER_CONCURRENCY) as pool:
+    print(f"worker started with concurrency {WORKER_CONCURRENCY}", flush=True)
+    while True:
+      with lock:
+        free = WORKER_CONCURRENCY - len(running)
+      try:
+        jobs = db.claim_analysis_jobs(free, JOB_VISIBILITY_TIMEOUT) if free > 0 else []
+      except Exception as e:
+        # e.g. the database restarting; claims resume once it is back
+        print(f"Claiming jobs failed: {type(e).__name__}: {e}", flush=True)
+        jobs = []
+      for job in jobs:
+        with lock:
+          running.add(job.video_id)
+        pool.submit(process, job).add_done_callback(lambda _, video_id=job.video_id: done(video_id))
+      if not jobs:
+        time.sleep(WORKER_POLL_INTERVAL)
+
+
+if __name__ == '__main__':
+  main()
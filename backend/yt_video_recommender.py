@@ -1,28 +1,87 @@
 import os
-import googleapiclient
-
-# Configure YouTube API
-youtube = googleapiclient.discovery.build("youtube", "v3", developerKey=os.environ["YOUTUBE_DEV_KEY"])
-async def search_youtube_videos(query: str, max_results: int = 3):
-    search_response = youtube.search().list(
-        q=query,
-        type="video",
-        part="id,snippet",
-        channelId="UC8butISFwT-Wl7EV0hUK0BQ",  # freeCodeCamp channel ID
-        maxResults=max_results
-    ).execute()
-
-    video_ids = [item['id']['videoId'] for item in search_response.get("items", [])]
+from typing import Optional
+
+import httpx
+
+import async_db as adb
+import embeddings
+import search_fusion
+from utils import TTLCache
+
+YOUTUBE_API_URL = "https://www.googleapis.com/youtube/v3"
+FCC_CHANNEL_ID = "UC8butISFwT-Wl7EV0hUK0BQ"  # freeCodeCamp channel ID
+# "api" queries the YouTube Data API, "catalog" answers from the local pgvector index (see catalog_ingest.py)
+YT_SEARCH_MODE = os.environ.get("YT_SEARCH_MODE", "api")
+
+# identical searches within the TTL are answered locally instead of spending quota
+search_cache = TTLCache(
+    max_size=int(os.environ.get("YT_SEARCH_CACHE_SIZE", 2048)),
+    ttl=float(os.environ.get("YT_SEARCH_CACHE_TTL", 6 * 60 * 60)),
+)
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=YOUTUBE_API_URL,
+            params={"key": os.environ["YOUTUBE_DEV_KEY"]},
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+            timeout=10,
+        )
+    return _client
+
+
+async def aclose():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _normalize(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+async def search_catalog_videos(query: str, max_results: int = 3):
+    embedding = (await embeddings.aembed([query]))[0]
+    videos = await adb.search_videos_by_embedding(embeddings.to_pgvector(embedding), max_results)
+    return [
+        {"video_id": v.video_id, "url": v.url, "title": v.title, "description": v.description, "thumbnail_url": v.thumbnail_url}
+        for v in videos
+    ]
+
+
+async def search_youtube_videos(query: str, max_results: int = 3, channel_id: str = FCC_CHANNEL_ID, mode: Optional[str] = None):
+    if (mode or YT_SEARCH_MODE) == "catalog" and channel_id == FCC_CHANNEL_ID:
+        return await search_catalog_videos(query, max_results)
+
+    key = (_normalize(query), channel_id, max_results)
+    cached = search_cache.get(key)
+    if cached is not None:
+        return [dict(x) for x in cached]
+
+    client = get_client()
+    search_response = await client.get("/search", params={
+        "q": query,
+        "type": "video",
+        "part": "id,snippet",
+        "channelId": channel_id,
+        "maxResults": max_results,
+    })
+    search_response.raise_for_status()
+
+    video_ids = [item['id']['videoId'] for item in search_response.json().get("items", [])]
     if not video_ids:
+        search_cache.set(key, [])
         return []
 
     videos = []
-    videos_response = youtube.videos().list(
-        part="snippet",
-        id=",".join(video_ids)
-    ).execute()
-    for item in videos_response.get("items", []):
-    # for item in search_response.get("items", []):
+    videos_response = await client.get("/videos", params={"part": "snippet", "id": ",".join(video_ids)})
+    videos_response.raise_for_status()
+    for item in videos_response.json().get("items", []):
         video = {
             "video_id": item['id'],
             "url": f"https://www.youtube.com/watch?v={item['id']}",
@@ -31,4 +90,12 @@ async def search_youtube_videos(query: str, max_results: int = 3):
             "thumbnail_url": item['snippet']['thumbnails']['high']['url'],
         }
         videos.append(video)
-    return videos
+    search_cache.set(key, videos)
+    return [dict(x) for x in videos]
+
+
+async def multi_search(queries: list[str], max_results: int = 3, concurrency: int = 4, search_fn=None):
+    """
+    Search several phrasings concurrently and fuse the rankings (see search_fusion.multi_search).
+    """
+    return await search_fusion.multi_search(queries, search_fn or search_youtube_videos, max_results, concurrency)